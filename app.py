@@ -1,32 +1,661 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file
+from flask import Flask, Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, send_file, g, abort, make_response, has_request_context, has_app_context, current_app
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
 from flask_sqlalchemy import SQLAlchemy
-from flask_wtf.csrf import CSRFProtect
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_wtf.csrf import CSRFProtect, CSRFError, generate_csrf
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+from itsdangerous import URLSafeSerializer, BadSignature
+from werkzeug.datastructures import CallbackDict
 from datetime import datetime, date, timedelta
-import pandas as pd
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import glob
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import math
 import os
+import re
 import secrets
+import socket
+import sqlite3
+import statistics
+import threading
+import time
+import weakref
+import zlib
+from contextlib import contextmanager
 from functools import wraps
 from io import BytesIO
+from jinja2 import meta
+from logging.handlers import RotatingFileHandler
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.hybrid import hybrid_method, hybrid_property
+from sqlalchemy.sql.expression import FunctionElement
+
+# Settings read from the environment at import. create_app() starts from
+# these, then applies instance/config.py, then its own config argument, so a
+# deployment can keep its settings in one file shared by every worker.
+DEFAULT_CONFIG = {}
+
+# Security: every worker and node must sign with the same key. Without one in
+# the environment or instance/config.py, create_app() generates one and keeps
+# it in instance/secret_key (see instance_secret_key()).
+DEFAULT_CONFIG['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+DEFAULT_CONFIG['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-app = Flask(__name__)
+# Session security settings
+DEFAULT_CONFIG['SESSION_COOKIE_SECURE'] = os.environ.get('FLASK_ENV') == 'production'
+DEFAULT_CONFIG['SESSION_COOKIE_HTTPONLY'] = True
+DEFAULT_CONFIG['SESSION_COOKIE_SAMESITE'] = 'Lax'
+DEFAULT_CONFIG['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=8)
+
+# Where session data lives (see SESSIONS): 'database' or Flask's signed 'cookie'
+DEFAULT_CONFIG['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'database')
+
+# Seconds a user's role and ward set may be served from the in-process auth cache
+DEFAULT_CONFIG['AUTH_CACHE_TTL'] = int(os.environ.get('AUTH_CACHE_TTL', 30))
+
+# Write-behind mode for pickup completions (see WRITE-BEHIND PICKUP LOG);
+# the log directory defaults to instance/pickup_log
+DEFAULT_CONFIG['PICKUP_WRITE_BEHIND'] = os.environ.get('PICKUP_WRITE_BEHIND', 'false').lower() == 'true'
+DEFAULT_CONFIG['PICKUP_LOG_DIR'] = os.environ.get('PICKUP_LOG_DIR')
+DEFAULT_CONFIG['PICKUP_FLUSH_INTERVAL_MS'] = int(os.environ.get('PICKUP_FLUSH_INTERVAL_MS', 250))
+
+
+# ==================== DATABASE ENGINE ====================
+
+# DATABASE_URL picks the backend. SQLite (the default) is tuned for many
+# readers and one writer; PostgreSQL URLs (postgresql://...) are also
+# supported and need a driver such as psycopg2-binary installed.
+DEFAULT_DATABASE_URL = 'sqlite:///waste_collection.db'
+
+# Applied to every new SQLite connection. WAL lets admin page readers run
+# while collectors write; busy_timeout makes writers wait for the lock
+# instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024)) * -1,  # negative = KiB
+    'foreign_keys': 'ON',
+}
+
+
+def database_config(url):
+    """Return (SQLALCHEMY_DATABASE_URI, SQLALCHEMY_ENGINE_OPTIONS) for a database URL.
+
+    Pool sizes are per process: with gunicorn, size DB_POOL_SIZE to the
+    number of threads per worker, since each worker gets its own pool.
+    """
+    # Heroku-style URLs use the scheme SQLAlchemy dropped in 1.4
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+
+    options = {}
+    is_memory_sqlite = url.startswith('sqlite') and (url in ('sqlite://', 'sqlite:///') or ':memory:' in url)
+    if not is_memory_sqlite:
+        options.update({
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+            'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        })
+    if url.startswith('postgresql'):
+        options.update({
+            'pool_pre_ping': True,
+            'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        })
+    return url, options
 
-# Security: Use environment variable for secret key, generate random if not set
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///waste_collection.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# Session security settings
-app.config['SESSION_COOKIE_SECURE'] = os.environ.get('FLASK_ENV') == 'production'
-app.config['SESSION_COOKIE_HTTPONLY'] = True
-app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=8)
+DEFAULT_CONFIG['DATABASE_URL'] = os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL)
+
+# Archived pickup history (see PICKUP ARCHIVE). With SQLite it gets its own
+# file so the live database stays small; with PostgreSQL it defaults to a
+# table in the main database.
+DEFAULT_ARCHIVE_URL = 'sqlite:///pickup_archive.db'
+DEFAULT_CONFIG['ARCHIVE_DATABASE_URL'] = os.environ.get('ARCHIVE_DATABASE_URL')
+
+# Pickups in whole months older than this many days are archived; 0 turns archiving off
+DEFAULT_CONFIG['PICKUP_ARCHIVE_DAYS'] = int(os.environ.get('PICKUP_ARCHIVE_DAYS', 180))
+
+
+def configure_databases(config):
+    """Fill in the SQLAlchemy settings from DATABASE_URL and ARCHIVE_DATABASE_URL"""
+    config['SQLALCHEMY_DATABASE_URI'], config['SQLALCHEMY_ENGINE_OPTIONS'] = database_config(config['DATABASE_URL'])
+    archive_uri, archive_options = database_config(
+        config['ARCHIVE_DATABASE_URL']
+        or (DEFAULT_ARCHIVE_URL if config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite') else config['SQLALCHEMY_DATABASE_URI'])
+    )
+    config['SQLALCHEMY_BINDS'] = {'archive': {'url': archive_uri, **archive_options}}
+
+
+db = SQLAlchemy()
+csrf = CSRFProtect()
+
+# Routes are grouped by who uses them; create_app() registers all three
+main_bp = Blueprint('main', __name__)
+admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
+collector_bp = Blueprint('collector', __name__, url_prefix='/collector')
+
+
+@db.event.listens_for(db.Engine, 'connect')
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {pragma} = {value}')
+    cursor.close()
+
+
+# ==================== METRICS ====================
+
+# In-process metrics served at /metrics in the Prometheus text format.
+# Each gunicorn worker keeps its own numbers; scrape every worker or sum them.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        names = self.labels + ('le',)
+        with self._lock:
+            for label_values, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state):
+                    lines.append(f'{self.name}_bucket{_format_labels(names, label_values + (bound,))} {count}')
+                lines.append(f'{self.name}_bucket{_format_labels(names, label_values + ("+Inf",))} {state[-1]}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, label_values)} {state[-2]}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, label_values)} {state[-1]}')
+        return lines
+
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time"""
+
+    def __init__(self, name, help_text, callback):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+
+    def expose(self):
+        value = self.callback()
+        if value is None:
+            return []
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge', f'{self.name} {value}']
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Request latency by endpoint.',
+                            ['endpoint', 'method'])
+REQUEST_COUNT = Counter('http_requests_total', 'Requests by endpoint and status.',
+                        ['endpoint', 'method', 'status'])
+REQUEST_DB_QUERIES = Histogram('http_request_db_queries', 'SQL statements executed per request.',
+                               ['endpoint'], buckets=(1, 2, 5, 10, 20, 50, 100, 250, 1000))
+REQUEST_DB_TIME = Histogram('http_request_db_seconds', 'Time spent in SQL statements per request.',
+                            ['endpoint'])
+JOB_DURATION = Histogram('job_duration_seconds', 'Duration of import and export jobs.',
+                         ['job'], buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+JOB_ROWS = Counter('job_rows_total', 'Rows processed by import and export jobs.', ['job'])
+DB_LOCK_WAIT = Histogram('db_write_lock_wait_seconds',
+                         'Time taken to acquire the write lock at the first write of a transaction.')
+DB_LOCK_ERRORS = Counter('db_lock_errors_total', 'Statements that failed because the database was locked.')
+PASSWORD_HASH_TIME = Histogram('password_hash_seconds',
+                               'Time to hash or check a password, including the wait for a hashing thread.',
+                               ['operation'])
+PASSWORD_HASH_REJECTED = Counter('password_hash_rejected_total',
+                                 'Password hashes turned away because the hashing queue was full.')
+
+
+def _pool_stat(method):
+    def read():
+        pool = db.engine.pool
+        return getattr(pool, method)() if hasattr(pool, method) else None
+    return read
+
+
+METRICS = [
+    REQUEST_LATENCY, REQUEST_COUNT, REQUEST_DB_QUERIES, REQUEST_DB_TIME,
+    JOB_DURATION, JOB_ROWS, DB_LOCK_WAIT, DB_LOCK_ERRORS, PASSWORD_HASH_TIME, PASSWORD_HASH_REJECTED,
+    Gauge('db_pool_size', 'Configured connection pool size.', _pool_stat('size')),
+    Gauge('db_pool_checked_out', 'Connections currently in use.', _pool_stat('checkedout')),
+    Gauge('db_pool_overflow', 'Connections open beyond the pool size (negative while below it).', _pool_stat('overflow')),
+]
+
+
+def track_job(name):
+    """Decorator timing an import/export route; the route reports rows with count_job_rows()"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            g.job_rows = 0
+            started = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                rows = g.pop('job_rows', 0)
+                JOB_DURATION.observe(elapsed, name)
+                JOB_ROWS.inc(name, amount=rows)
+                current_app.logger.info(f'{name}: {rows} rows in {elapsed:.2f}s '
+                                f'({rows / elapsed if elapsed else 0:.0f} rows/s)')
+        return decorated_function
+    return decorator
+
+
+def count_job_rows(rows):
+    g.job_rows = g.get('job_rows', 0) + rows
+
+
+@db.event.listens_for(db.Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@db.event.listens_for(db.Engine, 'after_cursor_execute')
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+        g.db_time = g.get('db_time', 0.0) + elapsed
+        statements = g.get('sql_statements')
+        if statements is not None:
+            statements.append((statement, elapsed))
+    threshold_ms = current_app.config['SLOW_QUERY_MS'] if has_app_context() else 0
+    if threshold_ms and elapsed * 1000 >= threshold_ms:
+        record_slow_query(conn, statement, parameters, executemany, elapsed)
+
+
+@db.event.listens_for(db.Engine, 'handle_error')
+def _count_lock_errors(context):
+    conn = context.connection
+    if conn is not None and conn.info.get('query_started'):
+        conn.info['query_started'].pop()
+    if 'database is locked' in str(context.original_exception):
+        DB_LOCK_ERRORS.inc()
+
+
+@main_bp.before_app_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+def _record_request(status):
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint, request.method)
+    REQUEST_COUNT.inc(endpoint, request.method, str(status))
+    REQUEST_DB_QUERIES.observe(g.get('db_queries', 0), endpoint)
+    REQUEST_DB_TIME.observe(g.get('db_time', 0.0), endpoint)
+
+
+@main_bp.after_app_request
+def _record_response(response):
+    _record_request(response.status_code)
+    return response
+
+
+@main_bp.teardown_app_request
+def _record_failed_request(exc):
+    # Only reached with a timer still running when after_request was skipped
+    if exc is not None:
+        _record_request(500)
+
+
+# ==================== SQL PROFILER ====================
+
+# Opt-in per-request statement profiling (SQL_PROFILER=true). Statements are
+# grouped by shape, with bound values and IN-lists collapsed, and any shape
+# run more than SQL_PROFILER_REPEAT_THRESHOLD times in one request is logged
+# as a likely N+1 loop. Profiled responses carry an X-SQL-Profile header.
+# query_budget() turns the same data into a test assertion.
+
+DEFAULT_CONFIG['SQL_PROFILER'] = os.environ.get('SQL_PROFILER', 'false').lower() == 'true'
+DEFAULT_CONFIG['SQL_PROFILER_REPEAT_THRESHOLD'] = int(os.environ.get('SQL_PROFILER_REPEAT_THRESHOLD', 5))
+
+# Lists receiving a RequestProfile for every request while query_budget() is active
+_profile_captures = []
+
+RequestProfile = namedtuple('RequestProfile', ['endpoint', 'path', 'queries', 'seconds', 'repeated'])
 
-db = SQLAlchemy(app)
-csrf = CSRFProtect(app)
+_IN_LIST = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """Normalize a SQL statement so repeats with different values compare equal"""
+    shape = _LITERAL.sub('?', statement)
+    shape = _IN_LIST.sub('(?)', shape)
+    shape = re.sub(r'%\(\w+\)s(::\w+(?: \w+)*)?', '?', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+def profiling_enabled():
+    return current_app.config['SQL_PROFILER'] or bool(_profile_captures)
+
+
+@main_bp.before_app_request
+def _start_sql_profile():
+    if profiling_enabled():
+        g.sql_statements = []
+
+
+@main_bp.after_app_request
+def _finish_sql_profile(response):
+    statements = g.pop('sql_statements', None)
+    if statements is None:
+        return response
+
+    shapes = {}
+    for statement, elapsed in statements:
+        shape = statement_shape(statement)
+        count, total = shapes.get(shape, (0, 0.0))
+        shapes[shape] = (count + 1, total + elapsed)
+
+    threshold = current_app.config['SQL_PROFILER_REPEAT_THRESHOLD']
+    repeated = {shape: count for shape, (count, _) in shapes.items() if count > threshold}
+    seconds = sum(elapsed for _, elapsed in statements)
+    profile = RequestProfile(request.endpoint, request.path, len(statements), seconds, repeated)
+
+    for shape, count in repeated.items():
+        current_app.logger.warning(f'Possible N+1 in {request.endpoint}: {count}x {shape[:200]}')
+    for capture in _profile_captures:
+        capture.append(profile)
+
+    response.headers['X-SQL-Profile'] = f'queries={len(statements)}; time={seconds * 1000:.1f}ms; repeated={len(repeated)}'
+    return response
+
+
+@contextmanager
+def query_budget(max_queries, allow_repeats=True):
+    """Fail a test if any request made inside the block exceeds its query budget.
+
+    with query_budget(5):
+        client.get('/dashboard')
+
+    Raises AssertionError naming the route, its statement count and any
+    repeated statement shapes. With allow_repeats=False, a statement shape
+    above SQL_PROFILER_REPEAT_THRESHOLD also fails.
+    """
+    captured = []
+    _profile_captures.append(captured)
+    try:
+        yield captured
+    finally:
+        _profile_captures.remove(captured)
+
+    for profile in captured:
+        over_budget = profile.queries > max_queries
+        if over_budget or (profile.repeated and not allow_repeats):
+            details = '; '.join(f'{count}x {shape[:120]}' for shape, count in profile.repeated.items())
+            raise AssertionError(
+                f'{profile.path} ({profile.endpoint}) ran {profile.queries} SQL statements, '
+                f'budget {max_queries}' + (f'. Repeated: {details}' if details else '')
+            )
+
+
+# ==================== SLOW QUERY LOG ====================
+
+# Statements slower than SLOW_QUERY_MS are appended as JSON lines to a
+# rotating log with their parameter types, the route that ran them and the
+# query plan captured right then. /admin/slow-queries ranks them.
+# SLOW_QUERY_MS=0 turns the recorder off.
+#
+# Every process writes and rotates its own file next to SLOW_QUERY_LOG
+# (slow_queries-<host>-<pid>.log), since rotating one file shared by several
+# gunicorn workers loses and duplicates entries. The ranking reads them all.
+
+DEFAULT_CONFIG['SLOW_QUERY_MS'] = int(os.environ.get('SLOW_QUERY_MS', 250))
+DEFAULT_CONFIG['SLOW_QUERY_LOG'] = os.environ.get('SLOW_QUERY_LOG')  # defaults to instance/slow_queries.log
+DEFAULT_CONFIG['SLOW_QUERY_LOG_BYTES'] = int(os.environ.get('SLOW_QUERY_LOG_BYTES', 5 * 1024 * 1024))
+DEFAULT_CONFIG['SLOW_QUERY_LOG_BACKUPS'] = int(os.environ.get('SLOW_QUERY_LOG_BACKUPS', 3))
+# Logs of processes that have written nothing for this long are deleted
+DEFAULT_CONFIG['SLOW_QUERY_LOG_DAYS'] = int(os.environ.get('SLOW_QUERY_LOG_DAYS', 7))
+
+# Only statements that can be explained without side effects
+EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE')
+
+slow_query_log = logging.getLogger('dortibox.slow_queries')
+slow_query_log.setLevel(logging.INFO)
+slow_query_log.propagate = False
+_slow_query_log_pid = None
+_slow_query_log_path = None
+_slow_query_log_lock = threading.Lock()
+
+
+def slow_query_log_paths(path):
+    """Every process's slow-query log next to path, with their rotated files"""
+    base, ext = os.path.splitext(path)
+    # path itself is where every process wrote before logs were per process
+    return sorted(set(glob.glob(glob.escape(path) + '*')
+                      + glob.glob(f'{glob.escape(base)}-*{glob.escape(ext)}*')))
+
+
+def _prune_slow_query_logs(path, max_age_days):
+    """Delete the logs of processes that have written nothing for max_age_days"""
+    cutoff = time.time() - max_age_days * 86400
+    for log_path in slow_query_log_paths(path):
+        try:
+            if os.path.getmtime(log_path) < cutoff:
+                os.remove(log_path)
+        except OSError:
+            pass
+
+
+def _slow_query_handler():
+    global _slow_query_log_pid, _slow_query_log_path
+    # A forked worker must not write through its parent's handler, and a log
+    # pruned by another process while this one was idle is opened afresh
+    def stale():
+        return _slow_query_log_pid != os.getpid() or not os.path.exists(_slow_query_log_path)
+
+    if stale():
+        with _slow_query_log_lock:
+            if stale():
+                for handler in list(slow_query_log.handlers):
+                    slow_query_log.removeHandler(handler)
+                    handler.close()
+                path = current_app.config['SLOW_QUERY_LOG']
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                _prune_slow_query_logs(path, current_app.config['SLOW_QUERY_LOG_DAYS'])
+                base, ext = os.path.splitext(path)
+                _slow_query_log_path = f'{base}-{socket.gethostname()}-{os.getpid()}{ext}'
+                handler = RotatingFileHandler(
+                    _slow_query_log_path,
+                    maxBytes=current_app.config['SLOW_QUERY_LOG_BYTES'],
+                    backupCount=current_app.config['SLOW_QUERY_LOG_BACKUPS'],
+                )
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                slow_query_log.addHandler(handler)
+                _slow_query_log_pid = os.getpid()
+    return slow_query_log
+
+
+def parameter_shape(parameters, executemany=False):
+    """Types of the bound parameters, never their values"""
+    if executemany:
+        return {'rows': len(parameters), 'each': parameter_shape(parameters[0]) if parameters else None}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    return [type(value).__name__ for value in parameters or ()]
+
+
+def explain_plan(conn, statement, parameters):
+    """Ask the database how it runs statement, on the connection that just ran it"""
+    sqlite = conn.dialect.name == 'sqlite'
+    prefix = 'EXPLAIN QUERY PLAN ' if sqlite else 'EXPLAIN '
+    # A raw DBAPI cursor, so the plan query is not itself timed or logged
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        # On PostgreSQL a failed EXPLAIN would abort the caller's transaction
+        if not sqlite:
+            cursor.execute('SAVEPOINT explain_slow_query')
+        try:
+            cursor.execute(prefix + statement, parameters)
+            rows = cursor.fetchall()
+        except Exception as e:
+            if not sqlite:
+                cursor.execute('ROLLBACK TO SAVEPOINT explain_slow_query')
+            return [f'unavailable: {e}']
+        if not sqlite:
+            cursor.execute('RELEASE SAVEPOINT explain_slow_query')
+    finally:
+        cursor.close()
+    # SQLite rows are (id, parent, notused, detail); PostgreSQL rows are one text column
+    return [row[-1] for row in rows]
+
+
+def record_slow_query(conn, statement, parameters, executemany, elapsed):
+    plan = None
+    if not executemany and statement.lstrip().upper().startswith(EXPLAINABLE):
+        plan = explain_plan(conn, statement, parameters)
+    entry = {
+        'at': datetime.now().isoformat(timespec='seconds'),
+        'ms': round(elapsed * 1000, 1),
+        'route': request.endpoint if has_request_context() else None,
+        'statement': statement,
+        'shape': statement_shape(statement),
+        'params': parameter_shape(parameters, executemany),
+        'plan': plan,
+    }
+    try:
+        _slow_query_handler().info(json.dumps(entry, default=str))
+    except OSError as e:
+        current_app.logger.warning(f'Could not write slow query log: {e}')
+
+
+def slow_query_offenders(limit=25):
+    """Aggregate every process's slow-query log (including rotated files) by statement shape"""
+    offenders = {}
+    for log_path in slow_query_log_paths(current_app.config['SLOW_QUERY_LOG']):
+        try:
+            f = open(log_path, encoding='utf-8')
+        except OSError:
+            # Rotated or pruned since it was listed
+            continue
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                offender = offenders.setdefault(entry['shape'], {
+                    'shape': entry['shape'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'routes': set(),
+                })
+                offender['count'] += 1
+                offender['total_ms'] += entry['ms']
+                offender['max_ms'] = max(offender['max_ms'], entry['ms'])
+                offender['routes'].add(entry['route'] or 'background')
+                # Keep the plan of the latest entry across all processes
+                if entry['at'] >= offender.get('last_seen', ''):
+                    offender['last_seen'] = entry['at']
+                    offender['params'] = entry['params']
+                    offender['plan'] = entry['plan']
+    ranked = sorted(offenders.values(), key=lambda o: o['total_ms'], reverse=True)
+    for offender in ranked:
+        offender['routes'] = sorted(offender['routes'])
+        offender['avg_ms'] = offender['total_ms'] / offender['count']
+    return ranked[:limit]
+
+
+# /metrics needs this token outside debug mode. Behind a reverse proxy on the
+# same host every request comes from 127.0.0.1, so the address proves nothing;
+# only a debug server answers without one, and only unproxied local requests.
+DEFAULT_CONFIG['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')
+PROXY_HEADERS = ('X-Forwarded-For', 'X-Real-IP', 'Forwarded')
+
+
+@main_bp.route('/metrics')
+def metrics():
+    """Prometheus text exposition of this process's metrics"""
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                                   f'Bearer {token}'.encode('utf-8')):
+            abort(401)
+    elif not current_app.debug or request.remote_addr not in LOOPBACK_ADDRESSES or \
+            any(header in request.headers for header in PROXY_HEADERS):
+        abort(403)
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+@main_bp.route('/healthz')
+def healthz():
+    """Liveness check that also measures database round-trip latency"""
+    started = time.perf_counter()
+    try:
+        db.session.execute(db.text('SELECT 1'))
+    except Exception:
+        current_app.logger.exception('Health check could not reach the database')
+        return jsonify({'status': 'error', 'database': 'unavailable'}), 503
+    latency_ms = (time.perf_counter() - started) * 1000
+    return jsonify({'status': 'ok', 'db_latency_ms': round(latency_ms, 2)})
 
 # Make datetime and abs available in templates
-@app.context_processor
+@main_bp.app_context_processor
 def inject_now():
     return {
         'now': datetime.now,
@@ -35,6 +664,113 @@ def inject_now():
 
 # ==================== DATABASE MODELS ====================
 
+class days_between(FunctionElement):
+    """Whole days from the second date to the first, as SQL: days_between(later, earlier)"""
+    type = db.Integer()
+    name = 'days_between'
+    inherit_cache = True
+
+
+@compiles(days_between, 'sqlite')
+def _days_between_sqlite(element, compiler, **kw):
+    later, earlier = [compiler.process(arg, **kw) for arg in element.clauses]
+    return f'CAST(julianday({later}) - julianday({earlier}) AS INTEGER)'
+
+
+@compiles(days_between)
+def _days_between_default(element, compiler, **kw):
+    # PostgreSQL: date - date is an integer number of days
+    later, earlier = [compiler.process(arg, **kw) for arg in element.clauses]
+    return f'({later} - {earlier})'
+
+
+# One bin size: "240L", "120 Liters", "2 x 120L", "1.1m3" or a bare number of litres
+BIN_SIZE_PATTERN = re.compile(
+    r'^(?:(\d+)\s*[x×*]\s*)?(\d+(?:\.\d+)?)\s*(l|lt|ltr|ltrs|litres?|liters?|m3|m³)?(?:\s*[x×*]\s*(\d+))?$'
+)
+
+
+def parse_bin_litres(bin_size):
+    """Total litres of the bins listed in text like "300L, 50L", or None if any part can't be read"""
+    if not bin_size or not str(bin_size).strip():
+        return None
+    total = 0.0
+    for part in re.split(r'[,+&/;]| and ', str(bin_size).lower()):
+        part = part.strip()
+        if not part:
+            continue
+        match = BIN_SIZE_PATTERN.match(part)
+        if not match:
+            return None
+        count_before, size, unit, count_after = match.groups()
+        litres = float(size) * (1000 if unit in ('m3', 'm³') else 1)
+        total += litres * int(count_before or 1) * int(count_after or 1)
+    return round(total) or None
+
+
+def bin_volumes(bin_size, bin_qty):
+    """Return (bin_litres, pickup_litres) for a customer's bin_size text and bin_qty"""
+    bin_litres = parse_bin_litres(bin_size)
+    if bin_litres is None:
+        return None, None
+    return bin_litres, bin_litres * (1 if bin_qty is None else bin_qty)
+
+
+WEEKDAY_COLUMNS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday')
+
+# Biweekly customers without an anchor date count their weeks from this Monday
+RECURRENCE_EPOCH = date(2024, 1, 1)
+
+ORDINAL_WEEKS = {'first': 1, '1st': 1, 'second': 2, '2nd': 2, 'third': 3, '3rd': 3,
+                 'fourth': 4, '4th': 4, 'last': -1}
+
+
+def parse_frequency(frequency, anchor=None):
+    """Return (recurrence, recurrence_weeks) for the Frequency text of a customer.
+
+    "Every 2 weeks", "biweekly", "fortnightly" or "every other week" is
+    'biweekly'. Text mentioning a month is 'monthly', on the weeks of the
+    month it names ("1st and 3rd", "last"); otherwise "2(month)" or "twice a
+    month" means the 1st and 3rd, "3 per month" the first three, and once a
+    month the week the anchor date falls in. Anything else, including the
+    plain pickups-per-week counts, is 'weekly'.
+    """
+    text = (frequency or '').lower()
+    if re.search(r'bi-?weekly|fortnight|every\s+(2|two|other)\s+weeks?|alternate\s+weeks?', text):
+        return 'biweekly', None
+    if 'month' not in text:
+        return 'weekly', None
+
+    weeks = {week for word, week in ORDINAL_WEEKS.items() if re.search(rf'\b{word}\b', text)}
+    if not weeks:
+        count = re.match(r'\s*(\d+)', text)
+        count = int(count.group(1)) if count else 2 if 'twice' in text else 1
+        if count >= 4:
+            return 'weekly', None
+        if count > 1:
+            weeks = {1, 3} if count == 2 else {1, 2, 3}
+        else:
+            nth = (anchor.day - 1) // 7 + 1 if anchor else 1
+            weeks = {nth if nth < 5 else -1}
+    return 'monthly', ','.join(str(week) for week in sorted(weeks, key=lambda week: week % 6))
+
+
+def is_due(customer, day):
+    """Whether a customer (or a row with its schedule columns) has a pickup on day"""
+    column = day.strftime('%A').lower()
+    if column not in WEEKDAY_COLUMNS or getattr(customer, column) != 1:
+        return False
+    if customer.recurrence == 'biweekly':
+        anchor = customer.schedule_anchor or RECURRENCE_EPOCH
+        weeks = ((day - timedelta(days=day.weekday())) - (anchor - timedelta(days=anchor.weekday()))).days // 7
+        return weeks % 2 == 0
+    if customer.recurrence == 'monthly':
+        weeks = {int(week) for week in (customer.recurrence_weeks or '1').split(',')}
+        is_last = (day + timedelta(days=7)).month != day.month
+        return (day.day - 1) // 7 + 1 in weeks or (is_last and -1 in weeks)
+    return True
+
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -45,10 +781,10 @@ class User(db.Model):
     assigned_wards = db.relationship('CollectorWard', backref='user', lazy=True, cascade='all, delete-orphan')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = current_app.extensions['password_hasher'].hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return current_app.extensions['password_hasher'].check(self.password_hash, password)
 
     def get_ward_names(self):
         return [cw.ward for cw in self.assigned_wards]
@@ -59,12 +795,22 @@ class Customer(db.Model):
     customer_number = db.Column(db.Integer)
     customer_name = db.Column(db.String(200), nullable=False)
     address = db.Column(db.String(300))
+    # Optional, in decimal degrees; used to order collector routes
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
     phone_number = db.Column(db.String(50))
     type = db.Column(db.String(100))
-    ward = db.Column(db.String(100))
+    ward = db.Column(db.String(100), index=True)
     bin_size = db.Column(db.String(50))  # Now stores multiple sizes like "300L, 50L"
     bin_qty = db.Column(db.Integer)
+    # Parsed from bin_size and bin_qty whenever either is set; None when bin_size can't be read
+    bin_litres = db.Column(db.Integer)  # one set of the listed bins
+    pickup_litres = db.Column(db.Integer)  # bin_litres x bin_qty, collected per pickup
     frequency = db.Column(db.String(50))
+    # Parsed from frequency and schedule_anchor whenever either is set, see parse_frequency()
+    recurrence = db.Column(db.String(20), default='weekly')  # weekly, biweekly or monthly
+    recurrence_weeks = db.Column(db.String(20))  # weeks of the month for monthly, e.g. "1,3" or "-1" (last)
+    schedule_anchor = db.Column(db.Date)  # a pickup date that fixes which weeks biweekly and monthly use
     time = db.Column(db.String(50))
     
     monday = db.Column(db.Integer, default=0)
@@ -83,17 +829,59 @@ class Customer(db.Model):
     target_month_end = db.Column(db.Date)
     month_acquired = db.Column(db.String(50))
     amount_paid = db.Column(db.Float)
+
+    # Bumped on every insert/update, see CHANGE TRACKING below
+    change_seq = db.Column(db.Integer, nullable=False, default=0, index=True)
+    # Whether the customer gets pickups today; kept current by the EXPIRY SWEEP below
+    serviceable = db.Column(db.Boolean, nullable=False, default=True)
     
     pickups = db.relationship('Pickup', backref='customer', lazy=True, cascade='all, delete-orphan')
+
+    __table_args__ = (db.Index('ix_customer_serviceable_ward', 'serviceable', 'ward'),)
+
+    @db.validates('bin_size', 'bin_qty')
+    def _update_bin_volumes(self, key, value):
+        self.bin_litres, self.pickup_litres = bin_volumes(
+            value if key == 'bin_size' else self.bin_size,
+            value if key == 'bin_qty' else self.bin_qty
+        )
+        return value
+
+    @db.validates('frequency', 'schedule_anchor')
+    def _update_recurrence(self, key, value):
+        self.recurrence, self.recurrence_weeks = parse_frequency(
+            value if key == 'frequency' else self.frequency,
+            value if key == 'schedule_anchor' else self.schedule_anchor
+        )
+        return value
+
+    def due_on(self, day):
+        """Whether the weekday flags and recurrence put a pickup on day"""
+        return is_due(self, day)
+
+    @hybrid_method
+    def serviceable_on(self, day):
+        """Whether the customer is active with a subscription running on the given day"""
+        return (self.active in ('Yes', 'yes')
+                and (self.subscription_end is None or self.subscription_end >= day))
+
+    @serviceable_on.expression
+    def serviceable_on(cls, day):
+        return db.and_(
+            cls.active.in_(['Yes', 'yes']),
+            db.or_(cls.subscription_end.is_(None), cls.subscription_end >= day)
+        )
     
+    @hybrid_property
     def subscription_status(self):
-        """Return subscription status"""
-        if not self.subscription_end:
+        """Return subscription status: no_date, expired, expiring_week, expiring_month or active.
+
+        Also a SQL expression, so it can be selected, sorted and grouped on
+        alongside the customer instead of being worked out per row.
+        """
+        days_until_end = self.days_until_expiry
+        if days_until_end is None:
             return 'no_date'
-        
-        today = date.today()
-        days_until_end = (self.subscription_end - today).days
-        
         if days_until_end < 0:
             return 'expired'
         elif days_until_end <= 7:
@@ -102,13 +890,47 @@ class Customer(db.Model):
             return 'expiring_month'
         else:
             return 'active'
-    
+
+    @subscription_status.expression
+    def subscription_status(cls):
+        today = date.today()
+        return db.case(
+            (cls.subscription_end.is_(None), 'no_date'),
+            (cls.subscription_end < today, 'expired'),
+            (cls.subscription_end <= today + timedelta(days=7), 'expiring_week'),
+            (cls.subscription_end <= today + timedelta(days=30), 'expiring_month'),
+            else_='active'
+        )
+
+    @hybrid_property
     def days_until_expiry(self):
-        """Return days until expiry"""
+        """Return days until expiry (negative once expired), or None without an end date"""
         if not self.subscription_end:
             return None
         return (self.subscription_end - date.today()).days
 
+    @days_until_expiry.expression
+    def days_until_expiry(cls):
+        return days_between(cls.subscription_end, db.literal(date.today(), db.Date))
+
+    @classmethod
+    def subscription_filter(cls, name):
+        """Conditions for the customer list's subscription filter, as plain ranges on subscription_end.
+
+        Unlike filtering on subscription_status these can use an index, and
+        the "expiring" filters include everything up to their horizon.
+        """
+        today = date.today()
+        if name == 'expired':
+            return [cls.subscription_end < today]
+        if name == 'expiring_week':
+            return [cls.subscription_end >= today, cls.subscription_end <= today + timedelta(days=7)]
+        if name == 'expiring_month':
+            return [cls.subscription_end >= today, cls.subscription_end <= today + timedelta(days=30)]
+        if name == 'no_date':
+            return [cls.subscription_end.is_(None)]
+        return []
+
 
 class CollectorWard(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -126,16 +948,375 @@ class Pickup(db.Model):
     completed_at = db.Column(db.DateTime)
     completed_by = db.Column(db.String(100))
     notes = db.Column(db.Text)
+    change_seq = db.Column(db.Integer, nullable=False, default=0, index=True)
+    # The customer's ward when the pickup was created. Completion rollups are
+    # keyed on it, so a customer moving ward doesn't move their history.
+    ward = db.Column(db.String(100))
+
+    __table_args__ = (db.Index('ix_pickup_date_customer', 'pickup_date', 'customer_id'),)
+
+
+class ArchivedPickup(db.Model):
+    """A pickup moved out of the live table by archive_pickups(); keeps its original id"""
+    __bind_key__ = 'archive'
+    __tablename__ = 'pickup_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    # No foreign key: the archive lives in its own database and outlives deleted customers
+    customer_id = db.Column(db.Integer, nullable=False)
+    pickup_date = db.Column(db.Date, nullable=False)
+    completed = db.Column(db.Boolean, default=False)
+    completed_at = db.Column(db.DateTime)
+    completed_by = db.Column(db.String(100))
+    notes = db.Column(db.Text)
+    # Pickup.ward, copied so rebuilt rollups keep the ward the pickup was made under
+    ward = db.Column(db.String(100))
+
+    __table_args__ = (
+        db.Index('ix_pickup_archive_date_customer', 'pickup_date', 'customer_id'),
+        db.Index('ix_pickup_archive_customer_date', 'customer_id', 'pickup_date'),
+    )
+
+
+class PickupMonthSummary(db.Model):
+    """Per-customer monthly totals left behind in the live database for archived pickups"""
+    customer_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.Date, primary_key=True)  # first day of the month
+    scheduled = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    last_completed_at = db.Column(db.DateTime)
+
+
+class CompletionRollup(db.Model):
+    """Pickup counts per day, ward and collector, kept current by COMPLETION ROLLUPS.
+
+    Pending pickups count under collector ''; completing one moves it to
+    the collector who completed it.
+    """
+    day = db.Column(db.Date, primary_key=True)
+    ward = db.Column(db.String(100), primary_key=True)
+    collector = db.Column(db.String(100), primary_key=True)
+    pickups = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RoutePaceDay(db.Model):
+    """Cached pace of one collector's finished day (see ROUTE PACE).
+
+    A row with collector '' marks a day that was computed and had no
+    completions, so it is not recomputed on every view.
+    """
+    day = db.Column(db.Date, primary_key=True)
+    collector = db.Column(db.String(100), primary_key=True)
+    stops = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    median_gap_seconds = db.Column(db.Float)
+    slow_stops = db.Column(db.Integer, nullable=False, default=0)
+    idle_gaps = db.Column(db.Integer, nullable=False, default=0)
+    idle_seconds = db.Column(db.Float, nullable=False, default=0)
+    flags = db.Column(db.Text)  # JSON list of slow stops and idle gaps
+
+    @property
+    def active_seconds(self):
+        if not self.started_at or not self.finished_at:
+            return 0
+        return max((self.finished_at - self.started_at).total_seconds() - self.idle_seconds, 0)
+
+    @property
+    def stops_per_hour(self):
+        return round(self.stops / (self.active_seconds / 3600), 1) if self.active_seconds else None
+
+    def flag_list(self):
+        return json.loads(self.flags) if self.flags else []
+
+
+class PickupLogCheckpoint(db.Model):
+    """How far each write-behind pickup log has been applied to the database"""
+    log_name = db.Column(db.String(200), primary_key=True)
+    offset = db.Column(db.Integer, nullable=False, default=0)
+
+
+class PickupOccurrence(db.Model):
+    """A customer due a pickup on a day, precomputed for the schedule horizon, see SCHEDULE OCCURRENCES"""
+    day = db.Column(db.Date, primary_key=True)
+    # No foreign key: rows are removed with their customer by the code that deletes it
+    customer_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+
+class OccurrenceDay(db.Model):
+    """A day whose occurrences are all in PickupOccurrence"""
+    day = db.Column(db.Date, primary_key=True)
+
+
+class RouteOrder(db.Model):
+    """Cached stop order for one ward on one weekday, see ROUTE ORDERING"""
+    ward = db.Column(db.String(100), primary_key=True)
+    weekday = db.Column(db.String(10), primary_key=True)
+    # Hash of the stops and coordinates the order was built from
+    signature = db.Column(db.String(40), nullable=False)
+    customer_ids = db.Column(db.Text, nullable=False)  # JSON list, in driving order
+    built_at = db.Column(db.DateTime, nullable=False)
+
+
+class ServiceabilityChange(db.Model):
+    """Audit log of customers going in or out of service, used for renewal follow-up"""
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: the log outlives deleted customers
+    customer_id = db.Column(db.Integer, nullable=False, index=True)
+    changed_at = db.Column(db.DateTime, nullable=False, index=True)
+    serviceable = db.Column(db.Boolean, nullable=False)
+    reason = db.Column(db.String(50), nullable=False)  # subscription_lapsed or customer_updated
+    subscription_end = db.Column(db.Date)
+
+
+class ExpirySweepRun(db.Model):
+    """One row per day the expiry sweep has run"""
+    day = db.Column(db.Date, primary_key=True)
+    ran_at = db.Column(db.DateTime, nullable=False)
+    lapsed = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ChangeCounter(db.Model):
+    """Single-row counter handing out change sequence numbers"""
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UserSession(db.Model):
+    """Server-side session data, keyed by the random id in the session cookie, see SESSIONS"""
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+# ==================== CHANGE TRACKING ====================
+
+# Every transaction that writes a Customer or Pickup takes one number from
+# ChangeCounter and stamps it on the rows it touches. Incrementing the counter
+# row takes the write lock until commit, so numbers become visible in commit
+# order and "change_seq > cursor" never skips a change.
+
+def next_change_seq():
+    """Return the change sequence number for the current transaction"""
+    seq = db.session.info.get('change_seq')
+    if seq is None:
+        stmt = db.update(ChangeCounter).where(ChangeCounter.id == 1).values(value=ChangeCounter.value + 1)
+        # This is the transaction's first write, so its duration is the wait for the write lock
+        started = time.perf_counter()
+        if db.session.get_bind().dialect.update_returning:
+            seq = db.session.execute(stmt.returning(ChangeCounter.value)).scalar()
+        elif db.session.execute(stmt).rowcount:
+            seq = db.session.execute(db.select(ChangeCounter.value).where(ChangeCounter.id == 1)).scalar()
+        DB_LOCK_WAIT.observe(time.perf_counter() - started)
+        if seq is None:
+            db.session.execute(db.insert(ChangeCounter).values(id=1, value=1))
+            seq = 1
+        db.session.info['change_seq'] = seq
+    return seq
+
+
+def current_change_seq():
+    """Return the latest committed change sequence number"""
+    return db.session.execute(db.select(ChangeCounter.value).where(ChangeCounter.id == 1)).scalar() or 0
+
+
+@db.event.listens_for(db.session, 'before_flush')
+def _stamp_change_seq(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, (Customer, Pickup)) and (obj in session.new or session.is_modified(obj)):
+            obj.change_seq = next_change_seq()
+
+
+@db.event.listens_for(db.session, 'after_commit')
+@db.event.listens_for(db.session, 'after_rollback')
+def _reset_change_seq(session):
+    session.info.pop('change_seq', None)
+
+
+# ==================== PASSWORD HASHING ====================
+
+# Hashing a password is deliberately slow: werkzeug's default scrypt takes
+# tens of milliseconds and 32 MB. When every collector logs in at the start of
+# a shift, hashes would otherwise occupy every request thread at once. Each
+# process therefore hashes on at most PASSWORD_HASH_THREADS threads, with up
+# to PASSWORD_HASH_QUEUE more waiting; past that a login is refused with 503
+# and asked to retry. Kept together below gunicorn's threads per worker, they
+# leave every worker a thread for other requests during a login storm
+# (benchmarks/bench_login.py). PASSWORD_HASH_METHOD takes werkzeug's method strings
+# (scrypt:n:r:p or pbkdf2:hash:iterations). A stored hash made with other
+# parameters is replaced on the user's next successful login.
+
+DEFAULT_CONFIG['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+DEFAULT_CONFIG['PASSWORD_HASH_THREADS'] = int(os.environ.get('PASSWORD_HASH_THREADS', 1))
+DEFAULT_CONFIG['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE', 2))
+
+# Seconds a refused client is asked to wait before retrying
+PASSWORD_HASH_RETRY_AFTER = 1
+
+
+class PasswordHashBusy(Exception):
+    """Raised when the hashing queue is full"""
+
+
+def normalize_hash_method(method):
+    """Return method with werkzeug's defaults filled in, as it is written into a stored hash"""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f'scrypt:{n}:{r}:{p}'
+    if name == 'pbkdf2' and len(args) <= 2:
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    raise ValueError(f'Invalid PASSWORD_HASH_METHOD {method!r}')
+
+
+class PasswordHasher:
+    def __init__(self, method, threads, queue):
+        self.method = normalize_hash_method(method)
+        self.threads = threads
+        self._slots = threading.BoundedSemaphore(threads + queue)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _run(self, operation, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            PASSWORD_HASH_REJECTED.inc()
+            raise PasswordHashBusy()
+        started = time.perf_counter()
+        try:
+            # A forked worker starts its own threads; the parent's don't exist in it
+            if self._pid != os.getpid():
+                with self._lock:
+                    if self._pid != os.getpid():
+                        self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix='password-hash')
+                        self._pid = os.getpid()
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+            PASSWORD_HASH_TIME.observe(time.perf_counter() - started, operation)
+
+    def hash(self, password):
+        return self._run('hash', generate_password_hash, password, self.method)
+
+    def check(self, password_hash, password):
+        return self._run('check', check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if password_hash was made with other parameters than the configured ones"""
+        return password_hash.split('$', 1)[0] != self.method
+
+
+@main_bp.app_errorhandler(PasswordHashBusy)
+def password_hash_busy(e):
+    # Setting a password (change password, add user) while logins fill the queue
+    response = make_response('Too many passwords are being checked right now. Please try again in a few seconds.', 503)
+    response.headers['Retry-After'] = str(PASSWORD_HASH_RETRY_AFTER)
+    return response
 
 
 # ==================== AUTHENTICATION ====================
 
+# Read-only snapshot of the logged-in user used for authorization checks.
+# Routes that modify the user (e.g. change_password) still load the User model.
+AuthUser = namedtuple('AuthUser', ['id', 'username', 'role', 'full_name', 'wards'])
+
+# app.extensions['user_cache'] maps user_id -> (expires_at, AuthUser). Shared
+# across requests to that app in this process; entries are dropped by
+# invalidate_user_cache() when an admin edits or deletes the user, and
+# otherwise expire after AUTH_CACHE_TTL seconds.
+_user_cache_lock = threading.Lock()
+
+
+def _load_auth_user(user_id):
+    """Load a user and their ward set in a single query"""
+    rows = db.session.query(
+        User.id, User.username, User.role, User.full_name, CollectorWard.ward
+    ).outerjoin(CollectorWard, CollectorWard.user_id == User.id).filter(User.id == user_id).all()
+
+    if not rows:
+        return None
+
+    first = rows[0]
+    wards = frozenset(row.ward for row in rows if row.ward)
+    return AuthUser(first.id, first.username, first.role, first.full_name, wards)
+
+
+def invalidate_user_cache(user_id):
+    """Drop a user from the auth cache so the next request reloads them"""
+    with _user_cache_lock:
+        current_app.extensions['user_cache'].pop(user_id, None)
+
+
+def _role_signer():
+    return URLSafeSerializer(current_app.secret_key, salt='role-claim')
+
+
+def set_role_claim(user):
+    """Store a signed (user_id, role) claim in the session"""
+    session['role'] = user.role
+    session['role_claim'] = _role_signer().dumps([user.id, user.role])
+
+
+def get_role_claim():
+    """Return the role from the session's signed claim, or None if missing or invalid"""
+    claim = session.get('role_claim')
+    if not claim:
+        return None
+    try:
+        user_id, role = _role_signer().loads(claim)
+    except (BadSignature, ValueError, TypeError):
+        return None
+    if user_id != session.get('user_id'):
+        return None
+    return role
+
+
+def get_current_user():
+    """Return the AuthUser for this request.
+
+    Loaded at most once per request (kept on flask.g) and served from the
+    cross-request cache while fresh, so authorization checks normally cost
+    no queries. Returns None if nobody is logged in or the user was deleted.
+    """
+    if 'current_user' in g:
+        return g.current_user
+
+    user_id = session.get('user_id')
+    user = None
+
+    if user_id is not None:
+        now = time.monotonic()
+        user_cache = current_app.extensions['user_cache']
+        with _user_cache_lock:
+            cached = user_cache.get(user_id)
+        if cached and cached[0] > now:
+            user = cached[1]
+        else:
+            user = _load_auth_user(user_id)
+            if user is not None:
+                with _user_cache_lock:
+                    user_cache[user_id] = (now + current_app.config['AUTH_CACHE_TTL'], user)
+
+        # Keep the session claim in step with the user's current role
+        if user is not None and get_role_claim() != user.role:
+            set_role_claim(user)
+
+    g.current_user = user
+    return user
+
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             flash('Please log in to access this page.', 'warning')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
+        if get_current_user() is None:
+            session.clear()
+            flash('Please log in to access this page.', 'warning')
+            return redirect(url_for('main.login'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -145,49 +1326,184 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             flash('Please log in to access this page.', 'warning')
-            return redirect(url_for('login'))
-        user = User.query.get(session['user_id'])
+            return redirect(url_for('main.login'))
+        # A signed non-admin claim is rejected without touching the cache or DB.
+        # An admin claim is still confirmed against the cached user so that
+        # demotions and deletions take effect.
+        if get_role_claim() not in (None, 'admin'):
+            flash('You do not have permission to access this page.', 'danger')
+            return redirect(url_for('main.dashboard'))
+        user = get_current_user()
+        if user is None:
+            session.clear()
+            flash('Please log in to access this page.', 'warning')
+            return redirect(url_for('main.login'))
         if user.role != 'admin':
             flash('You do not have permission to access this page.', 'danger')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('main.dashboard'))
         return f(*args, **kwargs)
     return decorated_function
 
 
+# ==================== SESSIONS ====================
+
+# With SESSION_BACKEND=database (the default) the session cookie carries only
+# a random id and the data lives in UserSession, so every worker on every
+# node sees the same session and logging out ends it everywhere. A row is
+# rewritten when the session changes, or at most every SESSION_TOUCH_SECONDS
+# to keep an active session alive; it lapses after PERMANENT_SESSION_LIFETIME
+# without activity. A login issues a new id. Reads and writes use their own
+# connection, so they never commit or roll back the request's work.
+
+DEFAULT_CONFIG['SESSION_TOUCH_SECONDS'] = int(os.environ.get('SESSION_TOUCH_SECONDS', 300))
+
+# Lapsed rows are deleted by the first session write after this many seconds
+SESSION_PURGE_SECONDS = 600
+
+
+def instance_secret_key(instance_path):
+    """Return the key kept in instance/secret_key, creating it on first use.
+
+    The key is written to a temporary file and linked into place, so
+    workers starting at the same moment all end up with the one that won.
+    """
+    path = os.path.join(instance_path, 'secret_key')
+    if not os.path.exists(path):
+        os.makedirs(instance_path, exist_ok=True)
+        temp = f'{path}.{os.getpid()}'
+        fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(temp, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(temp)
+    with open(path) as f:
+        return f.read().strip()
+
+
+class DatabaseSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        # Whose session this was when loaded; a different user_id on save means a login
+        self.opened_user_id = self.get('user_id')
+        self.modified = False
+
+
+class DatabaseSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            with db.engine.connect() as conn:
+                row = conn.execute(db.select(UserSession.data, UserSession.expires_at).where(
+                    UserSession.id == sid, UserSession.expires_at > datetime.now()
+                )).first()
+            if row is not None:
+                return DatabaseSession(self.serializer.loads(row.data), sid, row.expires_at)
+        return DatabaseSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        response.vary.add('Cookie')
+
+        if not session:
+            if session.sid is not None:
+                with db.engine.begin() as conn:
+                    conn.execute(db.delete(UserSession).where(UserSession.id == session.sid))
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+            return
+
+        now = datetime.now()
+        lifetime = app.permanent_session_lifetime
+        new_id = session.sid is None or session.get('user_id') != session.opened_user_id
+        stale = session.expires_at is None or \
+            session.expires_at - lifetime + timedelta(seconds=app.config['SESSION_TOUCH_SECONDS']) <= now
+        if not (new_id or session.modified or stale):
+            return
+
+        old_sid = session.sid
+        if new_id:
+            session.sid = secrets.token_urlsafe(32)
+        with db.engine.begin() as conn:
+            if new_id and old_sid is not None:
+                conn.execute(db.delete(UserSession).where(UserSession.id == old_sid))
+            stmt = UPSERTS[conn.dialect.name](UserSession.__table__).values(
+                id=session.sid, data=self.serializer.dumps(dict(session)), expires_at=now + lifetime
+            )
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=['id'], set_={'data': stmt.excluded.data, 'expires_at': stmt.excluded.expires_at}
+            ))
+            if time.monotonic() - app.extensions['sessions_purged_at'] > SESSION_PURGE_SECONDS:
+                conn.execute(db.delete(UserSession).where(UserSession.expires_at <= now))
+                app.extensions['sessions_purged_at'] = time.monotonic()
+
+        if new_id or session.permanent:
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=httponly, domain=domain, path=path, secure=secure, samesite=samesite)
+
+
 # ==================== ROUTES ====================
 
-@app.route('/')
+@main_bp.route('/')
 def index():
     if 'user_id' in session:
-        return redirect(url_for('dashboard'))
-    return redirect(url_for('login'))
+        return redirect(url_for('main.dashboard'))
+    return redirect(url_for('main.login'))
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@main_bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
         
         user = User.query.filter_by(username=username).first()
-        
-        if user and user.check_password(password):
+
+        try:
+            authenticated = user is not None and user.check_password(password)
+        except PasswordHashBusy:
+            flash('Too many people are signing in right now. Please try again in a few seconds.', 'warning')
+            response = make_response(render_template('login.html'), 503)
+            response.headers['Retry-After'] = str(PASSWORD_HASH_RETRY_AFTER)
+            return response
+
+        if authenticated:
+            if current_app.extensions['password_hasher'].needs_rehash(user.password_hash):
+                try:
+                    user.set_password(password)
+                    db.session.commit()
+                except PasswordHashBusy:
+                    pass  # Rehashed on a later login instead
             session['user_id'] = user.id
             session['username'] = user.username
-            session['role'] = user.role
+            set_role_claim(user)
             flash(f'Welcome back, {user.full_name or user.username}!', 'success')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('main.dashboard'))
         else:
             flash('Invalid username or password.', 'danger')
     
     return render_template('login.html')
 
 
-@app.route('/logout')
+@main_bp.route('/logout')
 def logout():
     session.clear()
     flash('You have been logged out.', 'info')
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 def validate_password(password):
     """Validate password meets security requirements. Returns (is_valid, error_message)."""
@@ -200,7 +1516,7 @@ def validate_password(password):
     return True, None
 
 
-@app.route('/change-password', methods=['GET', 'POST'])
+@main_bp.route('/change-password', methods=['GET', 'POST'])
 @login_required
 def change_password():
     if request.method == 'POST':
@@ -222,14 +1538,14 @@ def change_password():
                 user.set_password(new_password)
                 db.session.commit()
                 flash('Password changed successfully!', 'success')
-                return redirect(url_for('dashboard'))
+                return redirect(url_for('main.dashboard'))
 
     return render_template('change_password.html')
 
-@app.route('/dashboard')
+@main_bp.route('/dashboard')
 @login_required
 def dashboard():
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     
     if user.role == 'admin':
         total_customers = Customer.query.count()
@@ -237,20 +1553,12 @@ def dashboard():
             (Customer.active == 'Yes') | (Customer.active == 'yes')
         ).count()
         
-        # Count expiring subscriptions
+        # Expiring and expired subscriptions, counted in one pass
         today = date.today()
-        thirty_days = today + timedelta(days=30)
-        expiring_soon = Customer.query.filter(
-            Customer.subscription_end.isnot(None),
-            Customer.subscription_end <= thirty_days,
-            Customer.subscription_end >= today
-        ).count()
-        
-        # Count expired subscriptions
-        expired = Customer.query.filter(
-            Customer.subscription_end.isnot(None),
-            Customer.subscription_end < today
-        ).count()
+        status = Customer.subscription_status
+        status_counts = dict(db.session.query(status, db.func.count(Customer.id)).group_by(status).all())
+        expiring_soon = status_counts.get('expiring_week', 0) + status_counts.get('expiring_month', 0)
+        expired = status_counts.get('expired', 0)
         
         # Today's pickups
         day_name = today.strftime('%A').lower()
@@ -268,17 +1576,8 @@ def dashboard():
         completed_pickups = 0
         
         if day_column is not None:
-            # Only count active customers with non-expired subscriptions
-            today_date = date.today()
-            customers_today = Customer.query.filter(
-                day_column == 1,
-                (Customer.active == 'Yes') | (Customer.active == 'yes'),
-                db.or_(
-                    Customer.subscription_end.is_(None),  # No end date
-                    Customer.subscription_end >= today_date  # Or not expired
-                )
-            ).all()
-            today_pickups = len(customers_today)
+            # Only count customers due and in service today
+            today_pickups = Customer.query.filter(*scheduled_filter(today), *serviceable_filter(today)).count()
             
             completed_pickups = Pickup.query.filter(
                 Pickup.pickup_date == today,
@@ -294,82 +1593,26 @@ def dashboard():
                              expired=expired)
     else:
         today = date.today()
-        day_name = today.strftime('%A').lower()
-
-        day_column_map = {
-            'monday': Customer.monday,
-            'tuesday': Customer.tuesday,
-            'wednesday': Customer.wednesday,
-            'thursday': Customer.thursday,
-            'friday': Customer.friday,
-            'saturday': Customer.saturday
-        }
-
-        day_column = day_column_map.get(day_name)
-        pickups = []
-
-        # Get collector's assigned wards
-        collector_wards = user.get_ward_names()
-
-        if day_column is not None:
-            # Only show active customers with non-expired subscriptions
-            today_date = date.today()
-            query = Customer.query.filter(
-                day_column == 1,
-                (Customer.active == 'Yes') | (Customer.active == 'yes'),
-                db.or_(
-                    Customer.subscription_end.is_(None),
-                    Customer.subscription_end >= today_date
-                )
-            )
 
-            # Filter by assigned wards - if collector has ward assignments, restrict to those
-            if collector_wards:
-                query = query.filter(Customer.ward.in_(collector_wards))
-            else:
-                # No wards assigned means no access
-                query = query.filter(db.false())
-
-            customers = query.order_by(Customer.address).all()
-
-            for customer in customers:
-                pickup = Pickup.query.filter_by(
-                    customer_id=customer.id,
-                    pickup_date=today
-                ).first()
-
-                if not pickup:
-                    pickup = Pickup(
-                        customer_id=customer.id,
-                        pickup_date=today
-                    )
-                    db.session.add(pickup)
-
-                pickups.append({
-                    'pickup': pickup,
-                    'customer': customer
-                })
+        # Answer reloads of an unchanged route before loading or rendering anything
+        etag = collector_route_etag(user, today, 'html')
+        if etag and request.if_none_match.contains(etag):
+            return not_modified(etag)
 
-            db.session.commit()
+        pickups = get_collector_route(user, today)
 
-        no_wards = len(collector_wards) == 0
-        return render_template('collector_dashboard.html',
-                             pickups=pickups,
-                             today=today,
-                             no_wards=no_wards)
+        no_wards = len(user.wards) == 0
+        response = make_response(render_template('collector_dashboard.html',
+                                                 pickups=pickups,
+                                                 today=today,
+                                                 no_wards=no_wards))
+        return set_route_etag(response, etag)
 
 
 # ==================== ADMIN CUSTOMER ROUTES ====================
 
-@app.route('/admin/customers')
-@admin_required
-def admin_customers():
-    page = request.args.get('page', 1, type=int)
-    search = request.args.get('search', '')
-    ward_filter = request.args.get('ward', '')
-    status_filter = request.args.get('status', '')
-    subscription_filter = request.args.get('subscription', '')
-    
+def customer_list_query(search, ward_filter, status_filter, subscription_filter):
+    """Customers matching the customer list filters, shared by the list page and the export"""
     query = Customer.query
     
     if search:
@@ -387,33 +1630,28 @@ def admin_customers():
     elif status_filter == 'inactive':
         query = query.filter(Customer.active == 'No')
     
-    # Subscription filter
-    today = date.today()
-    if subscription_filter == 'expired':
-        query = query.filter(
-            Customer.subscription_end.isnot(None),
-            Customer.subscription_end < today
-        )
-    elif subscription_filter == 'expiring_week':
-        week_from_now = today + timedelta(days=7)
-        query = query.filter(
-            Customer.subscription_end.isnot(None),
-            Customer.subscription_end >= today,
-            Customer.subscription_end <= week_from_now
-        )
-    elif subscription_filter == 'expiring_month':
-        month_from_now = today + timedelta(days=30)
-        query = query.filter(
-            Customer.subscription_end.isnot(None),
-            Customer.subscription_end >= today,
-            Customer.subscription_end <= month_from_now
-        )
-    elif subscription_filter == 'no_date':
-        query = query.filter(Customer.subscription_end.is_(None))
+    return query.filter(*Customer.subscription_filter(subscription_filter))
+
+
+@admin_bp.route('/customers')
+@admin_required
+def admin_customers():
+    page = request.args.get('page', 1, type=int)
+    search = request.args.get('search', '')
+    ward_filter = request.args.get('ward', '')
+    status_filter = request.args.get('status', '')
+    subscription_filter = request.args.get('subscription', '')
+    sort = request.args.get('sort', '')
     
-    customers = query.order_by(Customer.customer_number).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    query = customer_list_query(search, ward_filter, status_filter, subscription_filter)
+
+    # Status and days left come back with each customer, so the template does no date arithmetic
+    query = query.add_columns(Customer.subscription_status, Customer.days_until_expiry)
+    if sort == 'days_left':
+        query = query.order_by(Customer.subscription_end.is_(None), Customer.days_until_expiry, Customer.customer_number)
+    else:
+        query = query.order_by(Customer.customer_number)
+    customers = query.paginate(page=page, per_page=20, error_out=False)
     
     wards = db.session.query(Customer.ward).filter(Customer.ward.isnot(None)).distinct().order_by(Customer.ward).all()
     wards = [w[0] for w in wards if w[0]]
@@ -424,23 +1662,26 @@ def admin_customers():
                          ward_filter=ward_filter,
                          status_filter=status_filter,
                          subscription_filter=subscription_filter,
-                         wards=wards,
-                         today=today)
+                         sort=sort,
+                         wards=wards)
 
 
-@app.route('/admin/customers/bulk-delete', methods=['POST'])
+@admin_bp.route('/customers/bulk-delete', methods=['POST'])
 @admin_required
 def bulk_delete_customers():
     customer_ids = request.form.getlist('customer_ids[]')
     
     if not customer_ids:
         flash('No customers selected.', 'warning')
-        return redirect(url_for('admin_customers'))
+        return redirect(url_for('admin.admin_customers'))
     
     try:
         customer_ids = [int(id) for id in customer_ids]
+        Pickup.query.filter(Pickup.customer_id.in_(customer_ids)).delete(synchronize_session=False)
+        clear_occurrences(customer_ids)
         deleted_count = Customer.query.filter(Customer.id.in_(customer_ids)).delete(synchronize_session=False)
         db.session.commit()
+        rebuild_completion_rollups(date.today(), date.today())
         
         # Renumber customers after deletion
         renumber_customers()
@@ -450,10 +1691,10 @@ def bulk_delete_customers():
         db.session.rollback()
         flash(f'Error deleting customers: {str(e)}', 'danger')
     
-    return redirect(url_for('admin_customers'))
+    return redirect(url_for('admin.admin_customers'))
 
 
-@app.route('/admin/customers/bulk-extend', methods=['POST'])
+@admin_bp.route('/customers/bulk-extend', methods=['POST'])
 @admin_required
 def bulk_extend_subscriptions():
     """Bulk extend subscription end dates"""
@@ -462,11 +1703,11 @@ def bulk_extend_subscriptions():
     
     if not customer_ids:
         flash('No customers selected.', 'warning')
-        return redirect(url_for('admin_customers'))
+        return redirect(url_for('admin.admin_customers'))
     
     if not months or months < 1:
         flash('Please specify number of months to extend.', 'warning')
-        return redirect(url_for('admin_customers'))
+        return redirect(url_for('admin.admin_customers'))
     
     try:
         customer_ids = [int(id) for id in customer_ids]
@@ -491,7 +1732,7 @@ def bulk_extend_subscriptions():
         db.session.rollback()
         flash(f'Error extending subscriptions: {str(e)}', 'danger')
     
-    return redirect(url_for('admin_customers'))
+    return redirect(url_for('admin.admin_customers'))
 
 
 def renumber_customers():
@@ -503,63 +1744,24 @@ def renumber_customers():
     db.session.commit()
 
 
-@app.route('/admin/customers/export')
+@admin_bp.route('/customers/export')
 @admin_required
+@track_job('export_customers')
 def export_customers():
+    import pandas as pd
+
     search = request.args.get('search', '')
     ward_filter = request.args.get('ward', '')
     status_filter = request.args.get('status', '')
     subscription_filter = request.args.get('subscription', '')
     
-    query = Customer.query
-    
-    if search:
-        query = query.filter(
-            (Customer.customer_name.contains(search)) |
-            (Customer.address.contains(search)) |
-            (Customer.phone_number.contains(search))
-        )
-    
-    if ward_filter:
-        query = query.filter(Customer.ward == ward_filter)
-    
-    if status_filter == 'active':
-        query = query.filter((Customer.active == 'Yes') | (Customer.active == 'yes'))
-    elif status_filter == 'inactive':
-        query = query.filter(Customer.active == 'No')
-    
-    # Apply subscription filter
-    today = date.today()
-    if subscription_filter == 'expired':
-        query = query.filter(
-            Customer.subscription_end.isnot(None),
-            Customer.subscription_end < today
-        )
-    elif subscription_filter == 'expiring_week':
-        week_from_now = today + timedelta(days=7)
-        query = query.filter(
-            Customer.subscription_end.isnot(None),
-            Customer.subscription_end >= today,
-            Customer.subscription_end <= week_from_now
-        )
-    elif subscription_filter == 'expiring_month':
-        month_from_now = today + timedelta(days=30)
-        query = query.filter(
-            Customer.subscription_end.isnot(None),
-            Customer.subscription_end >= today,
-            Customer.subscription_end <= month_from_now
-        )
-    elif subscription_filter == 'no_date':
-        query = query.filter(Customer.subscription_end.is_(None))
-    
-    customers = query.order_by(Customer.customer_number).all()
+    customers = customer_list_query(search, ward_filter, status_filter, subscription_filter)\
+        .add_columns(Customer.days_until_expiry).order_by(Customer.customer_number).all()
     
     data = []
-    for c in customers:
-        # Calculate days until expiry
+    for c, days in customers:
         days_until_expiry = ''
-        if c.subscription_end:
-            days = (c.subscription_end - today).days
+        if days is not None:
             if days < 0:
                 days_until_expiry = f'EXPIRED {abs(days)} days ago'
             else:
@@ -569,6 +1771,8 @@ def export_customers():
             'Number': c.customer_number,
             'Customer Name': c.customer_name,
             'Address': c.address,
+            'Latitude': c.latitude,
+            'Longitude': c.longitude,
             'Phone Number': c.phone_number,
             'Type': c.type,
             'Ward': c.ward,
@@ -592,6 +1796,7 @@ def export_customers():
             'Amount Paid SLL': c.amount_paid
         })
     
+    count_job_rows(len(data))
     df = pd.DataFrame(data)
     
     output = BytesIO()
@@ -610,7 +1815,7 @@ def export_customers():
     )
 
 
-@app.route('/admin/customers/add', methods=['GET', 'POST'])
+@admin_bp.route('/customers/add', methods=['GET', 'POST'])
 @admin_required
 def add_customer():
     if request.method == 'POST':
@@ -641,6 +1846,9 @@ def add_customer():
             month_acquired=request.form.get('month_acquired'),
             amount_paid=request.form.get('amount_paid', type=float)
         )
+        customer.latitude, customer.longitude = coordinate_pair(
+            request.form.get('latitude'), request.form.get('longitude')
+        )
         
         if request.form.get('subscription_start'):
             customer.subscription_start = datetime.strptime(
@@ -650,12 +1858,16 @@ def add_customer():
             customer.subscription_end = datetime.strptime(
                 request.form.get('subscription_end'), '%Y-%m-%d'
             ).date()
+        if request.form.get('schedule_anchor'):
+            customer.schedule_anchor = datetime.strptime(
+                request.form.get('schedule_anchor'), '%Y-%m-%d'
+            ).date()
         
         db.session.add(customer)
         db.session.commit()
         
         flash(f'Customer added successfully! Customer #{next_number}', 'success')
-        return redirect(url_for('admin_customers'))
+        return redirect(url_for('admin.admin_customers'))
     
     # Get next customer number for display
     max_number = db.session.query(db.func.max(Customer.customer_number)).scalar()
@@ -664,7 +1876,7 @@ def add_customer():
     return render_template('add_customer.html', next_number=next_number)
 
 
-@app.route('/admin/customers/edit/<int:id>', methods=['GET', 'POST'])
+@admin_bp.route('/customers/edit/<int:id>', methods=['GET', 'POST'])
 @admin_required
 def edit_customer(id):
     customer = Customer.query.get_or_404(id)
@@ -680,6 +1892,9 @@ def edit_customer(id):
         customer.bin_size = request.form.get('bin_size')  # Can now store multiple sizes
         customer.bin_qty = request.form.get('bin_qty', type=int)
         customer.frequency = request.form.get('frequency')
+        customer.schedule_anchor = datetime.strptime(
+            request.form.get('schedule_anchor'), '%Y-%m-%d'
+        ).date() if request.form.get('schedule_anchor') else None
         customer.time = request.form.get('time')
         customer.monday = 1 if request.form.get('monday') else 0
         customer.tuesday = 1 if request.form.get('tuesday') else 0
@@ -692,6 +1907,9 @@ def edit_customer(id):
         customer.active = request.form.get('active')
         customer.month_acquired = request.form.get('month_acquired')
         customer.amount_paid = request.form.get('amount_paid', type=float)
+        customer.latitude, customer.longitude = coordinate_pair(
+            request.form.get('latitude'), request.form.get('longitude')
+        )
         
         if request.form.get('subscription_start'):
             customer.subscription_start = datetime.strptime(
@@ -704,26 +1922,27 @@ def edit_customer(id):
         
         db.session.commit()
         flash('Customer updated successfully!', 'success')
-        return redirect(url_for('admin_customers'))
+        return redirect(url_for('admin.admin_customers'))
     
     return render_template('edit_customer.html', customer=customer)
 
 
-@app.route('/admin/customers/delete/<int:id>', methods=['POST'])
+@admin_bp.route('/customers/delete/<int:id>', methods=['POST'])
 @admin_required
 def delete_customer(id):
     customer = Customer.query.get_or_404(id)
     db.session.delete(customer)
     db.session.commit()
+    rebuild_completion_rollups(date.today(), date.today())
     
     # Renumber customers after deletion
     renumber_customers()
     
     flash('Customer deleted successfully!', 'success')
-    return redirect(url_for('admin_customers'))
+    return redirect(url_for('admin.admin_customers'))
 
 
-@app.route('/admin/customers/renumber', methods=['POST'])
+@admin_bp.route('/customers/renumber', methods=['POST'])
 @admin_required
 def renumber_all_customers():
     """Manual renumbering route - renumbers all customers sequentially"""
@@ -732,10 +1951,10 @@ def renumber_all_customers():
         flash('All customers have been renumbered successfully!', 'success')
     except Exception as e:
         flash(f'Error renumbering customers: {str(e)}', 'danger')
-    return redirect(url_for('admin_customers'))
+    return redirect(url_for('admin.admin_customers'))
 
 
-@app.route('/admin/pickups')
+@admin_bp.route('/pickups')
 @admin_required
 def admin_pickups():
     date_filter = request.args.get('date', date.today().isoformat())
@@ -753,59 +1972,206 @@ def admin_pickups():
     }
     
     day_column = day_column_map.get(day_name)
+
+    # Archived dates are history: show what was recorded, don't create new pickups
+    cutoff = archive_cutoff()
+    archived = cutoff is not None and filter_date < cutoff
     
-    # Get all active customers scheduled for this day with non-expired subscriptions
-    if day_column is not None:
-        filter_date_obj = filter_date  # filter_date is already a date object
-        customers_for_day = Customer.query.filter(
-            day_column == 1,
-            (Customer.active == 'Yes') | (Customer.active == 'yes'),
-            db.or_(
-                Customer.subscription_end.is_(None),  # No end date
-                Customer.subscription_end >= filter_date_obj  # Or not expired on filter date
-            )
-        ).all()
+    # Get all customers due on this day who are in service on it
+    due = scheduled_filter(filter_date) + serviceable_filter(filter_date)
+    if day_column is not None and not archived:
+        customer_ids = [row[0] for row in db.session.query(Customer.id).filter(*due)]
         
         # Create pickup records if they don't exist
-        for customer in customers_for_day:
-            existing_pickup = Pickup.query.filter_by(
-                customer_id=customer.id,
-                pickup_date=filter_date
-            ).first()
-            
-            if not existing_pickup:
-                pickup = Pickup(
-                    customer_id=customer.id,
-                    pickup_date=filter_date
-                )
-                db.session.add(pickup)
-        
-        db.session.commit()
+        ensure_pickups(filter_date, customer_ids)
     
     # Now get all pickups for the filter date, but only for customers still scheduled for this day
     if day_column is not None:
-        pickups = Pickup.query.filter_by(pickup_date=filter_date).join(Customer).filter(
-            day_column == 1,
-            (Customer.active == 'Yes') | (Customer.active == 'yes'),
-            db.or_(
-                Customer.subscription_end.is_(None),
-                Customer.subscription_end >= filter_date
-            )
-        ).order_by(Pickup.completed, Customer.address).all()
+        pickups = Pickup.query.filter_by(pickup_date=filter_date).join(Customer).options(
+            db.contains_eager(Pickup.customer)
+        ).filter(*due).order_by(Pickup.completed, Customer.address).all()
     else:
         pickups = []
+
+    if archived:
+        pickups = sorted(pickups + archived_pickups_for_day(filter_date),
+                         key=lambda p: (bool(p.completed), p.customer.address or ''))
     
     return render_template('admin_pickups.html', pickups=pickups, filter_date=filter_date)
 
 
-@app.route('/admin/users')
+# Cell states in the pickup schedule matrix
+SCHEDULE_STATES = {2: 'completed', 1: 'pending'}
+SCHEDULE_LABELS = {'completed': 'Done', 'pending': 'Pending', 'scheduled': 'Scheduled', 'missed': 'Missed'}
+
+
+def schedule_range(day, view):
+    """First and last day of the week (Monday to Sunday) or calendar month containing day"""
+    if view == 'month':
+        start = day.replace(day=1)
+        return start, next_month(start) - timedelta(days=1)
+    start = day - timedelta(days=day.weekday())
+    return start, start + timedelta(days=6)
+
+
+def pickup_matrix(start, end, ward=None):
+    """Customers x days from start to end with each day's pickup state.
+
+    Returns (days, rows, totals). Each row is (customer, states) with one
+    state per day: 'completed' or 'pending' from the pickup row,
+    'scheduled' (today or later) or 'missed' (earlier) when the customer
+    was due but has no pickup row, or None. Live pickups come from one
+    grouped query; archived days take one more query on the archive.
+    """
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    states = [
+        db.func.max(db.case((Pickup.pickup_date == day, db.case((Pickup.completed == db.true(), 2), else_=1))))
+        for day in days
+    ]
+    weekday_names = {day.strftime('%A').lower() for day in days} - {'sunday'}
+    scheduled = db.and_(
+        db.or_(*[getattr(Customer, name) == 1 for name in sorted(weekday_names)]),
+        Customer.serviceable_on(start)
+    ) if weekday_names else db.false()
+
+    archived = {}
+    cutoff = archive_cutoff()
+    if cutoff is not None and start < cutoff:
+        archived = {
+            (customer_id, pickup_date): 2 if completed else 1
+            for customer_id, pickup_date, completed in db.session.query(
+                ArchivedPickup.customer_id, ArchivedPickup.pickup_date, ArchivedPickup.completed
+            ).filter(ArchivedPickup.pickup_date.between(start, min(end, cutoff - timedelta(days=1))))
+        }
+
+    # Customers with only archived pickups in the range (e.g. since lapsed) still get a row
+    present = [Pickup.id.isnot(None), scheduled]
+    if archived:
+        present.append(Customer.id.in_({customer_id for customer_id, _ in archived}))
+    query = db.session.query(Customer, *states).outerjoin(
+        Pickup, db.and_(Pickup.customer_id == Customer.id, Pickup.pickup_date.between(start, end))
+    ).filter(db.or_(*present))
+    if ward:
+        query = query.filter(Customer.ward == ward)
+    results = query.group_by(Customer.id).order_by(Customer.ward, Customer.address, Customer.id).all()
+
+    today = date.today()
+    rows = []
+    for customer, *codes in results:
+        row_states = []
+        for day, code in zip(days, codes):
+            code = code or archived.get((customer.id, day))
+            if code:
+                row_states.append(SCHEDULE_STATES[code])
+            elif customer.due_on(day) and customer.serviceable_on(day):
+                row_states.append('scheduled' if day >= today else 'missed')
+            else:
+                row_states.append(None)
+        rows.append((customer, row_states))
+
+    totals = [
+        {'date': day.isoformat(),
+         'scheduled': sum(1 for _, row_states in rows if row_states[i]),
+         'completed': sum(1 for _, row_states in rows if row_states[i] == 'completed')}
+        for i, day in enumerate(days)
+    ]
+    return days, rows, totals
+
+
+def schedule_args():
+    """(day, view, ward, start, end) from the schedule request's ?date=, ?view= and ?ward="""
+    try:
+        day = date.fromisoformat(request.args.get('date', date.today().isoformat()))
+    except ValueError:
+        day = date.today()
+    view = request.args.get('view', 'week')
+    if view not in ('week', 'month'):
+        view = 'week'
+    ward = request.args.get('ward', '')
+    start, end = schedule_range(day, view)
+    return day, view, ward, start, end
+
+
+@admin_bp.route('/pickups/schedule')
+@admin_required
+def admin_pickup_schedule():
+    day, view, ward, start, end = schedule_args()
+    days, rows, totals = pickup_matrix(start, end, ward)
+    wards = [w[0] for w in db.session.query(Customer.ward).filter(Customer.ward.isnot(None)).distinct().order_by(Customer.ward) if w[0]]
+    return render_template(
+        'admin_pickup_schedule.html',
+        view=view, ward=ward, start=start, end=end, days=days, rows=rows, totals=totals, wards=wards,
+        labels=SCHEDULE_LABELS, today=date.today(),
+        previous=schedule_range(start - timedelta(days=1), view)[0],
+        following=end + timedelta(days=1),
+    )
+
+
+@admin_bp.route('/pickups/schedule.json')
+@admin_required
+def admin_pickup_schedule_json():
+    day, view, ward, start, end = schedule_args()
+    days, rows, totals = pickup_matrix(start, end, ward)
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'view': view,
+        'days': [d.isoformat() for d in days],
+        'customers': [
+            {'id': c.id, 'customer_number': c.customer_number, 'customer_name': c.customer_name,
+             'ward': c.ward, 'address': c.address, 'states': row_states}
+            for c, row_states in rows
+        ],
+        'totals': totals,
+    })
+
+
+@admin_bp.route('/pickups/schedule/export')
+@admin_required
+@track_job('export_schedule')
+def export_pickup_schedule():
+    import pandas as pd
+
+    day, view, ward, start, end = schedule_args()
+    days, rows, totals = pickup_matrix(start, end, ward)
+
+    data = []
+    for c, row_states in rows:
+        entry = {
+            'Number': c.customer_number,
+            'Customer Name': c.customer_name,
+            'Ward': c.ward,
+            'Address': c.address,
+        }
+        for d, state in zip(days, row_states):
+            entry[d.strftime('%a %Y-%m-%d')] = SCHEDULE_LABELS.get(state, '')
+        data.append(entry)
+
+    count_job_rows(len(data))
+    df = pd.DataFrame(data, columns=['Number', 'Customer Name', 'Ward', 'Address'] + [d.strftime('%a %Y-%m-%d') for d in days])
+
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, sheet_name='Schedule', index=False)
+    output.seek(0)
+
+    filename = f'pickup_schedule_{start.isoformat()}_{end.isoformat()}.xlsx'
+    return send_file(
+        output,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=filename
+    )
+
+
+@admin_bp.route('/users')
 @admin_required
 def admin_users():
     users = User.query.all()
     return render_template('admin_users.html', users=users)
 
 
-@app.route('/admin/users/add', methods=['GET', 'POST'])
+@admin_bp.route('/users/add', methods=['GET', 'POST'])
 @admin_required
 def add_user():
     if request.method == 'POST':
@@ -835,14 +2201,14 @@ def add_user():
 
                 db.session.commit()
                 flash('User added successfully!', 'success')
-                return redirect(url_for('admin_users'))
+                return redirect(url_for('admin.admin_users'))
 
     wards = db.session.query(Customer.ward).filter(Customer.ward.isnot(None), Customer.ward != '').distinct().order_by(Customer.ward).all()
     wards = [w[0] for w in wards]
     return render_template('add_user.html', wards=wards)
 
 
-@app.route('/admin/users/edit/<int:id>', methods=['GET', 'POST'])
+@admin_bp.route('/users/edit/<int:id>', methods=['GET', 'POST'])
 @admin_required
 def edit_user(id):
     user = User.query.get_or_404(id)
@@ -861,8 +2227,9 @@ def edit_user(id):
                 db.session.add(cw)
 
         db.session.commit()
+        invalidate_user_cache(user.id)
         flash('User updated successfully!', 'success')
-        return redirect(url_for('admin_users'))
+        return redirect(url_for('admin.admin_users'))
 
     wards = db.session.query(Customer.ward).filter(Customer.ward.isnot(None), Customer.ward != '').distinct().order_by(Customer.ward).all()
     wards = [w[0] for w in wards]
@@ -870,7 +2237,7 @@ def edit_user(id):
     return render_template('edit_user.html', user=user, wards=wards, user_wards=user_wards)
 
 
-@app.route('/admin/users/delete/<int:id>', methods=['POST'])
+@admin_bp.route('/users/delete/<int:id>', methods=['POST'])
 @admin_required
 def delete_user(id):
     if id == session.get('user_id'):
@@ -879,71 +2246,1988 @@ def delete_user(id):
         user = User.query.get_or_404(id)
         db.session.delete(user)
         db.session.commit()
+        invalidate_user_cache(id)
         flash('User deleted successfully!', 'success')
-    return redirect(url_for('admin_users'))
+    return redirect(url_for('admin.admin_users'))
+
+
+# ==================== ROUTE ORDERING ====================
+
+# Collector routes are ordered ward by ward. Within a ward, customers with
+# coordinates are visited in an order planned by plan_route(): a nearest-
+# neighbour tour improved with 2-opt, both using a grid index so each step
+# only looks at nearby stops. The order is cached per ward and weekday in
+# RouteOrder and rebuilt only when the ward's stops or their coordinates
+# change. Customers without coordinates follow, by address.
+
+# Candidate stops considered for each 2-opt move
+ROUTE_NEIGHBOURS = 8
+ROUTE_MAX_PASSES = 50
+
+
+def project(points):
+    """Map (latitude, longitude) pairs to (x, y) kilometres, accurate at town scale"""
+    lat0 = math.radians(sum(lat for lat, _ in points) / len(points))
+    return [(lng * 111.320 * math.cos(lat0), lat * 110.574) for lat, lng in points]
+
+
+class StopGrid:
+    """Buckets points into square cells so the points near one can be found without scanning them all"""
+
+    def __init__(self, points):
+        self.points = points
+        xs = [x for x, _ in points]
+        ys = [y for _, y in points]
+        self.min_x, self.min_y = min(xs), min(ys)
+        span = max(max(xs) - self.min_x, max(ys) - self.min_y)
+        # About one point per cell
+        self.size = span / math.sqrt(len(points)) or 1.0
+        self.reach = int(span / self.size) + 1
+        self.cells = {}
+        for i, point in enumerate(points):
+            self.cells.setdefault(self.cell(point), set()).add(i)
+
+    def cell(self, point):
+        return int((point[0] - self.min_x) // self.size), int((point[1] - self.min_y) // self.size)
+
+    def remove(self, i):
+        self.cells[self.cell(self.points[i])].discard(i)
+
+    def ring(self, cx, cy, r):
+        if r == 0:
+            return [(cx, cy)]
+        cells = [(cx + dx, cy + dy) for dx in range(-r, r + 1) for dy in (-r, r)]
+        return cells + [(cx + dx, cy + dy) for dx in (-r, r) for dy in range(-r + 1, r)]
+
+    def nearest(self, i, k):
+        """Return up to k of the points still in the grid closest to point i, nearest first"""
+        origin = self.points[i]
+        cx, cy = self.cell(origin)
+        found = []
+        for r in range(self.reach + 1):
+            for cell in self.ring(cx, cy, r):
+                found += [(math.dist(origin, self.points[j]), j) for j in self.cells.get(cell, ()) if j != i]
+            # Points in cells further out are at least r cells away
+            if len(found) >= k and sorted(found)[k - 1][0] <= r * self.size:
+                break
+        return [j for _, j in sorted(found)[:k]]
+
+
+def plan_route(coordinates):
+    """Return an open tour through (latitude, longitude) pairs as a list of indexes"""
+    points = project(coordinates)
+    n = len(points)
+    if n < 3:
+        return list(range(n))
+
+    # Nearest-neighbour tour, starting from the stop furthest from the middle
+    centre = (sum(x for x, _ in points) / n, sum(y for _, y in points) / n)
+    current = max(range(n), key=lambda i: math.dist(points[i], centre))
+    grid = StopGrid(points)
+    grid.remove(current)
+    tour = [current]
+    for _ in range(n - 1):
+        current = grid.nearest(current, 1)[0]
+        grid.remove(current)
+        tour.append(current)
+
+    # 2-opt: reverse a stretch of the tour whenever that shortens it, only
+    # trying to join stops to their nearest neighbours
+    grid = StopGrid(points)
+    neighbours = [grid.nearest(i, ROUTE_NEIGHBOURS) for i in range(n)]
+    position = [0] * n
+    for k, i in enumerate(tour):
+        position[i] = k
+
+    def dist(a, b):
+        return math.dist(points[a], points[b]) if a is not None and b is not None else 0.0
+
+    def reverse(first, last):
+        tour[first:last + 1] = tour[first:last + 1][::-1]
+        for k in range(first, last + 1):
+            position[tour[k]] = k
+
+    for _ in range(ROUTE_MAX_PASSES):
+        improved = False
+        for k in range(n - 1):
+            a, b = tour[k], tour[k + 1]
+            for c in neighbours[a]:
+                # a-b ... c-d becomes a-c ... b-d
+                j = position[c]
+                d = tour[j + 1] if j + 1 < n else None
+                if j > k + 1 and dist(a, c) + dist(b, d) < dist(a, b) + dist(c, d) - 1e-9:
+                    reverse(k + 1, j)
+                    improved = True
+                    break
+            else:
+                for c in neighbours[b]:
+                    # p-c ... a-b becomes p-a ... c-b
+                    j = position[c]
+                    p = tour[j - 1] if j > 0 else None
+                    if j < k and dist(p, a) + dist(c, b) < dist(p, c) + dist(a, b) - 1e-9:
+                        reverse(j, k)
+                        improved = True
+                        break
+        if not improved:
+            break
+    return tour
+
+
+def route_signature(stops):
+    return hashlib.sha1(repr(sorted((s.id, s.latitude, s.longitude) for s in stops)).encode('utf-8')).hexdigest()
+
+
+def order_route(stops, day):
+    """Return stops in driving order: by ward, then the ward's planned order, then unlocated stops by address.
+
+    stops can be Customers or rows with id, ward, address, latitude and
+    longitude. Orders missing from the cache, or built from a different set
+    of stops, are planned again and stored.
+    """
+    weekday = day.strftime('%A').lower()
+    wards = {}
+    for stop in stops:
+        wards.setdefault(stop.ward or '', []).append(stop)
+
+    located = {
+        ward: {s.id: s for s in ward_stops if s.latitude is not None and s.longitude is not None}
+        for ward, ward_stops in wards.items()
+    }
+    planned = [ward for ward in wards if len(located[ward]) > 2]
+    cached = {
+        order.ward: order for order in RouteOrder.query.filter(
+            RouteOrder.weekday == weekday, RouteOrder.ward.in_(planned)
+        )
+    } if planned else {}
+
+    ordered = []
+    built = []
+    for ward in sorted(wards):
+        ward_located = located[ward]
+        order = sorted(ward_located)
+        if ward in planned:
+            signature = route_signature(ward_located.values())
+            if ward in cached and cached[ward].signature == signature:
+                order = json.loads(cached[ward].customer_ids)
+            else:
+                tour = plan_route([(ward_located[i].latitude, ward_located[i].longitude) for i in order])
+                order = [order[k] for k in tour]
+                built.append({'ward': ward, 'weekday': weekday, 'signature': signature,
+                              'customer_ids': json.dumps(order), 'built_at': datetime.now()})
+        ordered += [ward_located[i] for i in order]
+        ordered += sorted((s for s in wards[ward] if s.id not in ward_located), key=lambda s: s.address or '')
+
+    if built:
+        stmt = UPSERTS[db.engine.dialect.name](RouteOrder.__table__).values(built)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['ward', 'weekday'],
+            set_={name: stmt.excluded[name] for name in ('signature', 'customer_ids', 'built_at')}
+        ))
+        db.session.commit()
+    return ordered
 
 
 # ==================== COLLECTOR ROUTES ====================
 
-@app.route('/collector/complete/<int:pickup_id>', methods=['POST'])
+def get_day_column(day):
+    """Return the Customer weekday column for a date, or None on Sundays"""
+    return {
+        'monday': Customer.monday,
+        'tuesday': Customer.tuesday,
+        'wednesday': Customer.wednesday,
+        'thursday': Customer.thursday,
+        'friday': Customer.friday,
+        'saturday': Customer.saturday
+    }.get(day.strftime('%A').lower())
+
+
+def collector_route_query(user, day):
+    """Query for the customers on a collector's route for a given day"""
+    day_column = get_day_column(day)
+    if day_column is None or not user.wards:
+        # No service on Sundays, and no wards assigned means no access
+        return Customer.query.filter(db.false())
+
+    # Only customers due and in service on the day, in the collector's wards
+    return Customer.query.filter(
+        *scheduled_filter(day),
+        *serviceable_filter(day),
+        Customer.ward.in_(sorted(user.wards))
+    )
+
+
+def ensure_pickups(day, customer_ids):
+    """Return {customer_id: pickup_id} for a day, creating any missing pickup rows"""
+    pickup_ids = dict(
+        db.session.query(Pickup.customer_id, Pickup.id).filter(
+            Pickup.pickup_date == day,
+            Pickup.customer_id.in_(customer_ids)
+        ).all()
+    ) if customer_ids else {}
+
+    missing_ids = [customer_id for customer_id in customer_ids if customer_id not in pickup_ids]
+    if missing_ids:
+        wards = dict(db.session.query(Customer.id, Customer.ward).filter(Customer.id.in_(missing_ids)))
+        missing = [Pickup(customer_id=customer_id, pickup_date=day, ward=wards.get(customer_id))
+                   for customer_id in missing_ids]
+        db.session.add_all(missing)
+        db.session.flush()
+        pickup_ids.update((pickup.customer_id, pickup.id) for pickup in missing)
+        rollup_new_pickups(day, missing)
+        db.session.commit()
+    return pickup_ids
+
+
+def get_collector_route(user, day):
+    """Return [{'pickup', 'customer'}] for a collector's route in driving order, see order_route().
+
+    Pickup rows are created on first view of the day.
+    """
+    customers = order_route(collector_route_query(user, day).all(), day)
+    if not customers:
+        return []
+
+    pickup_ids = ensure_pickups(day, [c.id for c in customers])
+    pickups = {
+        pickup.customer_id: pickup
+        for pickup in Pickup.query.filter(Pickup.id.in_(list(pickup_ids.values())))
+    }
+    return [{'pickup': pickups[c.id], 'customer': c} for c in customers]
+
+
+def serialize_pickup(pickup):
+    return {
+        'id': pickup.id,
+        'customer_id': pickup.customer_id,
+        'completed': bool(pickup.completed),
+        'completed_at': pickup.completed_at.isoformat() if pickup.completed_at else None,
+        'completed_by': pickup.completed_by,
+        'notes': pickup.notes
+    }
+
+
+def serialize_customer(customer):
+    return {
+        'id': customer.id,
+        'customer_name': customer.customer_name,
+        'address': customer.address,
+        'phone_number': customer.phone_number,
+        'ward': customer.ward,
+        'latitude': customer.latitude,
+        'longitude': customer.longitude,
+        'time': customer.time,
+        'bin_size': customer.bin_size,
+        'bin_qty': customer.bin_qty
+    }
+
+
+def make_sync_cursor(day, seq, user):
+    """Build the opaque cursor handed to devices.
+
+    The day and the collector's ward set are part of the cursor, so a new
+    day or a ward reassignment forces a full sync.
+    """
+    wards_key = zlib.crc32('|'.join(sorted(user.wards)).encode('utf-8'))
+    return f'{day.isoformat()}.{seq}.{wards_key:x}'
+
+
+def parse_sync_cursor(cursor, day, user):
+    """Return the change sequence from a cursor, or 0 if a full sync is needed"""
+    try:
+        cursor_day, seq, wards_key = cursor.split('.')
+        seq = int(seq)
+    except (AttributeError, ValueError):
+        return 0
+    if make_sync_cursor(day, seq, user) != cursor:
+        return 0
+    return seq
+
+
+# The rendered page embeds a CSRF token that expires after WTF_CSRF_TIME_LIMIT
+# (an hour by default); the ETag changes every half hour so a cached page never
+# carries an expired token. It also covers the session's CSRF secret, which is
+# new after every login, so a page cached before a logout is never served again.
+ETAG_TOKEN_BUCKET = 1800
+
+
+def collector_route_etag(user, day, kind):
+    """Return a strong ETag for a collector's route on a day.
+
+    Built from the newest change_seq and row counts of the customers in the
+    collector's wards and their pickups for the day, using one aggregate
+    query. Returns None when the response must not be cached (pending flash
+    messages in the session).
+    """
+    if session.get('_flashes'):
+        return None
+
+    customer_seq, customer_count, pickup_seq, pickup_count = db.session.query(
+        db.func.max(Customer.change_seq),
+        db.func.count(db.distinct(Customer.id)),
+        db.func.max(Pickup.change_seq),
+        db.func.count(Pickup.id)
+    ).select_from(Customer).outerjoin(
+        Pickup, db.and_(Pickup.customer_id == Customer.id, Pickup.pickup_date == day)
+    ).filter(Customer.ward.in_(sorted(user.wards))).one()
+
+    parts = [kind, user.id, user.role, make_sync_cursor(day, 0, user),
+             customer_seq, customer_count, pickup_seq, pickup_count]
+    if kind == 'html':
+        # Create the session's CSRF secret now rather than while rendering, so
+        # the first response after a login already carries the final ETag
+        generate_csrf()
+        csrf_secret = session.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'), '')
+        parts += [int(time.time() // ETAG_TOKEN_BUCKET), hashlib.sha1(csrf_secret.encode('utf-8')).hexdigest(),
+                  _template_mtime('collector_dashboard.html')]
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+# {(template name, mtime): names it extends, includes or imports}
+_template_references = {}
+
+
+def _template_mtime(name, seen=None):
+    """Newest modification time of a template and every template it extends,
+    includes or imports, so a redeploy touching any of them invalidates
+    cached pages"""
+    seen = set() if seen is None else seen
+    seen.add(name)
+    env = current_app.jinja_env
+    source, filename, _ = env.loader.get_source(env, name)
+    mtime = int(os.path.getmtime(filename))
+    key = (name, mtime)
+    if key not in _template_references:
+        _template_references[key] = [ref for ref in meta.find_referenced_templates(env.parse(source)) if ref]
+    for ref in _template_references[key]:
+        if ref not in seen:
+            mtime = max(mtime, _template_mtime(ref, seen))
+    return mtime
+
+
+def not_modified(etag):
+    response = make_response('', 304)
+    return set_route_etag(response, etag)
+
+
+def set_route_etag(response, etag):
+    if etag:
+        response.set_etag(etag)
+        # Let browsers keep the page but revalidate on every load
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+# ==================== COLLECTOR API ENCODING ====================
+
+# Collector devices are often on 2G/3G links. The JSON endpoints below can send
+# short keys or MessagePack (chosen by the Accept header) and gzip or brotli
+# compression (chosen by Accept-Encoding). Every response reports its
+# bytes-per-stop so payload size can be tracked against a budget.
+
+COMPACT_JSON_MIMETYPE = 'application/vnd.dortibox.compact+json'
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 256
+
+SHORT_KEYS = {
+    'success': 'ok',
+    'cursor': 'k',
+    'full': 'f',
+    'date': 'dt',
+    'route': 'r',
+    'pickups': 'P',
+    'customers': 'C',
+    'id': 'i',
+    'customer_id': 'c',
+    'completed': 'd',
+    'completed_at': 't',
+    'completed_by': 'b',
+    'notes': 'n',
+    'customer_name': 'nm',
+    'address': 'a',
+    'phone_number': 'p',
+    'ward': 'w',
+    'latitude': 'la',
+    'longitude': 'lo',
+    'time': 'tm',
+    'bin_size': 'bs',
+    'bin_qty': 'bq',
+}
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def negotiate_collector_encoding():
+    """Return (mimetype, content_encoding) for the current request"""
+    mimetypes = ['application/json', COMPACT_JSON_MIMETYPE]
+    if msgpack is not None:
+        mimetypes.append(MSGPACK_MIMETYPE)
+    mimetype = request.accept_mimetypes.best_match(mimetypes, default='application/json')
+
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    content_encoding = request.accept_encodings.best_match(encodings)
+    return mimetype, content_encoding
+
+
+def shorten_keys(value):
+    """Rename keys using SHORT_KEYS and drop null fields.
+
+    Devices replace whole records on sync, so a missing field means null.
+    """
+    if isinstance(value, dict):
+        return {SHORT_KEYS.get(k, k): shorten_keys(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [shorten_keys(v) for v in value]
+    return value
+
+
+def collector_etag(etag, encoding):
+    """Give each representation of a route its own strong ETag"""
+    if not etag:
+        return None
+    mimetype, content_encoding = encoding
+    return f'{etag}-{zlib.crc32(mimetype.encode("utf-8")):x}-{content_encoding or "identity"}'
+
+
+def collector_api_response(payload, stops, encoding, etag=None):
+    """Encode and compress a collector API payload.
+
+    stops is the number of route stops the payload describes and is used for
+    the X-Bytes-Per-Stop header.
+    """
+    mimetype, content_encoding = encoding
+    if mimetype == MSGPACK_MIMETYPE:
+        body = msgpack.packb(shorten_keys(payload))
+    elif mimetype == COMPACT_JSON_MIMETYPE:
+        body = json.dumps(shorten_keys(payload), separators=(',', ':')).encode('utf-8')
+    else:
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+    if content_encoding and len(body) >= MIN_COMPRESS_SIZE:
+        if content_encoding == 'br':
+            body = brotli.compress(body)
+        else:
+            body = gzip.compress(body, compresslevel=6)
+    else:
+        content_encoding = None
+
+    response = make_response(body)
+    response.mimetype = mimetype
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    response.vary.add('Accept')
+    response.vary.add('Accept-Encoding')
+    response.headers['X-Route-Stops'] = str(stops)
+    response.headers['X-Bytes-Per-Stop'] = str(len(body) // stops if stops else len(body))
+    return set_route_etag(response, etag)
+
+
+@collector_bp.route('/route')
+@login_required
+def collector_route():
+    """Return today's full route, with ETag revalidation"""
+    user = get_current_user()
+    today = date.today()
+    encoding = negotiate_collector_encoding()
+
+    etag = collector_etag(collector_route_etag(user, today, 'json'), encoding)
+    if etag and request.if_none_match.contains(etag):
+        return not_modified(etag)
+
+    route = get_collector_route(user, today)
+    return collector_api_response({
+        'success': True,
+        'date': today.isoformat(),
+        'pickups': [serialize_pickup(item['pickup']) for item in route],
+        'customers': [serialize_customer(item['customer']) for item in route]
+    }, len(route), encoding, etag)
+
+
+@collector_bp.route('/sync')
+@login_required
+def collector_sync():
+    """Return today's route changes since the cursor a device last received.
+
+    Responds with the pickups and customers whose change_seq is newer than
+    the cursor, plus the ordered list of [pickup_id, customer_id] on the route
+    so devices can drop stops that left it. Without a valid cursor for today
+    everything is sent.
+    """
+    user = get_current_user()
+    today = date.today()
+    since = parse_sync_cursor(request.args.get('cursor'), today, user)
+
+    # Read the sequence before the data so nothing committed in between is missed
+    seq = current_change_seq()
+
+    customer_ids = [
+        stop.id for stop in order_route(collector_route_query(user, today).with_entities(
+            Customer.id, Customer.ward, Customer.address, Customer.latitude, Customer.longitude
+        ).all(), today)
+    ]
+    pickup_ids = ensure_pickups(today, customer_ids)
+
+    customers = []
+    pickups = []
+    if customer_ids:
+        customers = Customer.query.filter(
+            Customer.id.in_(customer_ids),
+            Customer.change_seq > since
+        ).all()
+        pickups = Pickup.query.filter(
+            Pickup.pickup_date == today,
+            Pickup.customer_id.in_(customer_ids),
+            Pickup.change_seq > since
+        ).all()
+
+    return collector_api_response({
+        'success': True,
+        'cursor': make_sync_cursor(today, seq, user),
+        'full': since == 0,
+        'date': today.isoformat(),
+        'route': [[pickup_ids[customer_id], customer_id] for customer_id in customer_ids],
+        'customers': [serialize_customer(c) for c in customers],
+        'pickups': [serialize_pickup(p) for p in pickups]
+    }, len(customer_ids), negotiate_collector_encoding())
+
+
+# What set_pickup_completed() needs to know about a pickup's current state
+# to keep the completion rollups right, read along with the access check
+PickupState = namedtuple('PickupState', ['completed', 'allowed', 'pickup_date', 'ward', 'completed_by'])
+
+
+def pickup_states(pickup_ids, user=None):
+    """Return {pickup_id: PickupState} for the given pickups in one query.
+
+    Collectors are checked against collector_ward in the same statement;
+    other roles, and the write-behind writer (user=None), may update any
+    pickup. Missing pickups are left out.
+    """
+    if user is not None and user.role == 'collector':
+        allowed = db.session.query(CollectorWard.id).filter(
+            CollectorWard.user_id == user.id,
+            CollectorWard.ward == Customer.ward
+        ).exists()
+    else:
+        allowed = db.true()
+
+    rows = db.session.query(
+        Pickup.id, Pickup.completed, allowed, Pickup.pickup_date,
+        db.func.coalesce(Pickup.ward, Customer.ward), Pickup.completed_by
+    ).join(Customer, Customer.id == Pickup.customer_id).filter(Pickup.id.in_(pickup_ids)).all()
+
+    return {row[0]: PickupState(bool(row[1]), bool(row[2]), *row[3:]) for row in rows}
+
+
+def check_pickup_access(pickup_ids, user):
+    """Return {pickup_id: PickupState} with whether user may update each pickup"""
+    return pickup_states(pickup_ids, user)
+
+
+def set_pickup_completed(pickup_id, completed, state, completed_by=None, notes=None, completed_at=None):
+    """Mark a pickup completed or incomplete with a single conditional UPDATE.
+
+    state is the pickup's PickupState as read by the caller; its date, ward
+    and collector key the rollup rows to move. Only touches the row if it
+    is not already in the requested state, so repeated taps are no-ops.
+    Returns the new state if the row changed, else None. Does not commit.
+    """
+    if completed:
+        stmt = db.update(Pickup).where(
+            Pickup.id == pickup_id,
+            Pickup.completed.isnot(True)
+        ).values(
+            completed=True,
+            completed_at=completed_at or datetime.now(),
+            completed_by=completed_by,
+            notes=notes,
+            change_seq=next_change_seq()
+        )
+    else:
+        stmt = db.update(Pickup).where(
+            Pickup.id == pickup_id,
+            Pickup.completed.is_(True)
+        ).values(
+            completed=False,
+            completed_at=None,
+            completed_by=None,
+            notes=None,
+            change_seq=next_change_seq()
+        )
+    if db.session.execute(stmt).rowcount != 1:
+        return None
+    if completed:
+        move_rollup(state.pickup_date, state.ward, '', completed_by, 1)
+    else:
+        move_rollup(state.pickup_date, state.ward, state.completed_by, '', -1)
+    if state.pickup_date < date.today():
+        # A late sync changed a finished day; its cached pace is stale
+        RoutePaceDay.query.filter_by(day=state.pickup_date).delete()
+    return state._replace(completed=completed, completed_by=completed_by if completed else None)
+
+
+def pickup_log_entry(pickup_id, completed, completed_by, notes=None, completed_at=None):
+    """A completion tap as written to the write-behind pickup log"""
+    return {
+        'pickup_id': pickup_id,
+        'completed': completed,
+        'completed_by': completed_by if completed else None,
+        'notes': notes if completed else None,
+        'completed_at': (completed_at or datetime.now()).isoformat() if completed else None
+    }
+
+
+def record_pickup_completion(pickup_id, user, completed, state, notes=None):
+    """Apply a single completion tap and return True if it changed the pickup.
+
+    In write-behind mode the tap is appended to the durable pickup log and
+    the writer thread applies it to the database shortly after. The database
+    may not reflect earlier logged taps yet, so every tap is logged and the
+    writer's conditional UPDATE skips the ones that change nothing; whether
+    it changed the pickup is judged against the state read by
+    check_pickup_access() with this process's unapplied taps laid over it.
+    """
+    completed_by = user.full_name or user.username if completed else None
+    pickup_log = current_app.extensions.get('pickup_log')
+    if pickup_log is not None:
+        state = pickup_log.pending_states({pickup_id: state})[pickup_id]
+        pickup_log.append(pickup_log_entry(pickup_id, completed, completed_by, notes))
+        return completed != state.completed
+
+    if completed == state.completed:
+        return False
+    changed = set_pickup_completed(pickup_id, completed, state, completed_by, notes) is not None
+    db.session.commit()
+    return changed
+
+
+@collector_bp.route('/complete/<int:pickup_id>', methods=['POST'])
 @login_required
 def complete_pickup(pickup_id):
-    pickup = Pickup.query.get_or_404(pickup_id)
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
+
+    state = check_pickup_access([pickup_id], user).get(pickup_id)
+    if state is None:
+        abort(404)
 
     # Enforce ward access for collectors
-    if user.role == 'collector':
-        customer = Customer.query.get(pickup.customer_id)
-        collector_wards = user.get_ward_names()
-        if customer.ward not in collector_wards:
-            return jsonify({'success': False, 'message': 'You do not have access to this ward.'}), 403
+    if not state.allowed:
+        return jsonify({'success': False, 'message': 'You do not have access to this ward.'}), 403
 
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     notes = data.get('notes', '')
 
-    pickup.completed = True
-    pickup.completed_at = datetime.now()
-    pickup.completed_by = user.full_name or user.username
-    pickup.notes = notes
-
-    db.session.commit()
+    changed = record_pickup_completion(pickup_id, user, True, state, notes)
 
-    return jsonify({'success': True, 'message': 'Pickup marked as completed!'})
+    if not changed:
+        return jsonify({'success': True, 'changed': False, 'message': 'Pickup was already completed.'})
+    return jsonify({'success': True, 'changed': True, 'message': 'Pickup marked as completed!'})
 
 
-@app.route('/collector/uncomplete/<int:pickup_id>', methods=['POST'])
+@collector_bp.route('/uncomplete/<int:pickup_id>', methods=['POST'])
 @login_required
 def uncomplete_pickup(pickup_id):
-    pickup = Pickup.query.get_or_404(pickup_id)
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
+
+    state = check_pickup_access([pickup_id], user).get(pickup_id)
+    if state is None:
+        abort(404)
 
     # Enforce ward access for collectors
-    if user.role == 'collector':
-        customer = Customer.query.get(pickup.customer_id)
-        collector_wards = user.get_ward_names()
-        if customer.ward not in collector_wards:
-            return jsonify({'success': False, 'message': 'You do not have access to this ward.'}), 403
+    if not state.allowed:
+        return jsonify({'success': False, 'message': 'You do not have access to this ward.'}), 403
+
+    changed = record_pickup_completion(pickup_id, user, False, state)
+
+    if not changed:
+        return jsonify({'success': True, 'changed': False, 'message': 'Pickup was already incomplete.'})
+    return jsonify({'success': True, 'changed': True, 'message': 'Pickup marked as incomplete!'})
+
+
+MAX_PICKUP_BATCH = 200
+
+
+@collector_bp.route('/csrf-token')
+@login_required
+def collector_csrf_token():
+    """A fresh CSRF token for a device whose page has outlived the one it was rendered with"""
+    return jsonify({'csrf_token': generate_csrf()})
+
+
+@main_bp.app_errorhandler(CSRFError)
+def csrf_error(e):
+    # JSON clients get a body they can recognise, so they refresh the token
+    # and retry instead of treating the request as rejected
+    if request.is_json:
+        return jsonify({'success': False, 'csrf_error': True, 'message': e.description}), 400
+    return e
+
+
+def parse_client_timestamp(value):
+    """Parse an ISO 8601 timestamp sent by a device into naive local time.
+
+    Returns None for missing, malformed or future timestamps so the caller
+    falls back to the server clock.
+    """
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    if parsed > datetime.now() + timedelta(minutes=5):
+        return None
+    return parsed
+
+
+def is_pickup_id(value):
+    """True for an integer id; JSON true/false are bools, which Python counts as ints"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+@collector_bp.route('/pickups/batch', methods=['POST'])
+@login_required
+def batch_update_pickups():
+    """Apply a batch of queued completion taps from a collector's device.
+
+    Expects {"updates": [{"pickup_id", "completed", "notes", "client_timestamp"}, ...]}.
+    Ward access for the whole batch is checked in one query and all changes
+    are committed in one transaction, or in write-behind mode appended to
+    the pickup log with one fsync. Entries are applied in order, so the
+    last tap for a pickup wins.
+    """
+    user = get_current_user()
+    data = request.get_json(silent=True) or {}
+    updates = data.get('updates')
+
+    if not isinstance(updates, list):
+        return jsonify({'success': False, 'message': 'Expected a list of updates.'}), 400
+    if len(updates) > MAX_PICKUP_BATCH:
+        return jsonify({'success': False, 'message': f'At most {MAX_PICKUP_BATCH} updates per batch.'}), 400
+
+    pickup_ids = set()
+    for item in updates:
+        if isinstance(item, dict) and is_pickup_id(item.get('pickup_id')):
+            pickup_ids.add(item['pickup_id'])
+    access = check_pickup_access(pickup_ids, user) if pickup_ids else {}
+    pickup_log = current_app.extensions.get('pickup_log')
+    if pickup_log is not None:
+        access = pickup_log.pending_states(access)
+
+    results = []
+    logged = []
+    for item in updates:
+        pickup_id = item.get('pickup_id') if isinstance(item, dict) else None
+        if not is_pickup_id(pickup_id):
+            results.append({'pickup_id': pickup_id, 'success': False, 'changed': False,
+                            'message': 'Invalid pickup id.'})
+            continue
+        if pickup_id not in access:
+            results.append({'pickup_id': pickup_id, 'success': False, 'changed': False,
+                            'message': 'Pickup not found.'})
+            continue
+
+        state = access[pickup_id]
+        if not state.allowed:
+            results.append({'pickup_id': pickup_id, 'success': False, 'changed': False,
+                            'message': 'You do not have access to this ward.'})
+            continue
+
+        completed = item.get('completed', True)
+        notes = item.get('notes')
+        if not isinstance(completed, bool):
+            results.append({'pickup_id': pickup_id, 'success': False, 'changed': False,
+                            'message': 'completed must be true or false.'})
+            continue
+        if notes is not None and not isinstance(notes, str):
+            results.append({'pickup_id': pickup_id, 'success': False, 'changed': False,
+                            'message': 'notes must be text.'})
+            continue
+
+        completed_by = user.full_name or user.username
+        completed_at = parse_client_timestamp(item.get('client_timestamp'))
+        changed = False
+        if pickup_log is not None:
+            # Every tap is logged, in order; the writer skips the ones that change nothing
+            logged.append(pickup_log_entry(pickup_id, completed, completed_by, notes or '', completed_at))
+            changed = completed != state.completed
+            access[pickup_id] = state._replace(completed=completed)
+        elif completed != state.completed:
+            new_state = set_pickup_completed(
+                pickup_id, completed, state,
+                completed_by=completed_by,
+                notes=notes or '',
+                completed_at=completed_at
+            )
+            if new_state is not None:
+                access[pickup_id] = new_state
+                changed = True
+
+        results.append({'pickup_id': pickup_id, 'success': True, 'changed': changed,
+                        'completed': completed})
+
+    try:
+        if logged:
+            pickup_log.extend(logged)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('Could not save a batch of %d pickup updates', len(updates))
+        return jsonify({'success': False, 'message': 'Error saving pickups.'}), 500
+
+    return jsonify({'success': True, 'results': results})
+
+
+# ==================== WRITE-BEHIND PICKUP LOG ====================
+
+# With PICKUP_WRITE_BEHIND=true, completion taps are appended to a per-process
+# log file and fsynced before the request is acknowledged. A single writer
+# thread applies new log entries every PICKUP_FLUSH_INTERVAL_MS in one
+# transaction, which also stores how far the log has been applied
+# (PickupLogCheckpoint). On restart a log is replayed from its checkpoint,
+# so every acknowledged tap reaches the database exactly once.
+#
+# Each process holds an exclusive lock on its own log. Logs nobody holds were
+# left by a process that died, and are replayed and removed by the next
+# process to start the writer.
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process server only
+    fcntl = None
+
+# Logs are emptied once fully applied and at least this large
+PICKUP_LOG_TRUNCATE_BYTES = 1024 * 1024
+
+
+class PickupWriteBehind:
+    def __init__(self, app, log_dir, interval):
+        self.app = app
+        self.log_dir = log_dir
+        self.interval = interval
+        self.log_name = f'{socket.gethostname()}-{os.getpid()}'
+        self.path = os.path.join(log_dir, f'{self.log_name}.log')
+        self._fd = None
+        # pickup_id -> (log offset after the entry, completed) for taps not yet applied
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """Open this process's log, replay abandoned logs and start the writer"""
+        # After a fork the child must open its own log and run its own writer
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.log_name = f'{socket.gethostname()}-{os.getpid()}'
+            self.path = os.path.join(self.log_dir, f'{self.log_name}.log')
+
+            os.makedirs(self.log_dir, exist_ok=True)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+            with self.app.app_context():
+                self.replay_abandoned()
+                # A log with this name may survive a restart that reused the pid
+                self._apply(self.log_name, self.path)
+
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='pickup-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the writer after a final flush"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def append(self, entry):
+        """Durably record a completion tap. Returns once it is on disk."""
+        self.extend([entry])
+
+    def extend(self, entries):
+        """Durably record completion taps in order, with one fsync. Returns once they are on disk."""
+        self.start()
+        with self._lock:
+            for entry in entries:
+                os.write(self._fd, (json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8'))
+                self._pending[entry['pickup_id']] = (os.fstat(self._fd).st_size, entry['completed'])
+            os.fsync(self._fd)
+
+    def pending_states(self, states):
+        """states ({pickup_id: PickupState} read from the database) with this process's unapplied taps laid over.
+
+        Taps logged by other processes and not yet applied are not seen.
+        """
+        with self._lock:
+            pending = {pickup_id: self._pending[pickup_id][1] for pickup_id in states if pickup_id in self._pending}
+        return {pickup_id: state._replace(completed=pending[pickup_id]) if pickup_id in pending else state
+                for pickup_id, state in states.items()}
+
+    def flush(self):
+        """Apply any unapplied entries of this process's log"""
+        if self._fd is None:
+            return 0
+        with self.app.app_context():
+            try:
+                return self._apply(self.log_name, self.path, truncate=True)
+            finally:
+                db.session.remove()
+
+    def replay_abandoned(self):
+        """Apply and delete logs left behind by processes that have exited"""
+        if not os.path.isdir(self.log_dir):
+            return
+        for filename in sorted(os.listdir(self.log_dir)):
+            log_name, ext = os.path.splitext(filename)
+            if ext != '.log' or log_name == self.log_name:
+                continue
+            path = os.path.join(self.log_dir, filename)
+            fd = os.open(path, os.O_RDWR)
+            try:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue  # Still owned by a running process
+                self._apply(log_name, path)
+                os.unlink(path)
+                PickupLogCheckpoint.query.filter_by(log_name=log_name).delete()
+                db.session.commit()
+            finally:
+                os.close(fd)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                # Entries stay in the log and are retried on the next tick
+                self.app.logger.error(f'Error flushing pickup log: {e}')
+
+    def _apply(self, log_name, path, truncate=False):
+        """Apply complete entries after the checkpoint in one transaction"""
+        checkpoint = db.session.get(PickupLogCheckpoint, log_name)
+        offset = checkpoint.offset if checkpoint else 0
+
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if offset > size:
+                offset = 0  # The log was emptied after its last checkpoint
+            f.seek(offset)
+            data = f.read(size - offset)
+
+        # Only whole lines; a partial last line is still being written
+        end = data.rfind(b'\n') + 1
+        entries = [json.loads(line) for line in data[:end].splitlines()]
+        # One read for the whole flush; each applied tap updates its pickup's state
+        states = pickup_states({entry['pickup_id'] for entry in entries}) if entries else {}
+        applied = 0
+        for entry in entries:
+            state = states.get(entry['pickup_id'])
+            if state is not None and state.completed != entry['completed']:
+                completed_at = entry.get('completed_at')
+                new_state = set_pickup_completed(
+                    entry['pickup_id'],
+                    entry['completed'],
+                    state,
+                    completed_by=entry.get('completed_by'),
+                    notes=entry.get('notes'),
+                    completed_at=datetime.fromisoformat(completed_at) if completed_at else None
+                )
+                if new_state is not None:
+                    states[entry['pickup_id']] = new_state
+            applied += 1
+
+        new_offset = offset + end
+        if applied or not checkpoint or checkpoint.offset != new_offset:
+            db.session.merge(PickupLogCheckpoint(log_name=log_name, offset=new_offset))
+            db.session.commit()
+        if log_name == self.log_name:
+            with self._lock:
+                self._pending = {pickup_id: pending for pickup_id, pending in self._pending.items()
+                                 if pending[0] > new_offset}
+
+        if truncate and new_offset >= PICKUP_LOG_TRUNCATE_BYTES:
+            with self._lock:
+                if os.fstat(self._fd).st_size == new_offset:
+                    os.ftruncate(self._fd, 0)
+                    db.session.merge(PickupLogCheckpoint(log_name=log_name, offset=0))
+                    db.session.commit()
+        return applied
 
-    pickup.completed = False
-    pickup.completed_at = None
-    pickup.completed_by = None
-    pickup.notes = None
 
+@main_bp.before_app_request
+def start_pickup_writer():
+    # Started from a request rather than at import so each forked worker runs its own
+    pickup_log = current_app.extensions.get('pickup_log')
+    if pickup_log is not None:
+        pickup_log.start()
+
+
+# ==================== COMPLETION ROLLUPS ====================
+
+# CompletionRollup keeps pickup and completion counts per day, ward and
+# collector so reports never scan the pickup table. Rows are adjusted in
+# the same transaction that creates or (un)completes a pickup. Archiving
+# pickups leaves them alone, and so does deleting customers for past days:
+# they are history. Today's rows are recomputed after customers are
+# deleted, since their pending pickups are gone and a replace-mode import
+# creates new ones. rebuild_completion_rollups() (backfill_rollups.py)
+# recomputes a date range from the live and archived pickups, counting
+# archived pickups of deleted customers too.
+
+UPSERTS = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}
+
+
+def _not_below_zero(value):
+    return db.case((value < 0, 0), else_=value)
+
+
+def adjust_rollup(day, ward, collector, pickups, completed):
+    """Add to one rollup row, creating it if needed, in a single statement.
+
+    Counts never go below zero: a pickup whose rollup row was lost (e.g. a
+    day rebuilt from history) can't drive it negative when reverted.
+    """
+    table = CompletionRollup.__table__
+    stmt = UPSERTS[db.engine.dialect.name](table).values(
+        day=day, ward=ward or '', collector=collector or '', pickups=max(pickups, 0), completed=max(completed, 0)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['day', 'ward', 'collector'],
+        set_={
+            'pickups': _not_below_zero(table.c.pickups + pickups),
+            'completed': _not_below_zero(table.c.completed + completed),
+        },
+    )
+    db.session.execute(stmt)
+
+
+def move_rollup(day, ward, from_collector, to_collector, completed):
+    """Move one pickup between collectors; completed is +1 when completing, -1 when reverting"""
+    adjust_rollup(day, ward, from_collector, -1, min(completed, 0))
+    adjust_rollup(day, ward, to_collector, 1, max(completed, 0))
+
+
+def rollup_new_pickups(day, pickups):
+    """Count newly created (pending) pickups for day under their wards"""
+    counts = {}
+    for pickup in pickups:
+        counts[pickup.ward] = counts.get(pickup.ward, 0) + 1
+    for ward, count in counts.items():
+        adjust_rollup(day, ward, '', count, 0)
+
+
+def backfill_pickup_wards(conn):
+    """Copy each customer's current ward onto their pickups, used when the column is first added"""
+    conn.execute(db.update(Pickup).values(
+        ward=db.select(Customer.ward).where(Customer.id == Pickup.customer_id).scalar_subquery()
+    ))
+
+
+def backfill_archived_pickup_wards(conn):
+    """Copy each customer's current ward onto their archived pickups, used when the column is first added.
+
+    The archive may be another database, so the wards are read from the
+    live one; pickups of customers deleted since keep no ward.
+    """
+    table = ArchivedPickup.__table__
+    wards = [{'b_customer_id': customer_id, 'b_ward': ward}
+             for customer_id, ward in db.session.query(Customer.id, Customer.ward) if ward]
+    if wards:
+        conn.execute(
+            table.update().where(table.c.customer_id == db.bindparam('b_customer_id')).values(ward=db.bindparam('b_ward')),
+            wards
+        )
+
+
+def rebuild_completion_rollups(start=None, end=None):
+    """Recompute rollups for start..end inclusive (default: all history). Returns rows written."""
+    def in_range(column):
+        return [condition for condition in (
+            column >= start if start else None,
+            column <= end if end else None,
+        ) if condition is not None]
+
+    totals = {}
+
+    def add(day, ward, collector, pickups, completed):
+        key = (day, ward or '', collector or '')
+        row = totals.setdefault(key, [0, 0])
+        row[0] += pickups
+        row[1] += completed or 0
+
+    collector = db.case((Pickup.completed == db.true(), db.func.coalesce(Pickup.completed_by, '')), else_='')
+    ward = db.func.coalesce(Pickup.ward, Customer.ward)
+    live = db.session.query(
+        Pickup.pickup_date, ward, collector,
+        db.func.count(Pickup.id), db.func.sum(db.case((Pickup.completed == db.true(), 1), else_=0)),
+    ).join(Customer).filter(*in_range(Pickup.pickup_date))\
+        .group_by(Pickup.pickup_date, ward, collector)
+    for row in live:
+        add(*row)
+
+    # Archived pickups carry their own ward, so customers deleted since still count
+    archived_collector = db.case(
+        (ArchivedPickup.completed == db.true(), db.func.coalesce(ArchivedPickup.completed_by, '')), else_=''
+    )
+    archived = db.session.query(
+        ArchivedPickup.pickup_date, ArchivedPickup.ward, archived_collector,
+        db.func.count(ArchivedPickup.id),
+        db.func.sum(db.case((ArchivedPickup.completed == db.true(), 1), else_=0)),
+    ).filter(*in_range(ArchivedPickup.pickup_date))\
+        .group_by(ArchivedPickup.pickup_date, ArchivedPickup.ward, archived_collector)
+    for row in archived:
+        add(*row)
+
+    CompletionRollup.query.filter(*in_range(CompletionRollup.day)).delete(synchronize_session=False)
+    rows = [{'day': day, 'ward': ward, 'collector': collector, 'pickups': pickups, 'completed': completed}
+            for (day, ward, collector), (pickups, completed) in totals.items()]
+    for i in range(0, len(rows), 5000):
+        db.session.execute(CompletionRollup.__table__.insert(), rows[i:i + 5000])
     db.session.commit()
+    return len(rows)
+
+
+REPORT_GROUPS = {
+    'ward': [CompletionRollup.ward],
+    'collector': [CompletionRollup.collector],
+    'day': [CompletionRollup.day],
+    'ward_day': [CompletionRollup.ward, CompletionRollup.day],
+}
+
+
+def completion_report(start, end, by='ward'):
+    """Pickups, completions and completion rate for start..end, grouped by REPORT_GROUPS[by]"""
+    columns = REPORT_GROUPS[by]
+    query = db.session.query(
+        *columns, db.func.sum(CompletionRollup.pickups), db.func.sum(CompletionRollup.completed)
+    ).filter(CompletionRollup.day >= start, CompletionRollup.day <= end).group_by(*columns).order_by(*columns)
+    if by == 'collector':
+        # Pending pickups belong to no collector yet
+        query = query.filter(CompletionRollup.collector != '')
+
+    rows = []
+    for *keys, pickups, completed in query:
+        row = {column.key: key.isoformat() if isinstance(key, date) else key for column, key in zip(columns, keys)}
+        row.update(pickups=pickups or 0, completed=completed or 0)
+        if by != 'collector':
+            row['rate'] = round(100 * row['completed'] / row['pickups'], 1) if row['pickups'] else None
+        rows.append(row)
+    return rows
+
+
+def report_range():
+    """(start, end, days) from the request's ?days= (default 90), ending today"""
+    days = max(1, min(request.args.get('days', 90, type=int), 3660))
+    end = date.today()
+    return end - timedelta(days=days - 1), end, days
+
+
+@admin_bp.route('/reports/completion')
+@admin_required
+def completion_reports():
+    start, end, days = report_range()
+    return render_template(
+        'admin_reports.html',
+        days=days, start=start, end=end,
+        by_ward=completion_report(start, end, 'ward'),
+        by_collector=completion_report(start, end, 'collector'),
+        by_day=completion_report(start, end, 'day'),
+    )
+
+
+@admin_bp.route('/reports/completion.json')
+@admin_required
+def completion_reports_json():
+    start, end, days = report_range()
+    by = request.args.get('by', 'ward')
+    if by not in REPORT_GROUPS:
+        return jsonify({'success': False, 'message': f'by must be one of {", ".join(REPORT_GROUPS)}.'}), 400
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'by': by,
+        'rows': completion_report(start, end, by),
+    })
 
-    return jsonify({'success': True, 'message': 'Pickup marked as incomplete!'})
+
+# ==================== ROUTE PACE ====================
+
+# Time between a collector's consecutive completions, computed in SQL with
+# LAG(). A gap of PACE_IDLE_MINUTES or more is an idle gap; a shorter gap
+# more than PACE_SLOW_FACTOR times the collector's median for that day is
+# a slow stop. Finished days are summarized once into RoutePaceDay; today
+# is always computed live.
+
+DEFAULT_CONFIG['PACE_SLOW_FACTOR'] = float(os.environ.get('PACE_SLOW_FACTOR', 3))
+DEFAULT_CONFIG['PACE_IDLE_MINUTES'] = int(os.environ.get('PACE_IDLE_MINUTES', 30))
+
+MAX_PACE_RANGE_DAYS = 92
+
+
+def seconds_between(dialect, later, earlier):
+    if dialect == 'sqlite':
+        return (db.func.julianday(later) - db.func.julianday(earlier)) * 86400
+    return db.cast(db.extract('epoch', later - earlier), db.Float)
+
+
+def stop_gaps(model, day):
+    """Completed stops on day, each with the seconds since the same collector's previous one"""
+    dialect = db.session.get_bind(mapper=db.inspect(model)).dialect.name
+    previous_at = db.func.lag(model.completed_at).over(
+        partition_by=model.completed_by, order_by=(model.completed_at, model.id)
+    )
+    stops = db.session.query(
+        model.id.label('pickup_id'), model.customer_id, model.completed_by, model.completed_at,
+        previous_at.label('previous_at'),
+    ).filter(
+        model.pickup_date == day,
+        model.completed == db.true(),
+        model.completed_at.isnot(None),
+        model.completed_by.isnot(None),
+    ).subquery()
+    gap = seconds_between(dialect, stops.c.completed_at, stops.c.previous_at).label('gap_seconds')
+    return db.session.query(stops, gap).order_by(stops.c.completed_by, stops.c.completed_at).all()
+
+
+def summarize_pace(day, stops):
+    """One unsaved RoutePaceDay per collector from stop_gaps() rows"""
+    slow_factor = current_app.config['PACE_SLOW_FACTOR']
+    idle_limit = current_app.config['PACE_IDLE_MINUTES'] * 60
+    by_collector = {}
+    for stop in stops:
+        by_collector.setdefault(stop.completed_by, []).append(stop)
+
+    summaries = []
+    for collector, collector_stops in by_collector.items():
+        gaps = [stop.gap_seconds for stop in collector_stops if stop.gap_seconds is not None]
+        working_gaps = [gap for gap in gaps if gap < idle_limit]
+        median = statistics.median(working_gaps) if working_gaps else None
+
+        flags = []
+        for stop in collector_stops:
+            if stop.gap_seconds is None:
+                continue
+            if stop.gap_seconds >= idle_limit:
+                kind = 'idle'
+            elif median and stop.gap_seconds > slow_factor * median:
+                kind = 'slow'
+            else:
+                continue
+            flags.append({
+                'kind': kind,
+                'pickup_id': stop.pickup_id,
+                'customer_id': stop.customer_id,
+                'completed_at': stop.completed_at.isoformat(),
+                'gap_seconds': round(stop.gap_seconds),
+            })
+
+        summaries.append(RoutePaceDay(
+            day=day,
+            collector=collector,
+            stops=len(collector_stops),
+            started_at=collector_stops[0].completed_at,
+            finished_at=collector_stops[-1].completed_at,
+            median_gap_seconds=median,
+            slow_stops=sum(1 for flag in flags if flag['kind'] == 'slow'),
+            idle_gaps=sum(1 for flag in flags if flag['kind'] == 'idle'),
+            idle_seconds=sum(gap for gap in gaps if gap >= idle_limit),
+            flags=json.dumps(flags),
+        ))
+    return summaries
+
+
+def route_pace(day):
+    """RoutePaceDay rows for day, from the cache once the day is over"""
+    finished = day < date.today()
+    if finished:
+        cached = RoutePaceDay.query.filter_by(day=day).order_by(RoutePaceDay.collector).all()
+        if cached:
+            return [row for row in cached if row.collector]
+
+    stops = stop_gaps(Pickup, day)
+    cutoff = archive_cutoff()
+    if not stops and cutoff is not None and day < cutoff:
+        stops = stop_gaps(ArchivedPickup, day)
+    summaries = summarize_pace(day, stops)
+
+    if finished:
+        db.session.add_all(summaries or [RoutePaceDay(day=day, collector='')])
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request cached the same day first
+            db.session.rollback()
+    return summaries
+
+
+def pace_by_collector(start, end):
+    """Pace per collector over start..end, for sizing routes"""
+    totals = {}
+    day = start
+    while day <= end:
+        for row in route_pace(day):
+            total = totals.setdefault(row.collector, {
+                'collector': row.collector, 'days': 0, 'stops': 0, 'active_seconds': 0.0,
+                'slow_stops': 0, 'idle_gaps': 0, 'medians': [],
+            })
+            total['days'] += 1
+            total['stops'] += row.stops
+            total['active_seconds'] += row.active_seconds
+            total['slow_stops'] += row.slow_stops
+            total['idle_gaps'] += row.idle_gaps
+            if row.median_gap_seconds is not None:
+                total['medians'].append(row.median_gap_seconds)
+        day += timedelta(days=1)
+
+    results = []
+    for total in sorted(totals.values(), key=lambda t: t['collector']):
+        medians = total.pop('medians')
+        total['median_gap_seconds'] = round(statistics.median(medians)) if medians else None
+        total['stops_per_hour'] = round(total['stops'] / (total['active_seconds'] / 3600), 1) if total['active_seconds'] else None
+        total['active_hours'] = round(total.pop('active_seconds') / 3600, 1)
+        results.append(total)
+    return results
+
+
+def serialize_pace(row):
+    return {
+        'day': row.day.isoformat(),
+        'collector': row.collector,
+        'stops': row.stops,
+        'started_at': row.started_at.isoformat() if row.started_at else None,
+        'finished_at': row.finished_at.isoformat() if row.finished_at else None,
+        'median_gap_seconds': round(row.median_gap_seconds) if row.median_gap_seconds is not None else None,
+        'stops_per_hour': row.stops_per_hour,
+        'slow_stops': row.slow_stops,
+        'idle_gaps': row.idle_gaps,
+        'idle_seconds': round(row.idle_seconds),
+        'flags': row.flag_list(),
+    }
+
+
+@admin_bp.route('/reports/pace')
+@admin_required
+def route_pace_report():
+    try:
+        day = date.fromisoformat(request.args.get('date', date.today().isoformat()))
+    except ValueError:
+        day = date.today()
+    rows = route_pace(day)
+    customer_ids = {flag['customer_id'] for row in rows for flag in row.flag_list()}
+    customers = {c.id: c for c in Customer.query.filter(Customer.id.in_(customer_ids))} if customer_ids else {}
+    return render_template(
+        'admin_pace.html',
+        day=day,
+        rows=rows,
+        customers=customers,
+        idle_minutes=current_app.config['PACE_IDLE_MINUTES'],
+        slow_factor=current_app.config['PACE_SLOW_FACTOR'],
+    )
+
+
+@admin_bp.route('/reports/pace.json')
+@admin_required
+def route_pace_json():
+    """?date= for one day's collectors and flagged stops, or ?from=&to= for pace per collector"""
+    try:
+        if 'from' in request.args:
+            start = date.fromisoformat(request.args['from'])
+            end = date.fromisoformat(request.args.get('to', date.today().isoformat()))
+        else:
+            day = date.fromisoformat(request.args.get('date', date.today().isoformat()))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Dates must be YYYY-MM-DD.'}), 400
+
+    if 'from' not in request.args:
+        return jsonify({'date': day.isoformat(), 'collectors': [serialize_pace(row) for row in route_pace(day)]})
+    if end < start or (end - start).days >= MAX_PACE_RANGE_DAYS:
+        return jsonify({'success': False, 'message': f'Ranges are limited to {MAX_PACE_RANGE_DAYS} days.'}), 400
+    return jsonify({'from': start.isoformat(), 'to': end.isoformat(), 'collectors': pace_by_collector(start, end)})
+
+
+# ==================== EXPIRY SWEEP ====================
+
+# Route queries select customers by Customer.serviceable instead of checking
+# active and subscription_end on every row, so they become a plain index
+# lookup. The flag is recomputed whenever a customer is saved; the only thing
+# that changes it without a save is time passing, which expiry_sweep() covers
+# once a day. Every flip is written to ServiceabilityChange. The day an app
+# last checked for a sweep is kept in app.extensions['swept_day'].
+
+
+@db.event.listens_for(db.session, 'before_flush')
+def _update_serviceable(session, flush_context, instances):
+    today = date.today()
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Customer):
+            continue
+        serviceable = bool(obj.serviceable_on(today))
+        if obj in session.new:
+            obj.serviceable = serviceable
+        elif obj.serviceable != serviceable:
+            obj.serviceable = serviceable
+            session.add(ServiceabilityChange(
+                customer_id=obj.id, changed_at=datetime.now(), serviceable=serviceable,
+                reason='customer_updated', subscription_end=obj.subscription_end
+            ))
+
+
+def backfill_serviceable(conn):
+    """Set serviceable for every customer, used when the column is first added"""
+    conn.execute(db.update(Customer).values(serviceable=Customer.serviceable_on(date.today())))
+
+
+def expiry_sweep(today=None):
+    """Take customers whose subscription ended before today out of service.
+
+    Logs a 'subscription_lapsed' change for each one and records the run.
+    Runs in its own transaction, so a request that triggers it keeps its
+    session as it was. Returns the number of customers lapsed; 0 if
+    another process swept at the same moment.
+    """
+    today = today or date.today()
+    now = datetime.now()
+    try:
+        with db.engine.begin() as conn:
+            lapsed = conn.execute(db.select(Customer.id, Customer.subscription_end).where(
+                Customer.serviceable == db.true(),
+                Customer.subscription_end < today
+            )).all()
+            if lapsed:
+                # Lapsed customers are changes like any other save, so devices pick them up on sync
+                conn.execute(db.update(ChangeCounter).where(ChangeCounter.id == 1)
+                             .values(value=ChangeCounter.value + 1))
+                seq = conn.execute(db.select(ChangeCounter.value).where(ChangeCounter.id == 1)).scalar()
+                conn.execute(db.update(Customer).where(Customer.id.in_([row.id for row in lapsed]))
+                             .values(serviceable=False, change_seq=seq))
+                conn.execute(db.insert(ServiceabilityChange), [{
+                    'customer_id': row.id, 'changed_at': now, 'serviceable': False,
+                    'reason': 'subscription_lapsed', 'subscription_end': row.subscription_end
+                } for row in lapsed])
+
+            if conn.execute(db.select(ExpirySweepRun.day).where(ExpirySweepRun.day == today)).first() is None:
+                conn.execute(db.insert(ExpirySweepRun).values(day=today, ran_at=now, lapsed=len(lapsed)))
+            else:
+                conn.execute(db.update(ExpirySweepRun).where(ExpirySweepRun.day == today).values(
+                    ran_at=now, lapsed=ExpirySweepRun.lapsed + len(lapsed)
+                ))
+    except IntegrityError:
+        return 0
+    return len(lapsed)
+
+
+def ensure_expiry_sweep():
+    """Run today's sweep if no process has yet; checked once per day per process and app"""
+    today = date.today()
+    if current_app.extensions['swept_day'] != today:
+        # Read apart from the caller's session, so pending changes in it aren't flushed
+        with db.engine.connect() as conn:
+            swept = conn.execute(db.select(ExpirySweepRun.day).where(ExpirySweepRun.day == today)).first()
+        if swept is None:
+            expiry_sweep(today)
+        current_app.extensions['swept_day'] = today
+
+
+def serviceable_filter(day):
+    """Conditions selecting the customers who are in service on a day"""
+    if day == date.today():
+        ensure_expiry_sweep()
+        return [Customer.serviceable == db.true()]
+    return [Customer.serviceable_on(day)]
+
+
+@admin_bp.route('/reports/expiries')
+@admin_required
+def expiry_report():
+    """Customers the sweep took out of service, newest first, for renewal follow-up"""
+    start, end, days = report_range()
+    ensure_expiry_sweep()
+    changes = db.session.query(ServiceabilityChange, Customer).outerjoin(
+        Customer, Customer.id == ServiceabilityChange.customer_id
+    ).filter(
+        ServiceabilityChange.reason == 'subscription_lapsed',
+        ServiceabilityChange.changed_at >= datetime.combine(start, datetime.min.time())
+    ).order_by(ServiceabilityChange.changed_at.desc(), ServiceabilityChange.id.desc()).all()
+    return render_template('admin_expiries.html', changes=changes, days=days, start=start, end=end)
+
+
+# ==================== SCHEDULE OCCURRENCES ====================
+
+# Which customers are due on a day depends on the weekday flags and, for
+# biweekly and monthly customers, on the week (see is_due()). Rather than
+# evaluate that on every route query, the customers due on each day from
+# today to SCHEDULE_HORIZON_DAYS ahead are stored in PickupOccurrence, so
+# "who is due today" is one probe on its (day, customer_id) key. Days are
+# added as the horizon moves and dropped once they are past; saving a
+# customer rewrites that customer's rows. Days outside the horizon fall back
+# to the weekday flags plus is_due() for the non-weekly customers. Each app
+# remembers the (today, last day) window it has checked in
+# app.extensions['occurrence_window'].
+
+DEFAULT_CONFIG['SCHEDULE_HORIZON_DAYS'] = int(os.environ.get('SCHEDULE_HORIZON_DAYS', 28))
+
+SCHEDULE_FIELDS = WEEKDAY_COLUMNS + ('recurrence', 'recurrence_weeks', 'schedule_anchor')
+
+
+def schedule_rows(*conditions, connection=None):
+    """id and the columns is_due() reads for customers with at least one pickup weekday"""
+    return (connection or db.session).execute(
+        db.select(Customer.id, *[getattr(Customer, name) for name in SCHEDULE_FIELDS]).where(
+            db.or_(*[getattr(Customer, name) == 1 for name in WEEKDAY_COLUMNS]), *conditions
+        )
+    ).all()
+
+
+def occurrence_rows(customers, days):
+    return [{'day': day, 'customer_id': customer.id}
+            for day in days for customer in customers if is_due(customer, day)]
+
+
+def index_occurrences(today, days):
+    """Drop occurrences before today and add those for days, in one transaction.
+
+    Runs on its own connection, so the caller's session (scheduled_filter()
+    is used by read-only pages) is neither committed nor joined.
+    """
+    with db.engine.begin() as conn:
+        # Taken first so a customer save can't rewrite its rows halfway through
+        conn.execute(db.update(ChangeCounter).where(ChangeCounter.id == 1).values(value=ChangeCounter.value + 1))
+        conn.execute(db.delete(PickupOccurrence).where(PickupOccurrence.day < today))
+        conn.execute(db.delete(OccurrenceDay).where(OccurrenceDay.day < today))
+        if days:
+            insert = UPSERTS[conn.dialect.name]
+            rows = occurrence_rows(schedule_rows(connection=conn), days)
+            if rows:
+                conn.execute(insert(PickupOccurrence.__table__).on_conflict_do_nothing(), rows)
+            conn.execute(insert(OccurrenceDay.__table__).on_conflict_do_nothing(),
+                         [{'day': day} for day in days])
+
+
+def ensure_occurrences():
+    """Index any missing days of the horizon; checked once per day per process and app. Returns the last indexed day."""
+    window = current_app.extensions['occurrence_window']
+    today = date.today()
+    if window is None or window[0] != today:
+        horizon = [today + timedelta(days=i) for i in range(current_app.config['SCHEDULE_HORIZON_DAYS'])]
+        # Read apart from the caller's session too, so pending changes in it aren't flushed
+        with db.engine.connect() as conn:
+            indexed = {row[0] for row in conn.execute(db.select(OccurrenceDay.day).where(OccurrenceDay.day >= today))}
+            stale = conn.execute(db.select(OccurrenceDay.day).where(OccurrenceDay.day < today).limit(1)).first()
+        missing = [day for day in horizon if day not in indexed]
+        if missing or stale:
+            index_occurrences(today, missing)
+        window = current_app.extensions['occurrence_window'] = (today, horizon[-1])
+    return window[1]
+
+
+def clear_occurrences(customer_ids=None):
+    """Remove indexed occurrences of the given customers, or of all of them, for bulk deletes.
+
+    The indexed days are kept: customers added afterwards, as by a
+    replace-mode import, are indexed for them by _reindex_occurrences, and
+    every app's occurrence window stays true.
+    """
+    if customer_ids is None:
+        PickupOccurrence.query.delete()
+    else:
+        PickupOccurrence.query.filter(PickupOccurrence.customer_id.in_(customer_ids)).delete(synchronize_session=False)
+
+
+@db.event.listens_for(db.session, 'after_flush')
+def _reindex_occurrences(session, flush_context):
+    changed = [
+        obj for obj in list(session.new) + list(session.dirty)
+        if isinstance(obj, Customer) and (obj in session.new or any(
+            db.inspect(obj).attrs[name].history.has_changes() for name in SCHEDULE_FIELDS
+        ))
+    ]
+    removed = [obj.id for obj in session.deleted if isinstance(obj, Customer)]
+    if not changed and not removed:
+        return
+    today = date.today()
+    conn = session.connection()
+    conn.execute(db.delete(PickupOccurrence).where(
+        PickupOccurrence.customer_id.in_([obj.id for obj in changed] + removed),
+        PickupOccurrence.day >= today
+    ))
+    days = [row[0] for row in conn.execute(db.select(OccurrenceDay.day).where(OccurrenceDay.day >= today))]
+    rows = occurrence_rows(changed, days)
+    if rows:
+        conn.execute(db.insert(PickupOccurrence), rows)
+
+
+def backfill_recurrence(conn):
+    """Parse every customer's frequency, used when the recurrence columns are first added"""
+    table = Customer.__table__
+    updates = []
+    for customer_id, frequency in conn.execute(db.select(table.c.id, table.c.frequency)):
+        recurrence, weeks = parse_frequency(frequency)
+        if recurrence != 'weekly':
+            updates.append({'b_id': customer_id, 'b_recurrence': recurrence, 'b_weeks': weeks})
+    if updates:
+        conn.execute(
+            table.update().where(table.c.id == db.bindparam('b_id')).values(
+                recurrence=db.bindparam('b_recurrence'), recurrence_weeks=db.bindparam('b_weeks')
+            ),
+            updates
+        )
+
+
+def scheduled_filter(day):
+    """Conditions selecting the customers due a pickup on a day, before any serviceability check"""
+    day_column = get_day_column(day)
+    if day_column is None:
+        return [db.false()]
+    if date.today() <= day <= ensure_occurrences():
+        return [Customer.id.in_(db.select(PickupOccurrence.customer_id).where(PickupOccurrence.day == day))]
+    due = [row.id for row in schedule_rows(day_column == 1, Customer.recurrence != 'weekly') if is_due(row, day)]
+    return [day_column == 1,
+            db.or_(Customer.recurrence.is_(None), Customer.recurrence == 'weekly', Customer.id.in_(due))]
+
+
+# ==================== CAPACITY PLANNING ====================
+
+# Expected waste volume for the coming service days, from the litre columns
+# parsed out of bin_size. Each day's totals per ward come from one grouped
+# query; collectors are then given an even share of each ward they work so
+# loads can be balanced against TRUCK_CAPACITY_LITRES before routes start.
+
+DEFAULT_CONFIG['TRUCK_CAPACITY_LITRES'] = int(os.environ.get('TRUCK_CAPACITY_LITRES', 10000))
+
+CAPACITY_DAYS = 6
+
+
+def backfill_bin_volumes(conn):
+    """Parse every customer's bin sizes, used when the litre columns are first added"""
+    table = Customer.__table__
+    updates = []
+    for customer_id, bin_size, bin_qty in conn.execute(db.select(table.c.id, table.c.bin_size, table.c.bin_qty)):
+        bin_litres, pickup_litres = bin_volumes(bin_size, bin_qty)
+        if bin_litres is not None:
+            updates.append({'b_id': customer_id, 'b_bin': bin_litres, 'b_pickup': pickup_litres})
+    if updates:
+        conn.execute(
+            table.update().where(table.c.id == db.bindparam('b_id')).values(
+                bin_litres=db.bindparam('b_bin'), pickup_litres=db.bindparam('b_pickup')
+            ),
+            updates
+        )
+
+
+def service_days(start, count=CAPACITY_DAYS):
+    """The first count days from start that have collections (Monday to Saturday)"""
+    days = []
+    day = start
+    while len(days) < count:
+        if get_day_column(day) is not None:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def capacity_plan(start):
+    """Expected stops and litres per ward and per collector for the service days from start.
+
+    Customers whose bin size couldn't be read count as stops and are
+    reported as unknown volume.
+    """
+    days = service_days(start)
+    columns = []
+    for day in days:
+        scheduled = db.and_(*scheduled_filter(day), *serviceable_filter(day))
+        columns += [
+            db.func.sum(db.case((scheduled, Customer.pickup_litres), else_=0)),
+            db.func.sum(db.case((scheduled, 1), else_=0)),
+            db.func.sum(db.case((db.and_(scheduled, Customer.pickup_litres.is_(None)), 1), else_=0)),
+        ]
+    rows = db.session.query(Customer.ward, *columns).group_by(Customer.ward).order_by(Customer.ward).all()
+
+    wards = []
+    for row in rows:
+        loads = [
+            {'date': day.isoformat(), 'litres': int(row[1 + 3 * i] or 0),
+             'stops': int(row[2 + 3 * i] or 0), 'unknown': int(row[3 + 3 * i] or 0)}
+            for i, day in enumerate(days)
+        ]
+        if any(load['stops'] for load in loads):
+            wards.append({'ward': row[0] or '', 'days': loads})
+
+    workers = {}
+    for ward, name in db.session.query(CollectorWard.ward, db.func.coalesce(User.full_name, User.username))\
+            .join(User).filter(User.role == 'collector'):
+        workers.setdefault(ward, []).append(name)
+
+    collectors = {}
+    for ward in wards:
+        names = workers.get(ward['ward']) or ['Unassigned']
+        for name in names:
+            entry = collectors.setdefault(name, {
+                'collector': name, 'wards': [],
+                'days': [{'date': day.isoformat(), 'litres': 0.0, 'stops': 0.0} for day in days]
+            })
+            entry['wards'].append(ward['ward'])
+            for total, load in zip(entry['days'], ward['days']):
+                total['litres'] += load['litres'] / len(names)
+                total['stops'] += load['stops'] / len(names)
+    for entry in collectors.values():
+        for total in entry['days']:
+            total['litres'] = round(total['litres'])
+            total['stops'] = round(total['stops'])
+
+    totals = [
+        {'date': day.isoformat(),
+         'litres': sum(ward['days'][i]['litres'] for ward in wards),
+         'stops': sum(ward['days'][i]['stops'] for ward in wards),
+         'unknown': sum(ward['days'][i]['unknown'] for ward in wards)}
+        for i, day in enumerate(days)
+    ]
+    return {
+        'days': [day.isoformat() for day in days],
+        'truck_capacity_litres': current_app.config['TRUCK_CAPACITY_LITRES'],
+        'wards': wards,
+        'collectors': sorted(collectors.values(), key=lambda entry: entry['collector']),
+        'totals': totals,
+    }
+
+
+@admin_bp.route('/reports/capacity')
+@admin_required
+def capacity_report():
+    try:
+        start = date.fromisoformat(request.args.get('from', date.today().isoformat()))
+    except ValueError:
+        start = date.today()
+    plan = capacity_plan(start)
+    return render_template('admin_capacity.html', start=start, plan=plan,
+                           days=[date.fromisoformat(day) for day in plan['days']])
+
+
+@admin_bp.route('/reports/capacity.json')
+@admin_required
+def capacity_report_json():
+    """?from= (default today) for the next six service days"""
+    try:
+        start = date.fromisoformat(request.args.get('from', date.today().isoformat()))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Dates must be YYYY-MM-DD.'}), 400
+    return jsonify(capacity_plan(start))
+
+
+# ==================== PICKUP ARCHIVE ====================
+
+# The pickup table gains a row per scheduled customer per service day.
+# archive_pickups() moves whole months older than PICKUP_ARCHIVE_DAYS into
+# the archive database and leaves a PickupMonthSummary row per customer per
+# month behind, so the live table only holds recent history. Run it from
+# archive_pickups.py (e.g. nightly). Dates before the cutoff are read-only:
+# admin_pickups shows them from both tables and no longer creates pickups.
+
+ARCHIVE_BATCH_SIZE = 5000
+
+
+def archive_cutoff(today=None):
+    """First date that stays live, or None when archiving is off"""
+    days = current_app.config['PICKUP_ARCHIVE_DAYS']
+    if days <= 0:
+        return None
+    return ((today or date.today()) - timedelta(days=days)).replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def archive_pickups(cutoff=None):
+    """Archive every live pickup dated before cutoff, a month at a time. Returns the number moved."""
+    cutoff = cutoff or archive_cutoff()
+    if cutoff is None:
+        return 0
+    moved = 0
+    while True:
+        oldest = db.session.query(db.func.min(Pickup.pickup_date)).filter(Pickup.pickup_date < cutoff).scalar()
+        if oldest is None:
+            return moved
+        start = oldest.replace(day=1)
+        moved += archive_month(start, min(next_month(start), cutoff))
+
+
+def archive_month(start, end):
+    """Move pickups dated in [start, end) to the archive and fold them into the month summary"""
+    in_range = (Pickup.pickup_date >= start, Pickup.pickup_date < end)
+    # Rows created for these dates after this point are left for the next run
+    max_id = db.session.query(db.func.max(Pickup.id)).filter(*in_range).scalar()
+    if max_id is None:
+        return 0
+    batch_filter = in_range + (Pickup.id <= max_id,)
+
+    # Copy first, keeping ids, so a run interrupted before the delete below
+    # resumes without duplicating anything in the archive
+    columns = [Pickup.id, Pickup.customer_id, Pickup.pickup_date, Pickup.completed,
+               Pickup.completed_at, Pickup.completed_by, Pickup.notes, Pickup.ward]
+    last_id = 0
+    while True:
+        rows = db.session.query(*columns).filter(*batch_filter, Pickup.id > last_id)\
+            .order_by(Pickup.id).limit(ARCHIVE_BATCH_SIZE).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        copied = {pickup_id for (pickup_id,) in db.session.query(ArchivedPickup.id)
+                  .filter(ArchivedPickup.id.in_([row.id for row in rows]))}
+        new_rows = [row._asdict() for row in rows if row.id not in copied]
+        if new_rows:
+            db.session.execute(ArchivedPickup.__table__.insert(), new_rows)
+        db.session.commit()
+
+    # Summaries and the delete share one transaction on the live database
+    totals = db.session.query(
+        Pickup.customer_id,
+        db.func.count(Pickup.id),
+        db.func.sum(db.case((Pickup.completed == db.true(), 1), else_=0)),
+        db.func.max(Pickup.completed_at),
+    ).filter(*batch_filter).group_by(Pickup.customer_id).all()
+    month = start.replace(day=1)
+    summaries = {summary.customer_id: summary for summary in PickupMonthSummary.query.filter_by(month=month)}
+    for customer_id, scheduled, completed, last_completed_at in totals:
+        summary = summaries.get(customer_id)
+        if summary is None:
+            summary = PickupMonthSummary(customer_id=customer_id, month=month, scheduled=0, completed=0)
+            db.session.add(summary)
+        summary.scheduled += scheduled
+        summary.completed += completed or 0
+        if last_completed_at and (summary.last_completed_at is None or last_completed_at > summary.last_completed_at):
+            summary.last_completed_at = last_completed_at
+    moved = Pickup.query.filter(*batch_filter).delete(synchronize_session=False)
+    db.session.commit()
+    return moved
+
+
+def archived_pickups_for_day(day):
+    """Archived pickups on day, with .customer attached like a live Pickup (customers since deleted are skipped)"""
+    archived = ArchivedPickup.query.filter_by(pickup_date=day).all()
+    customers = {c.id: c for c in Customer.query.filter(Customer.id.in_({p.customer_id for p in archived}))}
+    pickups = []
+    for pickup in archived:
+        pickup.customer = customers.get(pickup.customer_id)
+        if pickup.customer is not None:
+            pickups.append(pickup)
+    return pickups
+
+
+def pickup_history(customer_id, start, end):
+    """A customer's pickups dated start..end inclusive, from the live table and the archive"""
+    live = Pickup.query.filter(Pickup.customer_id == customer_id,
+                               Pickup.pickup_date >= start, Pickup.pickup_date <= end).all()
+    archived = ArchivedPickup.query.filter(ArchivedPickup.customer_id == customer_id,
+                                           ArchivedPickup.pickup_date >= start,
+                                           ArchivedPickup.pickup_date <= end).all()
+    return sorted(live + archived, key=lambda p: (p.pickup_date, p.id))
+
+
+@admin_bp.route('/customers/<int:id>/history')
+@admin_required
+def customer_pickup_history(id):
+    """Monthly totals and individual pickups for a date range (default: the last 90 days)"""
+    customer = Customer.query.get_or_404(id)
+    try:
+        end = date.fromisoformat(request.args.get('to', date.today().isoformat()))
+        start = date.fromisoformat(request.args.get('from', (end - timedelta(days=90)).isoformat()))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'from and to must be YYYY-MM-DD dates.'}), 400
+
+    months = PickupMonthSummary.query.filter(
+        PickupMonthSummary.customer_id == customer.id,
+        PickupMonthSummary.month.between(start.replace(day=1), end)
+    ).order_by(PickupMonthSummary.month).all()
+    return jsonify({
+        'customer_id': customer.id,
+        'months': [{
+            'month': m.month.strftime('%Y-%m'),
+            'scheduled': m.scheduled,
+            'completed': m.completed,
+            'last_completed_at': m.last_completed_at.isoformat() if m.last_completed_at else None,
+        } for m in months],
+        'pickups': [
+            dict(serialize_pickup(p), pickup_date=p.pickup_date.isoformat(), archived=isinstance(p, ArchivedPickup))
+            for p in pickup_history(customer.id, start, end)
+        ],
+    })
 
 
 # ==================== SETTINGS ROUTES ====================
 
+# pandas (and numpy and openpyxl behind it) is imported inside the import,
+# export and backup functions only: it roughly doubles import time and adds
+# tens of MB to every process, and most workers never touch a spreadsheet.
+
 def allowed_file(filename):
     """Check if file has allowed extension"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'xlsx', 'xls'}
 
 
+def parse_coordinate(value, limit):
+    """Return value as a float within +/-limit degrees, or None if it is blank or out of range"""
+    try:
+        number = float(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(number) or abs(number) > limit:
+        return None
+    return number
+
+
+def coordinate_pair(latitude, longitude):
+    """Return (latitude, longitude) as floats, or (None, None) unless both are valid"""
+    latitude, longitude = parse_coordinate(latitude, 90), parse_coordinate(longitude, 180)
+    if latitude is None or longitude is None:
+        return None, None
+    return latitude, longitude
+
+
+def sheet_coordinates(row):
+    """Read a master log row's Latitude/Longitude columns, or a combined "lat, lng" Coordinates column.
+
+    Returns {} when the sheet has neither, so an update import keeps the
+    coordinates already entered in the app.
+    """
+    if 'Latitude' in row.index and 'Longitude' in row.index:
+        latitude, longitude = row.get('Latitude'), row.get('Longitude')
+    elif 'Coordinates' in row.index:
+        parts = str(row.get('Coordinates')).split(',')
+        latitude, longitude = parts if len(parts) == 2 else (None, None)
+    else:
+        return {}
+    latitude, longitude = coordinate_pair(latitude, longitude)
+    return {'latitude': latitude, 'longitude': longitude}
+
+
 def is_day_scheduled(value):
     """Check if a day column value indicates the day is scheduled.
     Handles: 1, 1.0, 'X', 'x', '1', True, and similar values."""
+    import pandas as pd
+
     if pd.isna(value):
         return False
     if isinstance(value, (int, float)):
@@ -956,7 +4240,7 @@ def is_day_scheduled(value):
     return False
 
 
-@app.route('/admin/settings', methods=['GET'])
+@admin_bp.route('/settings', methods=['GET'])
 @admin_required
 def settings():
     """Settings page with file upload"""
@@ -964,23 +4248,37 @@ def settings():
     return render_template('settings.html', customer_count=customer_count)
 
 
-@app.route('/admin/settings/upload', methods=['POST'])
+@admin_bp.route('/slow-queries')
+@admin_required
+def admin_slow_queries():
+    """Slowest statement shapes recorded in the slow-query log, by total time"""
+    return render_template(
+        'admin_slow_queries.html',
+        offenders=slow_query_offenders(),
+        threshold_ms=current_app.config['SLOW_QUERY_MS'],
+    )
+
+
+@admin_bp.route('/settings/upload', methods=['POST'])
 @admin_required
+@track_job('upload_excel')
 def upload_excel():
     """Handle Excel file upload and update database"""
+    import pandas as pd
+
     if 'excel_file' not in request.files:
         flash('No file selected', 'danger')
-        return redirect(url_for('settings'))
+        return redirect(url_for('admin.settings'))
 
     file = request.files['excel_file']
 
     if file.filename == '':
         flash('No file selected', 'danger')
-        return redirect(url_for('settings'))
+        return redirect(url_for('admin.settings'))
 
     if not allowed_file(file.filename):
         flash('Invalid file type. Please upload an Excel file (.xlsx or .xls)', 'danger')
-        return redirect(url_for('settings'))
+        return redirect(url_for('admin.settings'))
 
     try:
         df = pd.read_excel(file, sheet_name='Service Log', header=1)
@@ -990,8 +4288,11 @@ def upload_excel():
         import_mode = request.form.get('import_mode', 'update')
 
         if import_mode == 'replace':
+            Pickup.query.delete()
+            clear_occurrences()
             deleted_count = Customer.query.delete()
             db.session.commit()
+            rebuild_completion_rollups(date.today(), date.today())
             flash(f'Deleted {deleted_count} existing customers', 'info')
 
         imported = 0
@@ -1026,6 +4327,7 @@ def upload_excel():
                     'friday': 1 if is_day_scheduled(row.get('Fri')) else 0,
                     'saturday': 1 if is_day_scheduled(row.get('Sat')) else 0,
                 }
+                customer_data.update(sheet_coordinates(row))
 
                 # Handle amount paid
                 amount = row.get('Amount Paid')
@@ -1069,6 +4371,7 @@ def upload_excel():
                 continue
 
         db.session.commit()
+        count_job_rows(imported + updated)
 
         msg_parts = []
         if imported > 0:
@@ -1088,13 +4391,16 @@ def upload_excel():
     except Exception as e:
         flash(f'Error processing file: {str(e)}', 'danger')
 
-    return redirect(url_for('settings'))
+    return redirect(url_for('admin.settings'))
 
 
-@app.route('/admin/settings/preview', methods=['POST'])
+@admin_bp.route('/settings/preview', methods=['POST'])
 @admin_required
+@track_job('preview_excel')
 def preview_excel():
     """Preview Excel file contents before importing"""
+    import pandas as pd
+
     if 'excel_file' not in request.files:
         return jsonify({'error': 'No file selected'}), 400
 
@@ -1119,6 +4425,7 @@ def preview_excel():
         df = df[df['Number'].notna()]
 
         total_rows = len(df)
+        count_job_rows(total_rows)
         active_count = len(df[df['Active in Target Month?'].str.upper() == 'YES']) if 'Active in Target Month?' in df.columns else 0
 
         sample_cols = ['Number', 'Customer Name', 'Address', 'Active in Target Month?']
@@ -1139,10 +4446,13 @@ def preview_excel():
         return jsonify({'error': str(e)}), 400
 
 
-@app.route('/admin/settings/backup', methods=['POST'])
+@admin_bp.route('/settings/backup', methods=['POST'])
 @admin_required
+@track_job('backup_database')
 def backup_database():
     """Create a backup of current customer data as Excel file"""
+    import pandas as pd
+
     try:
         customers = Customer.query.all()
 
@@ -1152,6 +4462,8 @@ def backup_database():
                 'Number': c.customer_number,
                 'Customer Name': c.customer_name,
                 'Address': c.address,
+                'Latitude': c.latitude,
+                'Longitude': c.longitude,
                 'Phone Number': c.phone_number,
                 'Type': c.type,
                 'Bin Size': c.bin_size,
@@ -1174,6 +4486,7 @@ def backup_database():
                 'Amount Paid': c.amount_paid
             })
 
+        count_job_rows(len(data))
         df = pd.DataFrame(data)
 
         output = BytesIO()
@@ -1193,14 +4506,66 @@ def backup_database():
 
     except Exception as e:
         flash(f'Error creating backup: {str(e)}', 'danger')
-        return redirect(url_for('settings'))
+        return redirect(url_for('admin.settings'))
 
 
 # ==================== INITIALIZATION ====================
 
-def init_database():
+# Columns added after the original schema. db.create_all() only creates
+# missing tables, so existing databases get these through ALTER TABLE.
+SCHEMA_UPGRADES = [
+    ('customer', 'change_seq', 'INTEGER NOT NULL DEFAULT 0'),
+    ('pickup', 'change_seq', 'INTEGER NOT NULL DEFAULT 0'),
+    ('customer', 'serviceable', 'BOOLEAN NOT NULL DEFAULT TRUE'),
+    ('customer', 'latitude', 'FLOAT'),
+    ('customer', 'longitude', 'FLOAT'),
+    ('customer', 'bin_litres', 'INTEGER'),
+    ('customer', 'pickup_litres', 'INTEGER'),
+    ('customer', 'recurrence', "VARCHAR(20) DEFAULT 'weekly'"),
+    ('customer', 'recurrence_weeks', 'VARCHAR(20)'),
+    ('customer', 'schedule_anchor', 'DATE'),
+    ('pickup', 'ward', 'VARCHAR(100)'),
+    ('pickup_archive', 'ward', 'VARCHAR(100)'),
+]
+
+# Run once, right after their column has been added, to fill in existing rows
+SCHEMA_BACKFILLS = {
+    ('customer', 'serviceable'): backfill_serviceable,
+    ('customer', 'pickup_litres'): backfill_bin_volumes,
+    ('customer', 'schedule_anchor'): backfill_recurrence,
+    ('pickup', 'ward'): backfill_pickup_wards,
+    ('pickup_archive', 'ward'): backfill_archived_pickup_wards,
+}
+
+
+def upgrade_schema():
+    """Add missing columns and indexes to an existing database and archive"""
+    for bind_key, metadata in db.metadatas.items():
+        engine = db.engines[bind_key]
+        inspector = db.inspect(engine)
+        quote = engine.dialect.identifier_preparer.quote
+        with engine.begin() as conn:
+            for table, column, ddl in SCHEMA_UPGRADES:
+                if table not in metadata.tables:
+                    continue
+                existing = {col['name'] for col in inspector.get_columns(table)}
+                if column not in existing:
+                    conn.execute(db.text(f'ALTER TABLE {quote(table)} ADD COLUMN {quote(column)} {ddl}'))
+                    if (table, column) in SCHEMA_BACKFILLS:
+                        SCHEMA_BACKFILLS[(table, column)](conn)
+            for table in metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+
+
+def init_database(app):
     with app.app_context():
         db.create_all()
+        upgrade_schema()
+
+        # Seed the change counter so concurrent first writers never race to create it
+        if db.session.get(ChangeCounter, 1) is None:
+            db.session.add(ChangeCounter(id=1, value=0))
         
         if not User.query.filter_by(username='admin').first():
             admin = User(username='admin', role='admin', full_name='Administrator')
@@ -1215,8 +4580,66 @@ def init_database():
         db.session.commit()
 
 
+def create_app(config=None):
+    """Build the application.
+
+    Settings come from DEFAULT_CONFIG (the environment), then
+    instance/config.py if it exists, then config. Scripts and gunicorn use
+    the module-level app built from the first two.
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.from_pyfile('config.py', silent=True)
+    app.config.update(config or {})
+    configure_databases(app.config)
+    if not app.config['SECRET_KEY']:
+        app.config['SECRET_KEY'] = instance_secret_key(app.instance_path)
+    app.config['PICKUP_LOG_DIR'] = app.config['PICKUP_LOG_DIR'] or os.path.join(app.instance_path, 'pickup_log')
+    app.config['SLOW_QUERY_LOG'] = app.config['SLOW_QUERY_LOG'] or os.path.join(app.instance_path, 'slow_queries.log')
+
+    db.init_app(app)
+    csrf.init_app(app)
+    for blueprint in (main_bp, admin_bp, collector_bp):
+        app.register_blueprint(blueprint)
+    if app.config['SESSION_BACKEND'] == 'database':
+        app.session_interface = DatabaseSessionInterface()
+    app.extensions['password_hasher'] = PasswordHasher(
+        app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_THREADS'], app.config['PASSWORD_HASH_QUEUE']
+    )
+    app.extensions['pickup_log'] = PickupWriteBehind(
+        app, app.config['PICKUP_LOG_DIR'], app.config['PICKUP_FLUSH_INTERVAL_MS'] / 1000
+    ) if app.config['PICKUP_WRITE_BEHIND'] else None
+    # Per-app caches, so apps built for different databases never share them
+    app.extensions['user_cache'] = {}
+    app.extensions['sessions_purged_at'] = 0.0
+    app.extensions['swept_day'] = None
+    app.extensions['occurrence_window'] = None
+    _apps.add(app)
+    return app
+
+
+# Every app create_app() has built and that is still alive
+_apps = weakref.WeakSet()
+
+
+def _reset_pools_after_fork():
+    # Under gunicorn --preload workers are forked from a master that has
+    # imported the app; a connection it opened must never be shared with them
+    for app in list(_apps):
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
+app = create_app()
+
+
 if __name__ == '__main__':
-    init_database()
+    init_database(app)
     # Use environment variable to control debug mode (default: False for security)
     debug_mode = os.environ.get('FLASK_DEBUG', 'false').lower() == 'true'
     host = os.environ.get('FLASK_HOST', '127.0.0.1')  # Default to localhost for security
@@ -0,0 +1,30 @@
+"""
+Move old pickup history out of the live pickup table.
+
+Pickups in whole months older than PICKUP_ARCHIVE_DAYS (default 180) are
+copied to the archive database and replaced by one summary row per
+customer per month. Safe to re-run, e.g. nightly from cron.
+
+Usage: python archive_pickups.py [days]
+"""
+import sys
+from app import app, archive_cutoff, archive_pickups, init_database
+
+
+def main():
+    if len(sys.argv) > 1:
+        app.config['PICKUP_ARCHIVE_DAYS'] = int(sys.argv[1])
+
+    init_database(app)
+    with app.app_context():
+        cutoff = archive_cutoff()
+        if cutoff is None:
+            print("Archiving is turned off (PICKUP_ARCHIVE_DAYS=0)")
+            return
+        print(f"Archiving pickups dated before {cutoff.isoformat()}...")
+        moved = archive_pickups(cutoff)
+        print(f"✓ {moved} pickups archived")
+
+
+if __name__ == '__main__':
+    main()
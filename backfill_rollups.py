@@ -0,0 +1,27 @@
+"""
+Rebuild the daily completion rollups behind the reports page.
+
+Rollups are kept current as pickups are created and completed; run this
+once after upgrading to fill in history, or after importing pickups by
+other means. Covers both live and archived pickups.
+
+Usage: python backfill_rollups.py [start_date] [end_date]   (YYYY-MM-DD, default: everything)
+"""
+import sys
+from datetime import date
+from app import app, init_database, rebuild_completion_rollups
+
+
+def main():
+    start = date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else None
+    end = date.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    init_database(app)
+    with app.app_context():
+        print(f"Rebuilding completion rollups for {start or 'the beginning'} to {end or 'today'}...")
+        rows = rebuild_completion_rollups(start, end)
+        print(f"✓ {rows} rollup rows written")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+Import/export throughput benchmark.
+
+Generates 'Service Log' workbooks laid out like master_log.xlsx (a title
+row, headers on row 2, weekday markers mixing 'X', 1 and 'yes', dates as
+real cells and as text in two formats) and times the heavy spreadsheet
+paths against them:
+
+    preview   POST /admin/settings/preview
+    replace   POST /admin/settings/upload, import_mode=replace, empty database
+    update    POST /admin/settings/upload, import_mode=update, every row already present
+    cli       import_data.py
+    export    GET /admin/customers/export
+    backup    POST /admin/settings/backup
+
+    python benchmarks/bench_import_export.py --sizes 1000 5000 20000
+
+Each operation runs in its own process so peak RSS belongs to that
+operation alone. DB write time is the time spent inside INSERT, UPDATE
+and DELETE statements.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+OPERATIONS = ['preview', 'replace', 'update', 'cli', 'export', 'backup']
+# Operations that start from the database the replace import produced
+NEEDS_CUSTOMERS = {'update', 'export', 'backup'}
+
+HEADERS = [
+    'Number', 'Customer Name', 'Address', 'Phone Number', 'Type', 'Ward', 'Bin Size', 'Bin Qty',
+    'Frequency', 'Time', 'Mon', 'Tue', 'Wed', 'Thurs', 'Fri', 'Sat', 'Sales Rep', 'Payment Type',
+    'Subscription Start', 'Subscription End', 'Active in Target Month?\n', 'Target Month Start',
+    'Target month End', 'MONTH ACQUIRED', 'Amt Paid SLL',
+]
+DAY_MARKERS = ['X', 'x', 1, 1.0, 'yes', 'Yes', '1']
+STREETS = ['Wilberforce Street', 'Krootown Road', 'Siaka Stevens Street', 'Kissy Road', 'Main Motor Road']
+
+
+def mixed_date(rng, value):
+    """The same date as a real cell or as text in either format the importers accept"""
+    style = rng.random()
+    if style < 0.6:
+        return datetime.combine(value, datetime.min.time())
+    if style < 0.8:
+        return value.strftime('%Y-%m-%d')
+    return value.strftime('%d/%m/%Y')
+
+
+def generate_workbook(path, rows, seed=0):
+    """Write a master-log style workbook with `rows` customers"""
+    from openpyxl import Workbook
+
+    rng = random.Random(seed)
+    today = date.today()
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Service Log')
+    sheet.append([None, 'CUSTOMER SERVICE MASTER LOG'])
+    sheet.append(HEADERS)
+
+    for number in range(1, rows + 1):
+        start = today - timedelta(days=rng.randint(0, 400))
+        end = start + timedelta(days=rng.choice([30, 31, 90, 365]))
+        days = [rng.choice(DAY_MARKERS) if rng.random() < 0.35 else None for _ in range(6)]
+        sheet.append([
+            number,
+            f'Customer {number}',
+            f'{rng.randint(1, 200)} {rng.choice(STREETS)}',
+            f'0{rng.randint(70, 99)}-{rng.randint(100000, 999999)}',
+            rng.choice(['Commercial', 'Domestic']),
+            rng.choice([430, 431, 432, 433, 434, 435, 440, 441]),
+            rng.choice([120, 240, 300, 1100, '240L, 50L']),
+            rng.randint(1, 3),
+            sum(1 for day in days if day is not None),
+            rng.choice(['Morning', 'Evening', None]),
+            *days,
+            rng.choice(['IB', 'Maystead', 'AK']),
+            rng.choice(['Prepaid', 'Postpaid']),
+            mixed_date(rng, start),
+            mixed_date(rng, end) if rng.random() < 0.9 else None,
+            rng.choice(['Yes', 'Yes', 'Yes', 'No', 'yes']),
+            None,
+            None,
+            rng.choice(['July', 'August', 'September', 'October']),
+            float(rng.choice([200, 400, 1200, 4200])),
+        ])
+        # Master logs carry stray rows without a customer number; every importer skips them
+        if number % 500 == 0:
+            sheet.append([None, 'Subtotal'])
+    workbook.save(path)
+
+
+def reset_peak_rss():
+    """Reset the kernel's high-water mark (Linux) so imports don't count towards the peak"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def current_rss_kb():
+    """Resident memory right now, so growth is measured from where the operation started"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        return peak_rss_kb()
+
+
+def copy_database(source, target):
+    # The backup API includes pages still sitting in the -wal file
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+
+
+def run_operation(operation, db_path, workbook):
+    """Run one operation in this process and return its measurements"""
+    from synthetic import open_database
+
+    app_module = open_database(db_path)
+    app, db = app_module.app, app_module.db
+
+    write_time = [0.0]
+
+    @db.event.listens_for(db.Engine, 'before_cursor_execute')
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info['bench_started'] = time.perf_counter()
+
+    @db.event.listens_for(db.Engine, 'after_cursor_execute')
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+            write_time[0] += time.perf_counter() - conn.info['bench_started']
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    with app.app_context():
+        customers_before = app_module.Customer.query.count()
+    reset_peak_rss()
+    rss_before = current_rss_kb()
+
+    started = time.perf_counter()
+    if operation == 'cli':
+        import import_data
+        import_data.import_customers(workbook)
+        status = 200
+    elif operation in ('preview', 'replace', 'update'):
+        with open(workbook, 'rb') as f:
+            if operation == 'preview':
+                response = client.post('/admin/settings/preview', data={'excel_file': (f, 'log.xlsx')})
+            else:
+                response = client.post('/admin/settings/upload',
+                                       data={'excel_file': (f, 'log.xlsx'), 'import_mode': operation})
+        status = response.status_code
+    elif operation == 'export':
+        status = client.get('/admin/customers/export').status_code
+    else:
+        status = client.post('/admin/settings/backup').status_code
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        customers_after = app_module.Customer.query.count()
+    return {
+        'status': status,
+        'seconds': elapsed,
+        'db_write_seconds': write_time[0],
+        'rss_before_kb': rss_before,
+        'peak_rss_kb': peak_rss_kb(),
+        'customers': max(customers_before, customers_after),
+    }
+
+
+def measure(operation, db_path, workbook):
+    """Run operation in a child process so its peak RSS is its own"""
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', operation, '--db', db_path, '--workbook', workbook],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark spreadsheet import and export throughput.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000], help='customer rows per workbook')
+    parser.add_argument('--operations', nargs='+', choices=OPERATIONS, default=OPERATIONS)
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--child', choices=OPERATIONS, help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    parser.add_argument('--workbook', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_operation(args.child, args.db, args.workbook)))
+        return
+
+    results = []
+    print(f'{"rows":>7}  {"operation":<9}{"seconds":>9}{"rows/s":>10}{"db write s":>12}{"peak RSS MB":>13}{"+RSS MB":>9}')
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp(prefix='dortibox-bench-')
+        try:
+            workbook = os.path.join(workdir, f'service_log_{size}.xlsx')
+            generate_workbook(workbook, size)
+            populated = os.path.join(workdir, 'populated.db')
+
+            # The replace import builds the database the update, export and backup runs start from
+            operations = list(args.operations)
+            if NEEDS_CUSTOMERS & set(operations) and 'replace' not in operations:
+                measure('replace', populated, workbook)
+            for operation in sorted(operations, key=lambda op: op != 'replace'):
+                db_path = os.path.join(workdir, f'{operation}.db')
+                if operation == 'replace':
+                    db_path = populated
+                elif operation in NEEDS_CUSTOMERS:
+                    copy_database(populated, db_path)
+                result = measure(operation, db_path, workbook)
+                if result['status'] >= 400:
+                    raise SystemExit(f'{operation} at {size} rows returned {result["status"]}')
+
+                result.update(rows=size, operation=operation, rows_per_second=size / result['seconds'])
+                results.append(result)
+                peak = result['peak_rss_kb']
+                growth = peak - result['rss_before_kb'] if peak is not None else None
+                print(f'{size:>7}  {operation:<9}{result["seconds"]:>9.2f}{result["rows_per_second"]:>10.0f}'
+                      f'{result["db_write_seconds"]:>12.2f}'
+                      f'{peak / 1024 if peak else 0:>13.0f}{growth / 1024 if growth is not None else 0:>9.0f}')
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+Login storm benchmark.
+
+Starts gunicorn against a throwaway database holding --users collector
+accounts, then has every one of them log in at the same moment, as at the
+start of a shift. A login turned away with 503 because the hashing queue
+is full is retried after its Retry-After plus up to a second, as people
+retrying by hand don't all press the button at once. Meanwhile a probe keeps
+requesting /healthz, to show whether the storm starves requests that do no
+hashing. Each combination of --methods (PASSWORD_HASH_METHOD) and
+--hash-threads (PASSWORD_HASH_THREADS) gets its own server, and for each it
+reports:
+
+    logins/s       logins per second until every user was in
+    p50/p95        time from the first attempt until a user was logged in
+    refused        503 responses, each followed by a retry
+    healthz p95    latency of the probe during the storm
+
+    python benchmarks/bench_login.py --users 100 --workers 4 --threads 4 \\
+        --methods scrypt:32768:8:1 pbkdf2:sha256:600000 --hash-threads 1 2 4
+
+Stored hashes are made with the method under test, so no login rehashes.
+The clients run on the same machine as the server and take some of its CPU.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import REPO_ROOT  # noqa: E402
+
+CSRF_FIELD = re.compile(rb'name="csrf_token" value="([^"]+)"')
+PASSWORD = 'storm-password-1'
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def setup_database(db_path, users, method):
+    """Create users storm001... with PASSWORD hashed by method"""
+    from synthetic import open_database
+
+    app_module = open_database(db_path)
+    password_hash = app_module.generate_password_hash(PASSWORD, method)
+    with app_module.app.app_context():
+        for index in range(users):
+            app_module.db.session.add(app_module.User(
+                username=f'storm{index + 1:03d}', role='collector', password_hash=password_hash))
+        app_module.db.session.commit()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def start_server(db_path, args, method, hash_threads):
+    port = free_port()
+    env = dict(os.environ,
+               DATABASE_URL=f'sqlite:///{db_path}', ARCHIVE_DATABASE_URL=f'sqlite:///{db_path}-archive',
+               SECRET_KEY='bench-login', SLOW_QUERY_MS='0', PICKUP_WRITE_BEHIND='false',
+               PASSWORD_HASH_METHOD=method, PASSWORD_HASH_THREADS=str(hash_threads),
+               PASSWORD_HASH_QUEUE=str(args.hash_queue), GUNICORN_ACCESS_LOG=os.devnull)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--workers', str(args.workers),
+         '--threads', str(args.threads), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+        cwd=REPO_ROOT, env=env,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.perf_counter() + 60
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + '/healthz', timeout=1):
+                return server, base_url
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise SystemExit('gunicorn did not answer /healthz within 60s')
+
+
+def storm(base_url, users):
+    """Log every user in at once; returns (login results, seconds, healthz latencies)"""
+    start = threading.Barrier(users + 1)
+    done = threading.Event()
+
+    def log_in(index):
+        rng = random.Random(index)
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                             NoRedirect)
+        with opener.open(base_url + '/login', timeout=60) as response:
+            token = CSRF_FIELD.search(response.read()).group(1).decode()
+        body = urllib.parse.urlencode({'csrf_token': token, 'username': f'storm{index + 1:03d}',
+                                       'password': PASSWORD}).encode()
+        start.wait()
+        started = time.perf_counter()
+        refused = 0
+        while True:
+            # A successful login redirects (302); a failed one renders the form again (200)
+            try:
+                with opener.open(base_url + '/login', body, timeout=120) as response:
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+                if status == 503:
+                    refused += 1
+                    time.sleep(float(e.headers.get('Retry-After', 1)) + rng.random())
+                    continue
+            return status, time.perf_counter() - started, refused
+
+    def probe():
+        latencies = []
+        while not done.is_set():
+            started = time.perf_counter()
+            urllib.request.urlopen(base_url + '/healthz', timeout=120).read()
+            latencies.append(time.perf_counter() - started)
+            time.sleep(0.02)
+        return latencies
+
+    with ThreadPoolExecutor(users + 1) as pool:
+        futures = [pool.submit(log_in, index) for index in range(users)]
+        start.wait()
+        started = time.perf_counter()
+        probe_future = pool.submit(probe)
+        results = [future.result() for future in futures]
+        seconds = time.perf_counter() - started
+        done.set()
+        healthz = probe_future.result()
+    return results, seconds, healthz
+
+
+def measure(db_path, args, method, hash_threads):
+    server, base_url = start_server(db_path, args, method, hash_threads)
+    try:
+        results, seconds, healthz = storm(base_url, args.users)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+    latencies = [latency for _, latency, _ in results]
+    succeeded = sum(1 for status, _, _ in results if status == 302)
+    return {
+        'method': method,
+        'hash_threads': hash_threads,
+        'logins': succeeded,
+        'refused': sum(refused for _, _, refused in results),
+        'failed': len(results) - succeeded,
+        'seconds': seconds,
+        'logins_per_second': succeeded / seconds,
+        'login_p50': percentile(latencies, 0.5),
+        'login_p95': percentile(latencies, 0.95),
+        'healthz_p50': percentile(healthz, 0.5),
+        'healthz_p95': percentile(healthz, 0.95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark a burst of simultaneous logins.')
+    parser.add_argument('--users', type=int, default=100, help='users logging in at once')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--methods', nargs='+', default=['scrypt:32768:8:1', 'pbkdf2:sha256:600000'])
+    parser.add_argument('--hash-threads', nargs='+', type=int, default=[1, 2])
+    parser.add_argument('--hash-queue', type=int, default=2, help='PASSWORD_HASH_QUEUE for every run')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--setup', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.setup:
+        db_path, users, method = args.setup
+        setup_database(db_path, int(users), method)
+        return
+
+    if args.users > 999:
+        parser.error('--users is limited to 999')
+    results = []
+    print(f'{args.users} users, {args.workers} workers x {args.threads} threads, hash queue {args.hash_queue}\n')
+    print(f'{"method":<24}{"hash threads":>13}{"logins/s":>10}{"p50 ms":>9}{"p95 ms":>9}'
+          f'{"refused":>9}{"healthz p95 ms":>16}')
+    for method in args.methods:
+        for hash_threads in args.hash_threads:
+            workdir = tempfile.mkdtemp(prefix='dortibox-bench-')
+            try:
+                db_path = os.path.join(workdir, 'login.db')
+                subprocess.run([sys.executable, os.path.abspath(__file__), '--setup', db_path, str(args.users), method],
+                               cwd=REPO_ROOT, check=True)
+                run = measure(db_path, args, method, hash_threads)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            results.append(run)
+            print(f'{method:<24}{hash_threads:>13}{run["logins_per_second"]:>10.1f}{run["login_p50"] * 1000:>9.0f}'
+                  f'{run["login_p95"] * 1000:>9.0f}{run["refused"]:>9}{run["healthz_p95"] * 1000:>16.0f}')
+            if run['failed']:
+                print(f'  {run["failed"]} logins failed')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
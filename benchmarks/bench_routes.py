@@ -0,0 +1,219 @@
+"""
+Route latency benchmark.
+
+Builds a synthetic database (see synthetic.py), drives the main admin and
+collector routes through the Flask test client and reports p50/p95
+latency, SQL statements per request and peak Python memory per route.
+
+    python benchmarks/bench_routes.py --customers 10000
+    python benchmarks/bench_routes.py --customers 10000 --save-baseline
+    python benchmarks/bench_routes.py --customers 10000 --baseline benchmarks/baselines/routes.json
+
+Baselines are kept per dataset size (customers, wards, days) together
+with the settings they were recorded with. Latencies depend on the
+machine, so none are committed: record one with --save-baseline on the
+machine that runs the comparison. Without a baseline for the requested
+size the script exits with 2. With one, any route whose p95 grew by more
+than --tolerance or whose query count grew at all is reported and the
+script exits with 1.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import open_database, populate, ward_name  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'routes.json')
+
+CUSTOMER_FILTERS = [
+    ('admin_customers', ''),
+    ('admin_customers search', '?search=Market'),
+    ('admin_customers ward', f'?ward={ward_name(0)}'),
+    ('admin_customers active', '?status=active'),
+    ('admin_customers inactive', '?status=inactive'),
+    ('admin_customers expired', '?subscription=expired'),
+    ('admin_customers expiring_week', '?subscription=expiring_week'),
+    ('admin_customers expiring_month', '?subscription=expiring_month'),
+    ('admin_customers no_date', '?subscription=no_date'),
+    ('admin_customers page 5', '?page=5'),
+]
+
+
+def login(app, username, password):
+    client = app.test_client()
+    response = client.post('/login', data={'username': username, 'password': password})
+    if response.status_code != 302:
+        raise SystemExit(f'Could not log in as {username}')
+    return client
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def build_cases(app_module, admin, collector):
+    """(name, callable) pairs; each callable makes one request and returns the response"""
+    with app_module.app.app_context():
+        user = app_module.User.query.filter_by(username='collector').first()
+        pending = [
+            pickup_id for (pickup_id,) in app_module.db.session.query(app_module.Pickup.id)
+            .join(app_module.Customer)
+            .filter(app_module.Pickup.pickup_date == date.today(),
+                    app_module.Pickup.completed.is_(False),
+                    app_module.Customer.ward.in_([cw.ward for cw in user.assigned_wards]))
+        ]
+
+    def complete_next():
+        # A fresh pending pickup each time; once they run out, re-completing measures the no-op path
+        pickup_id = pending.pop() if pending else complete_next.last
+        complete_next.last = pickup_id
+        return collector.post(f'/collector/complete/{pickup_id}', json={'notes': ''})
+    complete_next.last = 0
+
+    cases = [
+        ('dashboard admin', lambda: admin.get('/dashboard')),
+        ('dashboard collector', lambda: collector.get('/dashboard')),
+    ]
+    cases += [(name, lambda query=query: admin.get('/admin/customers' + query)) for name, query in CUSTOMER_FILTERS]
+    cases += [
+        ('admin_pickups', lambda: admin.get('/admin/pickups')),
+        ('pickup_schedule week', lambda: admin.get('/admin/pickups/schedule')),
+        ('pickup_schedule month', lambda: admin.get('/admin/pickups/schedule?view=month&ward=Ward%2001')),
+        ('complete_pickup', complete_next),
+        ('export_customers', lambda: admin.get('/admin/customers/export')),
+        ('backup_database', lambda: admin.post('/admin/settings/backup')),
+    ]
+    return cases
+
+
+def run_case(app_module, call, iterations):
+    latencies = []
+    with app_module.query_budget(math.inf) as profiles:
+        call()  # warm-up, not counted
+        for _ in range(iterations):
+            started = time.perf_counter()
+            response = call()
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise SystemExit(f'{response.request.path} returned {response.status_code}')
+
+    tracemalloc.start()
+    call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'queries': max(profile.queries for profile in profiles[1:]),
+        'repeated': max(len(profile.repeated) for profile in profiles[1:]),
+        'peak_kb': round(peak / 1024),
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {before["p95_ms"]} ms -> {result["p95_ms"]} ms')
+        if result['queries'] > before['queries']:
+            regressions.append(f'{name}: queries {before["queries"]} -> {result["queries"]}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark route latency against a synthetic database.')
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--wards', type=int, default=30)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline for this scale')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 growth before flagging (0.25 = 25%%)')
+    parser.add_argument('--keep-db', action='store_true', help='leave the generated database in place')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='dortibox-bench-')
+    db_path = os.path.join(workdir, 'bench.db')
+    try:
+        app_module = open_database(db_path)
+        started = time.perf_counter()
+        counts = populate(app_module, args.customers, args.wards, args.days)
+        print(f'Generated {counts["customers"]} customers, {counts["pickups"]} pickups '
+              f'in {time.perf_counter() - started:.1f}s')
+        if date.today().weekday() == 6:
+            print('Note: today is Sunday, so collector routes are empty')
+
+        app = app_module.app
+        # Repeated statement shapes are reported in the table instead of logged per request
+        app.logger.setLevel(logging.ERROR)
+        admin = login(app, 'admin', 'admin123')
+        collector = login(app, 'collector', 'collector123')
+
+        results = {}
+        print(f'\n{"route":<32}{"p50 ms":>10}{"p95 ms":>10}{"queries":>9}{"peak KB":>10}{"N+1":>5}')
+        for name, call in build_cases(app_module, admin, collector):
+            result = results[name] = run_case(app_module, call, args.iterations)
+            print(f'{name:<32}{result["p50_ms"]:>10}{result["p95_ms"]:>10}{result["queries"]:>9}{result["peak_kb"]:>10}{result["repeated"]:>5}')
+    finally:
+        if args.keep_db:
+            print(f'\nDatabase kept at {db_path}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    scale = f'{args.customers}x{args.wards}x{args.days}'
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    if args.save_baseline:
+        baselines[scale] = {
+            'dataset': {'customers': args.customers, 'wards': args.wards, 'days': args.days},
+            'config': {
+                'iterations': args.iterations,
+                'database': 'sqlite',
+                'sqlite_pragmas': app_module.SQLITE_PRAGMAS,
+                'python': platform.python_version(),
+                'machine': platform.platform(),
+                'recorded': date.today().isoformat(),
+            },
+            'routes': results,
+        }
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f'\nSaved baseline for {args.customers} customers, {args.wards} wards, {args.days} days to {args.baseline}')
+        return
+
+    if scale not in baselines:
+        print(f'\nNo baseline for {args.customers} customers, {args.wards} wards, {args.days} days in {args.baseline}.'
+              '\nRecord one on this machine with --save-baseline, then rerun to compare.')
+        sys.exit(2)
+    print(f'\nComparing with the baseline recorded {baselines[scale]["config"]["recorded"]} '
+          f'on {baselines[scale]["config"]["machine"]}')
+    regressions = compare(results, baselines[scale]['routes'], args.tolerance)
+    if regressions:
+        print('\nRegressions against baseline:')
+        for line in regressions:
+            print(f'  {line}')
+        sys.exit(1)
+    print('\nNo regressions against baseline')
+
+
+if __name__ == '__main__':
+    main()
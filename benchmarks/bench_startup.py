@@ -0,0 +1,187 @@
+"""
+Worker startup benchmark.
+
+Measures what every process that imports app pays before serving anything:
+
+    import    time to import app in a fresh interpreter, RSS afterwards, and
+              whether pandas was loaded; plus what the first spreadsheet
+              request then pays to import pandas
+    gunicorn  seconds until a gunicorn server answers /healthz, and the
+              memory of each worker with and without --preload (Linux only)
+
+    python benchmarks/bench_startup.py --runs 5 --workers 4
+
+RSS counts shared pages in full for every worker. PSS splits them between
+the processes sharing them, and USS is what a worker alone holds, so a
+preloaded server shows up as a lower PSS and USS per worker.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import REPO_ROOT  # noqa: E402
+
+
+def memory_kb(pid):
+    """{'rss', 'pss', 'uss'} in KB for a process, from /proc/<pid>/smaps_rollup"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:', 'Private_Clean:', 'Private_Dirty:'):
+                values[parts[0][:-1]] = int(parts[1])
+    return {'rss': values['Rss'], 'pss': values['Pss'],
+            'uss': values['Private_Clean'] + values['Private_Dirty']}
+
+
+def child_pids(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def measure_import():
+    """Import app in this process and return its cost"""
+    os.environ.setdefault('SLOW_QUERY_MS', '0')
+    sys.path.insert(0, REPO_ROOT)
+    started = time.perf_counter()
+    import app  # noqa: F401
+    seconds = time.perf_counter() - started
+    result = {'seconds': seconds, 'pandas_loaded': 'pandas' in sys.modules, 'rss_kb': memory_kb('self')['rss']}
+
+    started = time.perf_counter()
+    import pandas  # noqa: F401
+    result['first_spreadsheet_seconds'] = time.perf_counter() - started
+    result['rss_with_pandas_kb'] = memory_kb('self')['rss']
+    return result
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_healthy(url, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            time.sleep(0.02)
+    return False
+
+
+def measure_gunicorn(db_path, workers, preload):
+    """Start gunicorn against db_path and return its startup time and per-worker memory"""
+    port = free_port()
+    env = dict(os.environ,
+               DATABASE_URL=f'sqlite:///{db_path}', ARCHIVE_DATABASE_URL=f'sqlite:///{db_path}-archive',
+               SLOW_QUERY_MS='0', PICKUP_WRITE_BEHIND='false',
+               GUNICORN_PRELOAD='true' if preload else 'false', GUNICORN_ACCESS_LOG=os.devnull)
+    command = [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--workers', str(workers),
+               '--threads', '1', '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+    started = time.perf_counter()
+    server = subprocess.Popen(command, cwd=REPO_ROOT, env=env)
+    try:
+        url = f'http://127.0.0.1:{port}/healthz'
+        if not wait_healthy(url, timeout=60):
+            raise SystemExit('gunicorn did not answer /healthz within 60s')
+        ready = time.perf_counter() - started
+
+        # Wait for every worker, then give each a few requests so it is warm
+        deadline = time.perf_counter() + 30
+        while len(child_pids(server.pid)) < workers and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        for _ in range(workers * 10):
+            urllib.request.urlopen(url, timeout=5).read()
+
+        worker_memory = [memory_kb(pid) for pid in child_pids(server.pid)]
+        master = memory_kb(server.pid)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+    return {
+        'preload': preload,
+        'workers': len(worker_memory),
+        'ready_seconds': ready,
+        'worker_rss_kb': statistics.mean(m['rss'] for m in worker_memory),
+        'worker_pss_kb': statistics.mean(m['pss'] for m in worker_memory),
+        'worker_uss_kb': statistics.mean(m['uss'] for m in worker_memory),
+        'total_pss_kb': master['pss'] + sum(m['pss'] for m in worker_memory),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark app import time and gunicorn worker memory.')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters to time the import in')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_import()))
+        return
+
+    imports = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child'], cwd=REPO_ROOT,
+                                check=True, capture_output=True, text=True).stdout
+        imports.append(json.loads(output.strip().splitlines()[-1]))
+    results = {
+        'import': {
+            'seconds_p50': statistics.median(run['seconds'] for run in imports),
+            'rss_kb': statistics.median(run['rss_kb'] for run in imports),
+            'pandas_loaded': any(run['pandas_loaded'] for run in imports),
+            'first_spreadsheet_seconds_p50': statistics.median(run['first_spreadsheet_seconds'] for run in imports),
+            'rss_with_pandas_kb': statistics.median(run['rss_with_pandas_kb'] for run in imports),
+        },
+        'gunicorn': [],
+    }
+    result = results['import']
+    print(f'import app        {result["seconds_p50"] * 1000:>8.0f} ms  {result["rss_kb"] / 1024:>6.1f} MB RSS  '
+          f'pandas loaded: {"yes" if result["pandas_loaded"] else "no"}')
+    print(f'first spreadsheet {result["first_spreadsheet_seconds_p50"] * 1000:>8.0f} ms  '
+          f'{result["rss_with_pandas_kb"] / 1024:>6.1f} MB RSS with pandas')
+
+    if not sys.platform.startswith('linux') or importlib.util.find_spec('gunicorn') is None:
+        print('\ngunicorn measurements need Linux and gunicorn installed; skipped')
+    else:
+        workdir = tempfile.mkdtemp(prefix='dortibox-bench-')
+        try:
+            db_path = os.path.join(workdir, 'startup.db')
+            subprocess.run([sys.executable, '-c', f'from synthetic import open_database; open_database({db_path!r})'],
+                           cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+            print(f'\n{"gunicorn":<20}{"ready s":>9}{"worker RSS MB":>15}{"worker PSS MB":>15}'
+                  f'{"worker USS MB":>15}{"total PSS MB":>14}')
+            for preload in (False, True):
+                run = measure_gunicorn(db_path, args.workers, preload)
+                results['gunicorn'].append(run)
+                label = f'{run["workers"]} workers' + (' --preload' if preload else '')
+                print(f'{label:<20}{run["ready_seconds"]:>9.2f}{run["worker_rss_kb"] / 1024:>15.1f}'
+                      f'{run["worker_pss_kb"] / 1024:>15.1f}{run["worker_uss_kb"] / 1024:>15.1f}'
+                      f'{run["total_pss_kb"] / 1024:>14.1f}')
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Query budget check.
+
+Builds a synthetic database (see synthetic.py) and requests the routes most
+prone to N+1 queries under query_budget(). Fails, and exits with 1, if any
+of them runs more SQL statements than its budget or repeats one statement
+shape more than SQL_PROFILER_REPEAT_THRESHOLD times, which is how a
+per-row query shows up. Budgets do not depend on the number of customers.
+
+    python benchmarks/check_queries.py --customers 500
+
+Each route is requested once before it is checked, so the day's pickups,
+occurrence index and expiry sweep already exist, as they do for every
+request after the first of the day.
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import open_database, populate  # noqa: E402
+
+# (name, user, path, most SQL statements allowed per request)
+ROUTES = [
+    ('dashboard admin', 'admin', '/dashboard', 5),
+    ('dashboard collector', 'collector', '/dashboard', 5),
+    ('collector route', 'collector', '/collector/route', 5),
+    ('admin_pickups', 'admin', '/admin/pickups', 3),
+    ('admin_pickups past day', 'admin', '/admin/pickups?date=2000-01-03', 4),
+]
+
+PASSWORDS = {'admin': 'admin123', 'collector': 'collector123'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the N+1-prone routes stay within their query budgets.')
+    parser.add_argument('--customers', type=int, default=500)
+    parser.add_argument('--wards', type=int, default=5)
+    parser.add_argument('--days', type=int, default=30)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='dortibox-check-')
+    failures = []
+    try:
+        app_module = open_database(os.path.join(workdir, 'check.db'))
+        populate(app_module, args.customers, args.wards, args.days)
+        if date.today().weekday() == 6:
+            print('Note: today is Sunday, so collector routes are empty')
+
+        app = app_module.app
+        # Repeated statement shapes are reported below instead of logged per request
+        app.logger.setLevel(logging.ERROR)
+        clients = {}
+        for username, password in PASSWORDS.items():
+            clients[username] = app.test_client()
+            response = clients[username].post('/login', data={'username': username, 'password': password})
+            if response.status_code != 302:
+                raise SystemExit(f'Could not log in as {username}')
+
+        for name, username, path, budget in ROUTES:
+            client = clients[username]
+            client.get(path)  # warm-up, not checked
+            try:
+                with app_module.query_budget(budget, allow_repeats=False) as profiles:
+                    response = client.get(path)
+            except AssertionError as e:
+                failures.append(f'{name}: {e}')
+                continue
+            if response.status_code != 200:
+                failures.append(f'{name}: {path} returned {response.status_code}')
+                continue
+            print(f'{name:<28}{profiles[0].queries:>3} statements (budget {budget})')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for failure in failures:
+        print(f'FAIL {failure}')
+    if failures:
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
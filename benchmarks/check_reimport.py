@@ -0,0 +1,84 @@
+"""
+Re-import check.
+
+Imports the same generated master-log workbook several times into one
+throwaway database, in one process, as an admin re-uploading the log
+would: through the replace-mode upload and through import_data.py. After
+every import it compares the customers the routes see as due on each of
+the next seven days (scheduled_filter(), backed by the occurrence index)
+with the customers the weekday flags and is_due() say are due. Fails, and
+exits with 1, if they differ after any import.
+
+    python benchmarks/check_reimport.py --rows 500
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_import_export import generate_workbook  # noqa: E402
+from synthetic import open_database  # noqa: E402
+
+
+def due_lists(app_module, days):
+    """{day: (ids from scheduled_filter(), ids from is_due())}"""
+    Customer = app_module.Customer
+    result = {}
+    for day in days:
+        day_column = app_module.get_day_column(day)
+        indexed = {row.id for row in Customer.query.filter(*app_module.scheduled_filter(day))}
+        expected = {customer.id for customer in Customer.query
+                    if day_column is not None and getattr(customer, day_column.key) == 1
+                    and app_module.is_due(customer, day)}
+        result[day] = (indexed, expected)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the due lists survive repeated imports.')
+    parser.add_argument('--rows', type=int, default=500, help='customers in the generated workbook')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='dortibox-check-')
+    failures = []
+    try:
+        workbook = os.path.join(workdir, 'master_log.xlsx')
+        generate_workbook(workbook, args.rows)
+        app_module = open_database(os.path.join(workdir, 'check.db'))
+        client = app_module.app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        days = [date.today() + timedelta(days=i) for i in range(7)]
+
+        import import_data
+        imports = [('upload', 1), ('upload', 2), ('import_data.py', 1), ('upload', 3)]
+        for name, run in imports:
+            if name == 'upload':
+                with open(workbook, 'rb') as f:
+                    response = client.post('/admin/settings/upload',
+                                           data={'excel_file': (f, 'master_log.xlsx'), 'import_mode': 'replace'})
+                if response.status_code != 302:
+                    failures.append(f'{name} #{run} returned {response.status_code}')
+            else:
+                import_data.import_customers(workbook)
+
+            with app_module.app.app_context():
+                lists = due_lists(app_module, days)
+            for day, (indexed, expected) in lists.items():
+                if indexed != expected:
+                    failures.append(f'{name} #{run}: {len(indexed)} due on {day}, expected {len(expected)}')
+            print(f'{name} #{run}: ' + ', '.join(f'{day:%a} {len(indexed)}' for day, (indexed, _) in lists.items()))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for failure in failures:
+        print(f'FAIL {failure}')
+    if failures:
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+Synthetic data generator for the benchmarks.
+
+Fills a throwaway SQLite database with customers spread over a number of
+wards, one collector per ward and a history of pickups, so routes can be
+timed at realistic sizes without touching instance/waste_collection.db.
+
+    python benchmarks/synthetic.py --customers 10000 --db /tmp/bench.db
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import date, datetime, time, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DAY_COLUMNS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday']
+BIN_SIZES = ['120L', '240L', '240L', '360L', '1100L', '240L, 50L', '300L, 50L']
+STREETS = ['Main Street', 'Church Road', 'Market Lane', 'Station Road', 'Hill View', 'River Drive', 'Park Avenue']
+INSERT_CHUNK = 20000
+
+
+def open_database(path):
+    """Point the app at a SQLite file and import it.
+
+    Must run before anything else imports app, since the database URL is
+    read at import time. The archive database sits next to it, and the
+    slow-query log and write-behind mode are switched off, so a benchmark
+    run leaves nothing in instance/.
+    """
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(path)}'
+    os.environ['ARCHIVE_DATABASE_URL'] = f'sqlite:///{os.path.abspath(path)}-archive'
+    os.environ.setdefault('SLOW_QUERY_MS', '0')
+    os.environ['PICKUP_WRITE_BEHIND'] = 'false'
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import app as app_module
+    app_module.init_database(app_module.app)
+    app_module.app.config['WTF_CSRF_ENABLED'] = False
+    return app_module
+
+
+def ward_name(index):
+    return f'Ward {index + 1:02d}'
+
+
+def make_customer(rng, number, wards, today):
+    scheduled = rng.sample(DAY_COLUMNS, rng.choice([1, 1, 2, 2, 3]))
+    start = today - timedelta(days=rng.randint(30, 900))
+
+    roll = rng.random()
+    if roll < 0.10:
+        end = None
+    elif roll < 0.25:
+        end = today - timedelta(days=rng.randint(1, 120))
+    elif roll < 0.30:
+        end = today + timedelta(days=rng.randint(0, 7))
+    elif roll < 0.40:
+        end = today + timedelta(days=rng.randint(8, 30))
+    else:
+        end = today + timedelta(days=rng.randint(31, 365))
+
+    customer = {
+        'id': number,
+        'customer_number': number,
+        'customer_name': f'Customer {number}',
+        'address': f'{rng.randint(1, 400)} {rng.choice(STREETS)}',
+        'phone_number': f'07{rng.randint(10000000, 99999999)}',
+        'type': 'Commercial' if rng.random() < 0.2 else 'Domestic',
+        'ward': ward_name(rng.randrange(wards)),
+        'bin_size': rng.choice(BIN_SIZES),
+        'bin_qty': rng.randint(1, 3),
+        'frequency': 'Weekly' if len(scheduled) == 1 else f'{len(scheduled)}x Weekly',
+        'time': rng.choice(['Morning', 'Afternoon', None]),
+        'sales_rep': rng.choice(['Ama', 'Kofi', 'Esi', 'Yaw']),
+        'payment_type': rng.choice(['Prepaid', 'Postpaid']),
+        'subscription_start': start,
+        'subscription_end': end,
+        'active': rng.choices(['Yes', 'yes', 'No'], weights=[85, 5, 10])[0],
+        'month_acquired': start.strftime('%B %Y'),
+        'amount_paid': float(rng.choice([50, 80, 120, 200])),
+        'change_seq': 0,
+    }
+    # Customers sit within about 1.5 km of their ward's centre; a few have no coordinates yet
+    ward_index = int(customer['ward'].split()[-1]) - 1
+    if rng.random() < 0.9:
+        customer['latitude'] = 8.40 + (ward_index // 6) * 0.03 + rng.uniform(-0.0135, 0.0135)
+        customer['longitude'] = -13.30 + (ward_index % 6) * 0.03 + rng.uniform(-0.0135, 0.0135)
+    else:
+        customer['latitude'] = customer['longitude'] = None
+    # Core inserts skip the ORM hook that normally keeps this current
+    customer['serviceable'] = customer['active'] in ('Yes', 'yes') and (end is None or end >= today)
+    for column in DAY_COLUMNS:
+        customer[column] = 1 if column in scheduled else 0
+    return customer
+
+
+def insert_rows(app_module, table, rows):
+    db = app_module.db
+    for i in range(0, len(rows), INSERT_CHUNK):
+        db.session.execute(table.insert(), rows[i:i + INSERT_CHUNK])
+
+
+def populate(app_module, customers=1000, wards=30, days=365, seed=0):
+    """Fill the database with synthetic customers, collectors and pickup history.
+
+    Pickups cover the `days` days up to and including today. Past pickups
+    are mostly completed; today's are left pending. Returns a dict of row
+    counts.
+    """
+    db = app_module.db
+    Customer, Pickup, User, CollectorWard = (
+        app_module.Customer, app_module.Pickup, app_module.User, app_module.CollectorWard
+    )
+    rng = random.Random(seed)
+    today = date.today()
+
+    with app_module.app.app_context():
+        customer_rows = [make_customer(rng, n, wards, today) for n in range(1, customers + 1)]
+        for customer in customer_rows:
+            customer['bin_litres'], customer['pickup_litres'] = app_module.bin_volumes(
+                customer['bin_size'], customer['bin_qty']
+            )
+        insert_rows(app_module, Customer.__table__, customer_rows)
+
+        # One collector per ward; the default collector account works the first ward
+        password_hash = app_module.generate_password_hash('collector123')
+        collector_names = {}
+        for index in range(wards):
+            username = f'collector{index + 1:02d}'
+            collector = User(username=username, role='collector', full_name=f'Collector {index + 1:02d}',
+                             password_hash=password_hash)
+            db.session.add(collector)
+            db.session.flush()
+            db.session.add(CollectorWard(user_id=collector.id, ward=ward_name(index)))
+            collector_names[ward_name(index)] = collector.full_name
+        default_collector = User.query.filter_by(username='collector').first()
+        db.session.add(CollectorWard(user_id=default_collector.id, ward=ward_name(0)))
+        db.session.commit()
+
+        schedule = {column: [] for column in DAY_COLUMNS}
+        for customer in customer_rows:
+            if customer['active'] in ('Yes', 'yes'):
+                for column in DAY_COLUMNS:
+                    if customer[column]:
+                        schedule[column].append(customer)
+
+        pickup_count = 0
+        for offset in range(days - 1, -1, -1):
+            day = today - timedelta(days=offset)
+            column = day.strftime('%A').lower()
+            if column not in schedule:
+                continue
+            rows = []
+            for customer in schedule[column]:
+                end = customer['subscription_end']
+                if day < customer['subscription_start'] or (end is not None and end < day):
+                    continue
+                completed = offset > 0 and rng.random() < 0.9
+                completed_at = None
+                if completed:
+                    completed_at = datetime.combine(day, time(7)) + timedelta(minutes=rng.randint(0, 480))
+                rows.append({
+                    'customer_id': customer['id'],
+                    'ward': customer['ward'],
+                    'pickup_date': day,
+                    'completed': completed,
+                    'completed_at': completed_at,
+                    'completed_by': collector_names[customer['ward']] if completed else None,
+                    'notes': 'Bin overflowing' if completed and rng.random() < 0.02 else None,
+                    'change_seq': 0,
+                })
+            insert_rows(app_module, Pickup.__table__, rows)
+            db.session.commit()
+            pickup_count += len(rows)
+
+        # Pickups were inserted directly, so the report rollups are built in one pass
+        app_module.rebuild_completion_rollups()
+
+    return {'customers': customers, 'wards': wards, 'collectors': wards, 'pickups': pickup_count}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fill a SQLite database with synthetic customers and pickups.')
+    parser.add_argument('--db', required=True, help='SQLite file to create (must not exist)')
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--wards', type=int, default=30)
+    parser.add_argument('--days', type=int, default=365, help='days of pickup history, ending today')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        parser.error(f'{args.db} already exists')
+    app_module = open_database(args.db)
+    counts = populate(app_module, args.customers, args.wards, args.days, args.seed)
+    print(', '.join(f'{value} {name}' for name, value in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
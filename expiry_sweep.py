@@ -0,0 +1,22 @@
+"""
+Take customers whose subscription has lapsed out of service.
+
+Customers with a subscription end date before today are marked as not
+serviceable and each change is logged for renewal follow-up. The app runs
+this on the first route request of the day anyway; scheduling it just after
+midnight keeps that first request fast. Safe to re-run.
+
+Usage: python expiry_sweep.py
+"""
+from app import app, expiry_sweep, init_database
+
+
+def main():
+    init_database(app)
+    with app.app_context():
+        lapsed = expiry_sweep()
+        print(f"✓ {lapsed} customers taken out of service")
+
+
+if __name__ == '__main__':
+    main()
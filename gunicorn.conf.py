@@ -0,0 +1,42 @@
+"""
+gunicorn settings for Dortibox. From the project directory, run:
+
+    gunicorn
+
+Each setting below can be changed through the environment variable next to
+it, or on the command line (gunicorn --workers 8). Application settings,
+including SECRET_KEY and DATABASE_URL, go in instance/config.py or the
+environment; see create_app() in app.py.
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+
+wsgi_app = 'app:app'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# workers x threads requests are served at once. Each worker has its own
+# connection pool, so keep DB_POOL_SIZE at least equal to threads.
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Spreadsheet imports of a large master log can take a minute or more
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Import the app once in the master; workers share its memory copy-on-write
+# and reset the database connections they inherit (see create_app())
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+access_log_format = '%(h)s %(p)s "%(r)s" %(s)s %(b)s %(M)sms'
+
+
+def on_starting(server):
+    # Create or upgrade the schema once, before any worker serves a request.
+    # This runs in a child interpreter so that, without preload_app, the master
+    # never imports app and a HUP still reloads the code in new workers.
+    subprocess.run([sys.executable, '-c', 'from app import app, init_database; init_database(app)'],
+                   cwd=server.cfg.chdir, check=True)
@@ -3,9 +3,9 @@ Import customer data from Excel file into the database
 """
 import sys
 import os
-from datetime import datetime
+from datetime import date, datetime
 import pandas as pd
-from app import app, db, Customer
+from app import app, db, Customer, Pickup, sheet_coordinates, clear_occurrences, rebuild_completion_rollups
 
 def import_customers(excel_file):
     """Import customers from Excel file"""
@@ -26,8 +26,11 @@ def import_customers(excel_file):
         
         # Clear existing customers
         print("Clearing existing customer data...")
+        Pickup.query.delete()
+        clear_occurrences()
         Customer.query.delete()
         db.session.commit()
+        rebuild_completion_rollups(date.today(), date.today())
         
         # Import each customer
         print("Importing customers...")
@@ -80,7 +83,8 @@ def import_customers(excel_file):
                     subscription_end=sub_end,
                     active=str(row['Active in Target Month?']) if pd.notna(row['Active in Target Month?']) else 'No',
                     month_acquired=str(row['MONTH ACQUIRED']) if pd.notna(row['MONTH ACQUIRED']) else None,
-                    amount_paid=float(row['Amt Paid SLL']) if pd.notna(row['Amt Paid SLL']) else None
+                    amount_paid=float(row['Amt Paid SLL']) if pd.notna(row['Amt Paid SLL']) else None,
+                    **sheet_coordinates(row)
                 )
                 
                 db.session.add(customer)
@@ -5,9 +5,9 @@ Run this to replace the existing data with correct data
 
 import sys
 import os
-from datetime import datetime
+from datetime import date, datetime
 import pandas as pd
-from app import app, db, Customer
+from app import app, db, Customer, Pickup, clear_occurrences, rebuild_completion_rollups
 
 def reimport_customers(excel_file):
     """Re-import customers from the correct Excel file"""
@@ -103,9 +103,12 @@ def reimport_customers(excel_file):
             
             # Clear existing customers
             print("\nDeleting existing customer data...")
+            Pickup.query.delete()
+            clear_occurrences()
             deleted = Customer.query.delete()
             print(f"Deleted {deleted} existing customers")
             db.session.commit()
+            rebuild_completion_rollups(date.today(), date.today())
             
             # Import each customer
             print("\nImporting new customer data...")